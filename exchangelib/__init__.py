@@ -1,9 +1,11 @@
 # Add noqa on top-level convenience imports
 from __future__ import unicode_literals
 
+import sys
+
 from .account import Account
 from .attachments import FileAttachment, ItemAttachment
-from .autodiscover import discover
+from .autodiscover import discover, discover_many
 from .configuration import Configuration
 from .credentials import DELEGATE, IMPERSONATION, Credentials, ServiceAccount
 from .ewsdatetime import EWSDate, EWSDateTime, EWSTimeZone, UTC, UTC_NOW
@@ -23,7 +25,7 @@ __all__ = [
     '__version__',
     'Account',
     'FileAttachment', 'ItemAttachment',
-    'discover',
+    'discover', 'discover_many',
     'Configuration',
     'DELEGATE', 'IMPERSONATION', 'Credentials', 'ServiceAccount',
     'EWSDate', 'EWSDateTime', 'EWSTimeZone', 'UTC', 'UTC_NOW',
@@ -38,6 +40,11 @@ __all__ = [
     'Build', 'Version',
 ]
 
+if sys.version_info >= (3, 6):
+    # Async support uses syntax that is not available in older Python versions
+    from .aio import AsyncAccount  # noqa
+    __all__.append('AsyncAccount')
+
 
 def close_connections():
     from .autodiscover import close_connections as close_autodiscover_connections
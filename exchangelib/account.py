@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 
 from locale import getlocale
 from logging import getLogger
+import time
 
 from cached_property import threaded_cached_property
 from future.utils import python_2_unicode_compatible
@@ -25,13 +26,15 @@ from .items import Item, BulkCreateResult, HARD_DELETE, \
     DELETE_TYPE_CHOICES, MESSAGE_DISPOSITION_CHOICES, CONFLICT_RESOLUTION_CHOICES, AFFECTED_TASK_OCCURRENCES_CHOICES, \
     SEND_MEETING_INVITATIONS_CHOICES, SEND_MEETING_INVITATIONS_AND_CANCELLATIONS_CHOICES, \
     SEND_MEETING_CANCELLATIONS_CHOICES, ID_ONLY
-from .properties import Mailbox
+from .properties import Mailbox, StatusEvent
 from .protocol import Protocol
 from .queryset import QuerySet
 from .services import ExportItems, UploadItems, GetItem, CreateItem, UpdateItem, DeleteItem, MoveItem, SendItem, \
-    CopyItem, GetUserOofSettings, SetUserOofSettings
+    CopyItem, GetUserOofSettings, SetUserOofSettings, Subscribe, SubscribeToPull, SubscribeToStreaming, Unsubscribe, \
+    GetEvents, GetStreamingEvents
 from .settings import OofSettings
-from .util import get_domain, peek
+from .util import get_domain, peek, CONNECTION_ERRORS
+from .version import EXCHANGE_2010_SP1
 
 log = getLogger(__name__)
 
@@ -468,6 +471,18 @@ class Account(object):
 
         :return: a list of either True or exception instances, in the same order as the input
         """
+        return list(self._consume_item_service(
+            service_cls=DeleteItem, items=ids, chunk_size=chunk_size, kwargs=self._get_delete_kwargs(
+                delete_type=delete_type,
+                send_meeting_cancellations=send_meeting_cancellations,
+                affected_task_occurrences=affected_task_occurrences,
+                suppress_read_receipts=suppress_read_receipts,
+            )
+        ))
+
+    def _get_delete_kwargs(self, delete_type=HARD_DELETE, send_meeting_cancellations=SEND_TO_NONE,
+                           affected_task_occurrences=ALL_OCCURRENCIES, suppress_read_receipts=True):
+        # Validates the arguments to bulk_delete() and returns them as kwargs for the DeleteItem service
         if delete_type not in DELETE_TYPE_CHOICES:
             raise ValueError("'delete_type' %s must be one of %s" % (
                 delete_type, DELETE_TYPE_CHOICES
@@ -489,13 +504,11 @@ class Account(object):
             send_meeting_cancellations,
             affected_task_occurrences,
         )
-        return list(
-            self._consume_item_service(service_cls=DeleteItem, items=ids, chunk_size=chunk_size, kwargs=dict(
-                delete_type=delete_type,
-                send_meeting_cancellations=send_meeting_cancellations,
-                affected_task_occurrences=affected_task_occurrences,
-                suppress_read_receipts=suppress_read_receipts,
-            ))
+        return dict(
+            delete_type=delete_type,
+            send_meeting_cancellations=send_meeting_cancellations,
+            affected_task_occurrences=affected_task_occurrences,
+            suppress_read_receipts=suppress_read_receipts,
         )
 
     def bulk_send(self, ids, save_copy=True, copy_to_folder=None, chunk_size=None):
@@ -552,6 +565,20 @@ class Account(object):
             ))
         )
 
+    def _get_fetch_fields(self, folder, only_fields):
+        # Returns the folder used for validating 'only_fields', and the normalized set of fields to fetch
+        validation_folder = folder or Folder(root=self.root)  # Default to a folder type that supports all item types
+        if only_fields is None:
+            # We didn't restrict list of field paths. Get all fields from the server, including extended properties.
+            additional_fields = {
+                FieldPath(field=f) for f in validation_folder.allowed_item_fields(version=self.version)
+            }
+        else:
+            for field in only_fields:
+                validation_folder.validate_item_field(field=field)
+            additional_fields = validation_folder.normalize_fields(fields=only_fields)
+        return validation_folder, additional_fields
+
     def fetch(self, ids, folder=None, only_fields=None, chunk_size=None):
         """ Fetch items by ID
 
@@ -561,19 +588,10 @@ class Account(object):
         :param chunk_size: The number of items to send to the server in a single request
         :return: A generator of Item objects, in the same order as the input
         """
-        validation_folder = folder or Folder(root=self.root)  # Default to a folder type that supports all item types
         # 'ids' could be an unevaluated QuerySet, e.g. if we ended up here via `fetch(ids=some_folder.filter(...))`. In
         # that case, we want to use its iterator. Otherwise, peek() will start a count() which is wasteful because we
         # need the item IDs immediately afterwards. iterator() will only do the bare minimum.
-        if only_fields is None:
-            # We didn't restrict list of field paths. Get all fields from the server, including extended properties.
-            additional_fields = {
-                FieldPath(field=f) for f in validation_folder.allowed_item_fields(version=self.version)
-            }
-        else:
-            for field in only_fields:
-                validation_folder.validate_item_field(field=field)
-            additional_fields = validation_folder.normalize_fields(fields=only_fields)
+        validation_folder, additional_fields = self._get_fetch_fields(folder=folder, only_fields=only_fields)
         # Always use IdOnly here, because AllProperties doesn't actually get *all* properties
         for i in self._consume_item_service(service_cls=GetItem, items=ids, chunk_size=chunk_size, kwargs=dict(
                 additional_fields=additional_fields,
@@ -585,6 +603,90 @@ class Account(object):
                 item = validation_folder.item_model_from_tag(i.tag).from_xml(elem=i, account=self)
                 yield item
 
+    def subscribe(self, folders=None, event_types=None, connection_timeout=30, poll_interval=60):
+        """ Yield events in the given folders as they happen. Uses a streaming subscription on Exchange 2010 SP1 and
+        later. Older servers get a pull subscription that is polled every 'poll_interval' seconds. The subscription is
+        removed when the generator is closed.
+
+        :param folders: an iterable of Folder objects to watch. Default to all folders in the mailbox
+        :param event_types: a list of values from Subscribe.EVENT_TYPES. Default to all event types
+        :param connection_timeout: the number of minutes before the server closes a streaming connection. We reconnect
+               automatically
+        :param poll_interval: the number of seconds between requests for events on a pull subscription
+        :return: A never-ending generator of Event objects
+        """
+        streaming = self.version.build >= EXCHANGE_2010_SP1
+        if event_types is None:
+            # FreeBusyChangedEvent is not supported on servers that don't support streaming subscriptions
+            event_types = [t for t in Subscribe.EVENT_TYPES if streaming or t != 'FreeBusyChangedEvent']
+        for event_type in event_types:
+            if event_type not in Subscribe.EVENT_TYPES:
+                raise ValueError("'event_types' value %r must be one of %s" % (event_type, Subscribe.EVENT_TYPES))
+        folders = list(folders) if folders else []
+        if streaming:
+            events = self._streaming_events(folders=folders, event_types=event_types,
+                                            connection_timeout=connection_timeout)
+        else:
+            events = self._pull_events(folders=folders, event_types=event_types, poll_interval=poll_interval)
+        try:
+            for event in events:
+                yield event
+        finally:
+            # Remove the subscription right away when we are closed
+            events.close()
+
+    def _streaming_events(self, folders, event_types, connection_timeout):
+        subscription_id, _ = SubscribeToStreaming(account=self).call(folders=folders, event_types=event_types)
+        try:
+            while True:
+                # The server closes the connection after 'connection_timeout' minutes. Events that happen while we
+                # reconnect are kept on the server until we reconnect.
+                try:
+                    for notification in GetStreamingEvents(account=self).call(
+                            subscription_ids=[subscription_id],
+                            connection_timeout=connection_timeout,
+                    ):
+                        if isinstance(notification, Exception):
+                            raise notification
+                        for event in notification.events:
+                            yield event
+                except CONNECTION_ERRORS as e:
+                    log.debug('Streaming connection for subscription %s was interrupted (%s). Reconnecting',
+                              subscription_id, e)
+        finally:
+            self._unsubscribe(subscription_id=subscription_id)
+
+    def _pull_events(self, folders, event_types, poll_interval):
+        # The subscription expires if we don't ask for events within 'timeout' minutes
+        timeout = int(poll_interval / 60) + 2
+        subscription_id, watermark = SubscribeToPull(account=self).call(
+            folders=folders, event_types=event_types, watermark=None, timeout=timeout,
+        )
+        try:
+            while True:
+                more_events = False
+                for notification in GetEvents(account=self).call(subscription_id=subscription_id, watermark=watermark):
+                    if isinstance(notification, Exception):
+                        raise notification
+                    for event in notification.events:
+                        watermark = event.watermark
+                        if isinstance(event, StatusEvent):
+                            # The server sends a status event when there are no new events
+                            continue
+                        yield event
+                    more_events = more_events or notification.more_events
+                if not more_events:
+                    time.sleep(poll_interval)
+        finally:
+            self._unsubscribe(subscription_id=subscription_id)
+
+    def _unsubscribe(self, subscription_id):
+        # Don't let errors here hide any exception that made us stop listening for events
+        try:
+            Unsubscribe(account=self).call(subscription_id=subscription_id)
+        except Exception as e:
+            log.warning('Could not remove subscription %s: %s', subscription_id, e)
+
     def __str__(self):
         txt = '%s' % self.primary_smtp_address
         if self.fullname:
@@ -0,0 +1,654 @@
+# coding=utf-8
+"""
+Asyncio support for exchangelib. Requires Python 3.6 or later.
+
+The async layer shares endpoint, credentials, auth type and server version with the threaded Protocol, and re-uses the
+payload generation and response parsing of the services in services.py. Only the transport differs: requests are sent
+on coroutine-based sessions, and retries and back off are scheduled on the event loop instead of blocking a thread.
+
+If aiohttp is installed and the protocol uses basic auth or no auth, requests are sent natively with aiohttp. aiohttp
+does not support connection-bound authentication methods like NTLM, so for other auth types, the blocking 'requests'
+session is run in the default executor of the event loop. The same happens if the protocol uses a custom HTTP adapter,
+e.g. NoVerifyHTTPAdapter, since aiohttp can't use it.
+
+Example:
+
+    account = AsyncAccount(...)
+    async for item in account.inbox.filter(subject__startswith='Foo'):
+        print(item.subject)
+"""
+from __future__ import unicode_literals
+
+import asyncio
+from collections import deque
+import datetime
+import functools
+import logging
+import os
+import ssl
+from threading import Lock
+
+import requests.adapters
+import requests.sessions
+import requests.utils
+
+from .account import Account
+from .errors import ErrorServerBusy, RateLimitError, RedirectError, UnauthorizedError
+from .folders import Folder, SHALLOW
+from .items import Item, ID_ONLY
+from .queryset import QuerySet
+from .services import FindItem, GetItem, DeleteItem, MoveItem, CopyItem
+from .transport import wrap, extra_headers, BASIC, NOAUTH, DEFAULT_HEADERS
+from .util import chunkify, peek, is_xml, time_func, DummyResponse, POST_LOG_MSG, CONNECTION_ERRORS, \
+    _may_retry_on_error, _redirect_or_fail, _raise_response_errors
+
+try:
+    import aiohttp
+except ImportError:
+    # aiohttp is optional
+    aiohttp = None
+
+log = logging.getLogger(__name__)
+
+ASYNC_CONNECTION_ERRORS = CONNECTION_ERRORS + (asyncio.TimeoutError,)
+if aiohttp is not None:
+    ASYNC_CONNECTION_ERRORS += (aiohttp.ClientError,)
+
+
+class AsyncResponse(DummyResponse):
+    # A fully read response. Has the attributes that post_ratelimited() and the services expect from a response
+    def __init__(self, url, status_code, headers, request_headers, content):
+        super(AsyncResponse, self).__init__(url=url, headers=headers, request_headers=request_headers, content=content)
+        self.status_code = status_code
+
+
+class ExecutorSession(object):
+    """Runs a blocking 'requests' session in the default executor of the event loop"""
+    def __init__(self, protocol):
+        self._session = protocol.create_session()
+        self.session_id = self._session.session_id
+        self.auth = self._session.auth
+
+    async def post(self, url, headers, data, timeout):
+        return await asyncio.get_event_loop().run_in_executor(None, functools.partial(
+            self._session.post, url=url, headers=headers, data=data, allow_redirects=False, timeout=timeout
+        ))
+
+    def close_nowait(self):
+        # The session isn't bound to an event loop, so it can be closed from anywhere
+        self._session.close()
+
+    async def close(self):
+        self.close_nowait()
+
+
+class AiohttpSession(object):
+    """A native asyncio session. Only supports basic auth and no auth"""
+    def __init__(self, protocol):
+        self.session_id = sum(map(ord, str(os.urandom(100))))  # Used for debugging messages in services
+        if protocol.auth_type == BASIC:
+            self.auth = aiohttp.BasicAuth(login=protocol.credentials.username, password=protocol.credentials.password)
+        else:
+            self.auth = None
+        # Use the same proxies as 'requests', i.e. from the environment
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=protocol.CONNECTIONS_PER_SESSION,
+                                           ssl=self.get_ssl_context(protocol)),
+            auth=self.auth,
+            headers=DEFAULT_HEADERS.copy(),
+            trust_env=True,
+        )
+
+    @staticmethod
+    def get_ssl_context(protocol):
+        # Use the same CA certificates as 'requests', including a CA bundle set in REQUESTS_CA_BUNDLE
+        verify = requests.sessions.Session().merge_environment_settings(
+            url=protocol.service_endpoint, proxies={}, stream=None, verify=None, cert=None
+        )['verify']
+        if verify is True:
+            verify = requests.utils.DEFAULT_CA_BUNDLE_PATH
+        if os.path.isdir(verify):
+            return ssl.create_default_context(capath=verify)
+        return ssl.create_default_context(cafile=verify)
+
+    async def post(self, url, headers, data, timeout):
+        async with self._session.post(url, headers=headers, data=data, allow_redirects=False,
+                                      timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+            content = await r.read()
+            return AsyncResponse(url=str(r.url), status_code=r.status, headers=r.headers,
+                                 request_headers=r.request_info.headers, content=content)
+
+    async def close(self):
+        await self._session.close()
+
+
+class AsyncProtocol(object):
+    """The async counterpart of a Protocol. Sessions are created lazily, up to the session pool size of the wrapped
+    Protocol. Use AsyncProtocol.from_protocol() to get the shared instance for a Protocol.
+    """
+    _async_protocol_lock = Lock()
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self._session_pool = None
+        self._session_pool_loop = None
+        self._session_count = 0
+
+    @classmethod
+    def from_protocol(cls, protocol):
+        # Share async sessions between accounts in the same way that Protocol instances are shared. The instance is
+        # stored on the protocol, so it doesn't keep the protocol alive after the protocol cache has evicted it.
+        with cls._async_protocol_lock:
+            if protocol._async_protocol is None:
+                protocol._async_protocol = cls(protocol)
+            return protocol._async_protocol
+
+    @property
+    def credentials(self):
+        return self.protocol.credentials
+
+    @property
+    def service_endpoint(self):
+        return self.protocol.service_endpoint
+
+    @property
+    def server(self):
+        return self.protocol.server
+
+    @property
+    def TIMEOUT(self):
+        return self.protocol.TIMEOUT
+
+    @property
+    def THROTTLING_REGISTRY(self):
+        return self.protocol.THROTTLING_REGISTRY
+
+    @property
+    def retry_policy(self):
+        return self.protocol.retry_policy
+
+    def get_rate_limiter(self):
+        return self.protocol.get_rate_limiter()
+
+    @property
+    def session_pool_size(self):
+        # The threaded protocol owns the pool size, so throttling seen by either layer affects both
+        return self.protocol.session_pool_size
+
+    @property
+    def supports_aiohttp(self):
+        # aiohttp only supports basic auth and no auth. It also can't use a custom HTTP adapter, so we would silently
+        # ignore e.g. the TLS settings of the adapter.
+        return aiohttp is not None and self.protocol.auth_type in (BASIC, NOAUTH) \
+            and self.protocol.HTTP_ADAPTER_CLS is requests.adapters.HTTPAdapter
+
+    def _get_session_pool(self):
+        # asyncio queues are bound to an event loop. Start over if we're called from a new loop.
+        loop = asyncio.get_event_loop()
+        if self._session_pool is None or self._session_pool_loop is not loop:
+            if self._session_pool is not None:
+                self._close_stale_sessions()
+            self._session_pool = asyncio.LifoQueue()
+            self._session_pool_loop = loop
+            self._session_count = 0
+        return self._session_pool
+
+    def _close_stale_sessions(self):
+        # Closes the pooled sessions of the previous event loop. aiohttp sessions can only be closed on the event loop
+        # they were created on, so we refuse to switch loops if any are left. Use close() before leaving an event loop.
+        stale_sessions = []
+        while not self._session_pool.empty():
+            stale_sessions.append(self._session_pool.get_nowait())
+        if any(isinstance(session, AiohttpSession) for session in stale_sessions):
+            for session in stale_sessions:
+                self._session_pool.put_nowait(session)
+            raise RuntimeError('%r has open aiohttp sessions on another event loop. Close them with close() first'
+                               % self)
+        for session in stale_sessions:
+            log.debug('Server %s: Closing async session %s of previous event loop', self.server, session.session_id)
+            session.close_nowait()
+
+    def create_session(self):
+        if self.supports_aiohttp:
+            session = AiohttpSession(protocol=self.protocol)
+        else:
+            session = ExecutorSession(protocol=self.protocol)
+        log.debug('Server %s: Created async session %s', self.server, session.session_id)
+        return session
+
+    async def get_session(self):
+        session_pool = self._get_session_pool()
+        if session_pool.empty() and self._session_count < self.session_pool_size:
+            self._session_count += 1
+            return self.create_session()
+        log.debug('Server %s: Waiting for async session', self.server)
+        session = await session_pool.get()
+        log.debug('Server %s: Got async session %s', self.server, session.session_id)
+        return session
+
+    async def release_session(self, session):
+        if self._session_count > self.session_pool_size:
+            # The pool size was decreased while the session was checked out
+            log.debug('Server %s: Closing surplus async session %s', self.server, session.session_id)
+            await self.retire_session(session)
+            return
+        log.debug('Server %s: Releasing async session %s', self.server, session.session_id)
+        self._get_session_pool().put_nowait(session)
+
+    async def retire_session(self, session):
+        # The session is useless. Close it completely and place a fresh session in the pool, unless the pool size was
+        # decreased in the meantime.
+        log.debug('Server %s: Retiring async session %s', self.server, session.session_id)
+        self._session_count -= 1
+        await session.close()
+        if self._session_count < self.session_pool_size:
+            self._session_count += 1
+            self._get_session_pool().put_nowait(self.create_session())
+
+    async def renew_session(self, session):
+        log.debug('Server %s: Renewing async session %s', self.server, session.session_id)
+        await session.close()
+        return self.create_session()
+
+    async def close(self):
+        session_pool = self._get_session_pool()
+        while not session_pool.empty():
+            self._session_count -= 1
+            await session_pool.get_nowait().close()
+
+    def __repr__(self):
+        return self.__class__.__name__ + repr((self.protocol,))
+
+
+async def _back_off_if_needed(back_off_until):
+    if back_off_until:
+        sleep_secs = (back_off_until - datetime.datetime.now()).total_seconds()
+        # The back off value may have expired within the last few milliseconds
+        if sleep_secs > 0:
+            log.warning('Server requested back off until %s. Sleeping %s seconds', back_off_until, sleep_secs)
+            await asyncio.sleep(sleep_secs)
+
+
+async def _acquire_rate_limiter(rate_limiter):
+    # Like RateLimiter.acquire(), but without blocking the event loop. The rate limiter may be shared with threads, so
+    # we poll for a free concurrency slot instead of waiting on its condition.
+    while True:
+        delay = rate_limiter.try_acquire()
+        if delay is not None:
+            break
+        await asyncio.sleep(rate_limiter.POLL_INTERVAL)
+    if delay:
+        log.debug('Rate limit reached. Sleeping %.2f seconds', delay)
+        await asyncio.sleep(delay)
+
+
+async def _acquire_throttling_slot(throttling_registry, protocol):
+    # Like ThrottlingRegistry.acquire(), but without blocking the event loop
+    while True:
+        res = throttling_registry.try_acquire(protocol)
+        if res is not None:
+            break
+        await asyncio.sleep(throttling_registry.POLL_INTERVAL)
+    slot, delay = res
+    if delay:
+        log.warning('Another process was asked to back off. Sleeping %s seconds', delay)
+        await asyncio.sleep(delay)
+    return slot
+
+
+async def post_ratelimited(protocol, session, url, headers, data, allow_redirects=False):
+    """
+    The async version of util.post_ratelimited(), with the same retry and back off semantics. 'protocol' must be an
+    AsyncProtocol. Streaming is not supported.
+    """
+    wait = 0  # seconds
+    total_wait = 0
+    retry = 0
+    redirects = 0
+    log_vals = dict(
+        retry=retry,
+        wait=wait,
+        timeout=protocol.TIMEOUT,
+        session_id=session.session_id,
+        thread_id=None,
+        auth=session.auth,
+        url=url,
+        adapter=session.__class__.__name__,
+        allow_redirects=allow_redirects,
+        stream=False,
+        response_time=None,
+        status_code=None,
+        request_headers=headers,
+        response_headers=None,
+        xml_request=data,
+        xml_response=None,
+    )
+    rate_limiter = protocol.get_rate_limiter()
+    throttling_registry = protocol.THROTTLING_REGISTRY
+    started = time_func()
+    try:
+        while True:
+            await _back_off_if_needed(protocol.credentials.back_off_until)
+            log.debug('Session %s: retry %s timeout %s POST\'ing to %s after %ss wait', session.session_id, retry,
+                      protocol.TIMEOUT, url, wait)
+            slot = None
+            if throttling_registry is not None:
+                slot = await _acquire_throttling_slot(throttling_registry, protocol)
+            if rate_limiter is not None:
+                await _acquire_rate_limiter(rate_limiter)
+            d_start = time_func()
+            # Always create a dummy response for logging purposes, in case we fail in the following
+            r = DummyResponse(url=url, headers={}, request_headers=headers)
+            try:
+                r = await session.post(url=url, headers=headers, data=data, timeout=protocol.TIMEOUT)
+            except ASYNC_CONNECTION_ERRORS as e:
+                log.debug('Session %s: connection error POST\'ing to %s', session.session_id, url)
+                r = DummyResponse(url=url, headers={'TimeoutException': e}, request_headers=headers)
+            finally:
+                if rate_limiter is not None:
+                    rate_limiter.release()
+                if throttling_registry is not None:
+                    throttling_registry.release(slot)
+                log_vals.update(
+                    retry=retry,
+                    wait=wait,
+                    session_id=session.session_id,
+                    url=str(r.url),
+                    response_time=time_func() - d_start,
+                    status_code=r.status_code,
+                    request_headers=r.request.headers,
+                    response_headers=r.headers,
+                    xml_response=r.content,
+                )
+            log.debug(POST_LOG_MSG, log_vals)
+            if _may_retry_on_error(r, protocol):
+                wait = protocol.retry_policy.get_wait(protocol=protocol, response=r, retry=retry,
+                                                      total_wait=total_wait, started=started)
+                log.info("Session %s: Connection error on URL %s (code %s). Cool down %.1f secs", session.session_id,
+                         r.url, r.status_code, wait)
+                await asyncio.sleep(wait)
+                retry += 1
+                total_wait += wait
+                session = await protocol.renew_session(session)
+                continue
+            if r.status_code in (301, 302):
+                url, redirects = _redirect_or_fail(r, redirects, allow_redirects)
+                continue
+            break
+    except (RateLimitError, RedirectError) as e:
+        log.warning(e.value)
+        await protocol.retire_session(session)
+        raise
+    except Exception as e:
+        # Let higher layers handle this. Add full context for better debugging.
+        log.error(str('%s: %s\n%s'), e.__class__.__name__, str(e), POST_LOG_MSG % log_vals)
+        await protocol.retire_session(session)
+        raise
+    if r.status_code == 500 and r.content and is_xml(r.content):
+        # Some genius at Microsoft thinks it's OK to send a valid SOAP response as an HTTP 500
+        log.debug('Got status code %s but trying to parse content anyway', r.status_code)
+    elif r.status_code != 200:
+        await protocol.retire_session(session)
+        _raise_response_errors(r, protocol, POST_LOG_MSG, log_vals)  # Always raises an exception
+    log.debug('Session %s: Useful response from %s', session.session_id, url)
+    protocol.retry_policy.record_success()
+    return r, session
+
+
+async def _achunkify(iterable, chunksize):
+    # Like util.chunkify(), but also accepts async iterables
+    if not hasattr(iterable, '__aiter__'):
+        for chunk in chunkify(iterable, chunksize):
+            yield chunk
+        return
+    chunk = []
+    async for i in iterable:
+        chunk.append(i)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class AsyncServiceMixIn(object):
+    """Replaces the methods of a service class that send requests with coroutine-based versions. Services whose call()
+    method returns the result of _pool_requests() or _paged_call() will return an async generator. Use
+    async_service() to create async versions of service classes.
+    """
+    @property
+    def aprotocol(self):
+        return AsyncProtocol.from_protocol(self.protocol)
+
+    async def _get_response_xml(self, payload, **parse_opts):
+        if self.streaming:
+            raise NotImplementedError('%s does not support streaming responses' % self.__class__.__name__)
+        account, hint, api_versions = self._get_api_versions()
+        for api_version in api_versions:
+            log.debug('Trying API version %s for account %s', api_version, account)
+            try:
+                r, session = await post_ratelimited(
+                    protocol=self.aprotocol,
+                    session=await self.aprotocol.get_session(),
+                    url=self.protocol.service_endpoint,
+                    headers=extra_headers(account=account),
+                    data=wrap(content=payload, version=api_version, account=account),
+                    allow_redirects=False,
+                )
+            except UnauthorizedError:
+                # The cached auth type may be wrong
+                self._invalidate_discovery_cache(auth_type=True)
+                raise
+            await self.aprotocol.release_session(session)
+            res = self._handle_response(response=r, account=account, hint=hint, api_version=api_version,
+                                        **parse_opts)
+            if res is None:
+                # The API version was invalid. Try the next version
+                continue
+            self.protocol.recover_poolsize()
+            return res
+        self._raise_all_versions_invalid(account=account, api_versions=api_versions)
+
+    async def _get_elements(self, payload):
+        while True:
+            try:
+                response = await self._get_response_xml(payload=payload)
+                return list(self._get_elements_in_response(response=response))
+            except ErrorServerBusy as e:
+                self._handle_server_busy(e)
+                continue
+
+    async def _pool_requests(self, payload_func, items, **kwargs):
+        log.debug('Processing items in chunks of %s', self.chunk_size)
+        # Run chunks concurrently, but yield results in the same order as the input. Concurrency is limited by the
+        # session pool. Limit the number of outstanding chunks like the thread pool of the threaded version does.
+        max_outstanding = 4 * self.protocol.session_pool_size
+        tasks = deque()
+        try:
+            chunk_size = self.chunk_size
+            if not self._chunk_size_is_explicit and self.protocol.autotuner is not None:
+                chunk_size = self.protocol.autotuner.get_chunk_size(service_name=self.SERVICE_NAME)
+            async for chunk in _achunkify(items, chunk_size):
+                log.debug('Starting %s._get_elements task for %s items', self.__class__.__name__, len(chunk))
+                tasks.append(asyncio.ensure_future(self._get_elements(payload=payload_func(chunk, **kwargs))))
+                while tasks and (len(tasks) >= max_outstanding or tasks[0].done()):
+                    for elem in await tasks.popleft():
+                        yield elem
+            while tasks:
+                for elem in await tasks.popleft():
+                    yield elem
+        finally:
+            # The consumer may have stopped early. Don't leave orphaned tasks behind.
+            for task in tasks:
+                task.cancel()
+
+    async def _paged_call(self, payload_func, max_items, **kwargs):
+        log_prefix, expected_message_count, paging_infos = self._init_paging()
+        common_next_offset = kwargs['offset']
+        total_item_count = 0
+        while True:
+            log.debug('%s: Getting items at offset %s (max_items %s)', log_prefix, common_next_offset, max_items)
+            kwargs['offset'] = common_next_offset
+            payload = payload_func(**kwargs)
+            try:
+                response = await self._get_response_xml(payload=payload)
+            except ErrorServerBusy as e:
+                self._handle_server_busy(e)
+                continue
+            for paging_info, container in self._get_paged_containers(response, paging_infos, expected_message_count):
+                if container is not None:
+                    for elem in self._iter_elements_in_container(response=response, container=container):
+                        paging_info['item_count'] += 1
+                        yield elem
+                    total_item_count += paging_info['item_count']
+                    if max_items and total_item_count >= max_items:
+                        log.debug("'max_items' count reached (inner)")
+                        break
+                self._check_next_offset(paging_info)
+            if max_items and total_item_count >= max_items:
+                log.debug("'max_items' count reached (outer)")
+                break
+            common_next_offset = self._get_next_offset(paging_infos)
+            if common_next_offset is None:
+                # Paging is done for all messages
+                break
+
+
+_async_service_classes = {}
+
+
+def async_service(service_cls):
+    """Returns an async version of a paging or pooled service class, e.g. async_service(GetItem)"""
+    try:
+        return _async_service_classes[service_cls]
+    except KeyError:
+        cls = type(str('Async%s' % service_cls.__name__), (AsyncServiceMixIn, service_cls), {})
+        _async_service_classes[service_cls] = cls
+        return cls
+
+
+async def find_items(folder_collection, q, **kwargs):
+    """The async version of FolderCollection.find_items()"""
+    items = folder_collection._find_items_call(async_service(FindItem), q, **kwargs)
+    if items is None:
+        return
+    async for i in items:
+        yield folder_collection._find_items_result(
+            i, shape=kwargs['shape'], additional_fields=kwargs['additional_fields']
+        )
+
+
+async def consume_item_service(account, service_cls, items, chunk_size, kwargs):
+    """The async version of Account._consume_item_service(). 'items' may also be an async iterable"""
+    if isinstance(items, QuerySet):
+        items = items.iterator()
+    if not hasattr(items, '__aiter__'):
+        is_empty, items = peek(items)
+        if is_empty:
+            return
+    kwargs['items'] = items
+    async for i in async_service(service_cls)(account=account, chunk_size=chunk_size).call(**kwargs):
+        yield i
+
+
+async def fetch(account, ids, folder=None, only_fields=None, chunk_size=None):
+    """The async version of Account.fetch(). 'ids' may also be an async iterable"""
+    validation_folder, additional_fields = account._get_fetch_fields(folder=folder, only_fields=only_fields)
+    async for i in consume_item_service(account=account, service_cls=GetItem, items=ids, chunk_size=chunk_size,
+                                        kwargs=dict(additional_fields=additional_fields, shape=ID_ONLY)):
+        if isinstance(i, Exception):
+            yield i
+        else:
+            yield validation_folder.item_model_from_tag(i.tag).from_xml(elem=i, account=account)
+
+
+async def iterate_queryset(qs):
+    """Returns an async iterator over the QuerySet. Like QuerySet.__iter__(), the cache is filled on completion"""
+    if qs.is_cached:
+        for val in qs._cache:
+            yield val
+        return
+    if qs.q is None:
+        qs._cache = []
+        return
+    if qs.request_type != qs.ITEM:
+        raise NotImplementedError('Async iteration is only supported for item querysets')
+    additional_fields, complex_fields_requested, order_fields, extra_order_fields = qs._get_query_fields()
+    find_item_kwargs = dict(
+        shape=ID_ONLY,  # Always use IdOnly here, because AllProperties doesn't actually get *all* properties
+        additional_fields=additional_fields,
+        order_fields=order_fields,
+        calendar_view=qs.calendar_view,
+        page_size=qs.page_size,
+        max_items=qs.max_items,
+        offset=qs.offset,
+        depth=SHALLOW,
+    )
+    if complex_fields_requested or not additional_fields:
+        # See QuerySet._query()
+        find_item_kwargs['additional_fields'] = None
+    items = find_items(qs.folder_collection, qs.q, **find_item_kwargs)
+    if complex_fields_requested:
+        items = fetch(account=qs.folder_collection.account, ids=items, only_fields=additional_fields,
+                      chunk_size=qs.chunk_size or qs.page_size)
+    if qs._must_sort_clientside:
+        # Client-side sorting is greedy anyway
+        items = qs._sort_clientside(items=[i async for i in items], extra_order_fields=extra_order_fields)
+        items = _as_async_iterable(items)
+    _cache = []
+    async for i in items:
+        for val in qs._format_items(items=[i], return_format=qs.return_format):
+            _cache.append(val)
+            yield val
+    qs._cache = _cache
+
+
+async def _as_async_iterable(iterable):
+    for i in iterable:
+        yield i
+
+
+class AsyncAccount(Account):
+    """An Account with async versions of the methods that work on items. QuerySets on any account can be iterated
+    with 'async for'. Item methods that are not implemented here are still available in their blocking versions.
+    """
+    @property
+    def aprotocol(self):
+        return AsyncProtocol.from_protocol(self.protocol)
+
+    def afetch(self, ids, folder=None, only_fields=None, chunk_size=None):
+        """The async version of fetch(). Returns an async generator of Item objects, in the same order as the input
+
+        :param ids: an iterable or async iterable of either (id, changekey) tuples or Item objects.
+        :param folder: used for validating 'only_fields'
+        :param only_fields: A list of string or FieldPath items specifying the fields to fetch. Default to all fields
+        :param chunk_size: The number of items to send to the server in a single request
+        """
+        return fetch(account=self, ids=ids, folder=folder, only_fields=only_fields, chunk_size=chunk_size)
+
+    async def abulk_delete(self, ids, chunk_size=None, **kwargs):
+        """The async version of bulk_delete(). Accepts the same keyword arguments as bulk_delete()"""
+        return [i async for i in consume_item_service(
+            account=self, service_cls=DeleteItem, items=ids, chunk_size=chunk_size,
+            kwargs=self._get_delete_kwargs(**kwargs)
+        )]
+
+    async def abulk_copy(self, ids, to_folder, chunk_size=None):
+        """The async version of bulk_copy()"""
+        if not isinstance(to_folder, Folder):
+            raise ValueError("'to_folder' %r must be a Folder instance" % to_folder)
+        return [i if isinstance(i, Exception) else Item.id_from_xml(i) async for i in consume_item_service(
+            account=self, service_cls=CopyItem, items=ids, chunk_size=chunk_size, kwargs=dict(to_folder=to_folder)
+        )]
+
+    async def abulk_move(self, ids, to_folder, chunk_size=None):
+        """The async version of bulk_move()"""
+        if not isinstance(to_folder, Folder):
+            raise ValueError("'to_folder' %r must be a Folder instance" % to_folder)
+        return [i if isinstance(i, Exception) else Item.id_from_xml(i) async for i in consume_item_service(
+            account=self, service_cls=MoveItem, items=ids, chunk_size=chunk_size, kwargs=dict(to_folder=to_folder)
+        )]
+
+    async def aclose(self):
+        """Closes the async sessions of this account's protocol"""
+        await self.aprotocol.close()
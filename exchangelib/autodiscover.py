@@ -11,19 +11,20 @@ If you have problems autodiscovering, start by doing an official test at https:/
 """
 from __future__ import unicode_literals
 
-from contextlib import contextmanager
-import getpass
+from collections import OrderedDict
+from functools import partial
 import glob
 import logging
 import os
-import shelve
-import sys
+import sqlite3
 import tempfile
-from threading import Lock
+from multiprocessing.pool import ThreadPool
+from threading import Lock, local
+import time
 
 import dns.resolver
 from future.moves.queue import LifoQueue
-from future.utils import raise_from, PY2, python_2_unicode_compatible
+from future.utils import raise_from, python_2_unicode_compatible
 from six import text_type
 
 from . import transport
@@ -33,7 +34,8 @@ from .errors import AutoDiscoverFailed, AutoDiscoverRedirect, AutoDiscoverCircul
 from .protocol import BaseProtocol, Protocol
 from .transport import DEFAULT_ENCODING, DEFAULT_HEADERS
 from .util import create_element, get_xml_attr, add_xml_child, to_xml, is_xml, post_ratelimited, xml_to_str, \
-    get_domain, CONNECTION_ERRORS, TLS_ERRORS
+    get_domain, shelve_filename, chunkify, ConcurrentCalls, ParseError, CONNECTION_ERRORS, TLS_ERRORS, SOAPNS
+from .version import Build, Version
 
 
 log = logging.getLogger(__name__)
@@ -42,38 +44,16 @@ REQUEST_NS = 'http://schemas.microsoft.com/exchange/autodiscover/outlook/request
 AUTODISCOVER_NS = 'http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006'
 ERROR_NS = 'http://schemas.microsoft.com/exchange/autodiscover/responseschema/2006'
 RESPONSE_NS = 'http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006a'
+# Namespaces and constants for the SOAP Autodiscover service
+SOAP_AUTODISCOVER_NS = 'http://schemas.microsoft.com/exchange/2010/Autodiscover'
+WSA_NS = 'http://www.w3.org/2005/08/addressing'
+GET_USER_SETTINGS_ACTION = 'http://schemas.microsoft.com/exchange/2010/Autodiscover/Autodiscover/GetUserSettings'
+# The maximum number of users in a GetUserSettings request. This is the default limit on Exchange servers.
+GET_USER_SETTINGS_MAX_USERS = 100
+USER_SETTINGS = ('AutoDiscoverSMTPAddress', 'ExternalEwsUrl', 'InternalEwsUrl', 'CasVersion')
 
 
-def shelve_filename():
-    # 'shelve' may pickle objects using different pickle protocol versions. Append the python major+minor version
-    # numbers to the filename. Also append the username, to avoid permission errors.
-    major, minor = sys.version_info[:2]
-    try:
-        user = getpass.getuser()
-    except KeyError:
-        # getuser() fails on some systems. Provide a sane default. See issue #448
-        user = 'exchangelib'
-    return 'exchangelib.cache.{user}.py{major}{minor}'.format(user=user, major=major, minor=minor)
-
-
-AUTODISCOVER_PERSISTENT_STORAGE = os.path.join(tempfile.gettempdir(), shelve_filename())
-
-
-@contextmanager
-def shelve_open_with_failover(filename):
-    # We can expect empty or corrupt files. Whatever happens, just delete the cache file and try again.
-    # 'shelve' may add a backend-specific suffix to the file, so also delete all files with a suffix.
-    # We don't know which file caused the error, so just delete them all.
-    try:
-        shelve_handle = shelve.open(filename)
-    except Exception as e:
-        for f in glob.glob(filename + '*'):
-            log.warning('Deleting invalid cache file %s (%r)', f, e)
-            os.unlink(f)
-        shelve_handle = shelve.open(filename)
-    yield shelve_handle
-    if PY2:
-        shelve_handle.close()
+AUTODISCOVER_PERSISTENT_STORAGE = os.path.join(tempfile.gettempdir(), shelve_filename(name='autodiscover') + '.sqlite')
 
 
 @python_2_unicode_compatible
@@ -91,64 +71,146 @@ class AutodiscoverCache(object):
 
     # If an autodiscover lookup fails for any reason, the corresponding cache entry must be purged.
 
-    # 'shelve' is supposedly thread-safe and process-safe, which suits our needs.
-    def __init__(self):
-        self._protocols = {}  # Mapping from (domain, credentials) to AutodiscoverProtocol
+    # The persistent storage is an SQLite database in WAL mode, which allows multiple processes to read the cache while
+    # another process is writing to it. Each thread uses its own database connection, which is kept open. Entries
+    # expire after 'ttl' seconds, or never if 'ttl' is None. The in-memory cache keeps at most 'max_protocols'
+    # protocols. The least recently used protocol is closed when the cache is full.
+    TTL = 24 * 3600
+    MAX_PROTOCOLS = 100
+    DB_TIMEOUT = 10  # Seconds to wait for another process to release a write lock on the database
+
+    def __init__(self, ttl=TTL, max_protocols=MAX_PROTOCOLS):
+        self.ttl = ttl
+        self.max_protocols = max_protocols
+        self._protocols = OrderedDict()  # LRU mapping from (domain, credentials) to AutodiscoverProtocol
+        self._expires = {}  # Mapping from (domain, credentials) to the expiry time of the in-memory entry
+        self._protocols_lock = Lock()
+        self._local = local()  # Holds the database connection of each thread
 
     @property
     def _storage_file(self):
         return AUTODISCOVER_PERSISTENT_STORAGE
 
+    def _connect(self):
+        conn = sqlite3.connect(self._storage_file, timeout=self.DB_TIMEOUT)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS autodiscover '
+                     '(domain TEXT PRIMARY KEY, endpoint TEXT NOT NULL, auth_type TEXT NOT NULL, expires REAL)')
+        return conn
+
+    def _get_connection(self):
+        conn, storage_file = getattr(self._local, 'conn', (None, None))
+        if conn is None or storage_file != self._storage_file:
+            conn = self._connect()
+            self._local.conn = conn, self._storage_file
+        return conn
+
+    def _close_connection(self):
+        conn, _ = getattr(self._local, 'conn', (None, None))
+        if conn is not None:
+            conn.close()
+        self._local.conn = None, None
+
+    def _execute(self, sql, params=()):
+        # We can expect corrupt files. If so, just delete the cache file and try again. SQLite may add files with a
+        # suffix to the database file, so also delete all files with a suffix. Operational errors, e.g. when another
+        # process held the write lock for longer than DB_TIMEOUT, don't mean that the file is broken. Other processes
+        # may be using the file, so don't delete it in that case.
+        try:
+            with self._get_connection() as conn:
+                return conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            raise
+        except sqlite3.DatabaseError as e:
+            self._close_connection()
+            for f in glob.glob(self._storage_file + '*'):
+                log.warning('Deleting invalid cache file %s (%r)', f, e)
+                os.unlink(f)
+        with self._get_connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _get_persistent(self, domain):
+        # Returns the (endpoint, auth_type, expires) tuple of the domain, or None if there is no valid entry
+        rows = self._execute('SELECT endpoint, auth_type, expires FROM autodiscover '
+                             'WHERE domain = ? AND (expires IS NULL OR expires > ?)', (str(domain), time.time()))
+        return rows[0] if rows else None
+
+    def _get_in_memory(self, key):
+        # Returns the protocol of the key and marks it as recently used, or None if there is no valid entry
+        with self._protocols_lock:
+            protocol = self._protocols.pop(key, None)
+            if protocol is None:
+                return None
+            expires = self._expires[key]
+            if expires is not None and expires <= time.time():
+                del self._expires[key]
+                log.debug('Domain %s: Closing sessions of expired protocol', key[0])
+                protocol.close()
+                return None
+            self._protocols[key] = protocol
+            return protocol
+
+    def _set_in_memory(self, key, protocol, expires):
+        with self._protocols_lock:
+            self._protocols.pop(key, None)
+            self._protocols[key] = protocol
+            self._expires[key] = expires
+            while len(self._protocols) > self.max_protocols:
+                lru_key, lru_protocol = self._protocols.popitem(last=False)
+                del self._expires[lru_key]
+                log.debug('Domain %s: Closing sessions of least recently used protocol', lru_key[0])
+                lru_protocol.close()
+
     def clear(self):
         # Wipe the entire cache
-        with shelve_open_with_failover(self._storage_file) as db:
-            db.clear()
-        self._protocols.clear()
+        self._execute('DELETE FROM autodiscover')
+        with self._protocols_lock:
+            self._protocols.clear()
+            self._expires.clear()
 
     def __contains__(self, key):
-        domain = key[0]
-        with shelve_open_with_failover(self._storage_file) as db:
-            return str(domain) in db
+        # Always ask the persistent cache. Another process may have removed the entry because autodiscover failed
+        return self._get_persistent(domain=key[0]) is not None
 
     def __getitem__(self, key):
-        protocol = self._protocols.get(key)
+        protocol = self._get_in_memory(key)
         if protocol:
             return protocol
         domain, credentials = key
-        with shelve_open_with_failover(self._storage_file) as db:
-            endpoint, auth_type = db[str(domain)]  # It's OK to fail with KeyError here
+        entry = self._get_persistent(domain=domain)
+        if entry is None:
+            raise KeyError(key)
+        endpoint, auth_type, expires = entry
         protocol = AutodiscoverProtocol(service_endpoint=endpoint, credentials=credentials, auth_type=auth_type)
-        self._protocols[key] = protocol
+        self._set_in_memory(key, protocol, expires)
         return protocol
 
     def __setitem__(self, key, protocol):
         # Populate both local and persistent cache
         domain = key[0]
-        with shelve_open_with_failover(self._storage_file) as db:
-            db[str(domain)] = (protocol.service_endpoint, protocol.auth_type)
-        self._protocols[key] = protocol
+        expires = None if self.ttl is None else time.time() + self.ttl
+        self._execute('INSERT OR REPLACE INTO autodiscover (domain, endpoint, auth_type, expires) VALUES (?, ?, ?, ?)',
+                      (str(domain), protocol.service_endpoint, protocol.auth_type, expires))
+        self._set_in_memory(key, protocol, expires)
 
     def __delitem__(self, key):
         # Empty both local and persistent cache. Don't fail on non-existing entries because we could end here
         # multiple times due to race conditions.
         domain = key[0]
-        with shelve_open_with_failover(self._storage_file) as db:
-            try:
-                del db[str(domain)]
-            except KeyError:
-                pass
-        try:
-            del self._protocols[key]
-        except KeyError:
-            pass
+        self._execute('DELETE FROM autodiscover WHERE domain = ?', (str(domain),))
+        with self._protocols_lock:
+            self._protocols.pop(key, None)
+            self._expires.pop(key, None)
 
     def close(self):
         # Close all open connections
-        for (domain, _), protocol in self._protocols.items():
-            log.debug('Domain %s: Closing sessions', domain)
-            protocol.close()
-            del protocol
-        self._protocols.clear()
+        with self._protocols_lock:
+            for (domain, _), protocol in self._protocols.items():
+                log.debug('Domain %s: Closing sessions', domain)
+                protocol.close()
+                del protocol
+            self._protocols.clear()
+            self._expires.clear()
 
     def __del__(self):
         # pylint: disable=bare-except
@@ -163,7 +225,14 @@ class AutodiscoverCache(object):
 
 
 _autodiscover_cache = AutodiscoverCache()
-_autodiscover_cache_lock = Lock()
+# A fixed pool of locks that serialize autodiscover of a (domain, credentials) key. Each key always maps to the same
+# lock. Unrelated keys may share a lock, but the number of locks stays bounded no matter how many domains we see.
+AUTODISCOVER_LOCK_STRIPES = 64
+_autodiscover_locks = tuple(Lock() for _ in range(AUTODISCOVER_LOCK_STRIPES))
+
+
+def _get_autodiscover_lock(key):
+    return _autodiscover_locks[hash(key) % len(_autodiscover_locks)]
 
 
 def close_connections():
@@ -183,11 +252,12 @@ def discover(email, credentials):
     # We may be using multiple different credentials and changing our minds on TLS verification. This key combination
     # should be safe.
     autodiscover_key = (domain, credentials)
-    # Use lock to guard against multiple threads competing to cache information
-    log.debug('Waiting for _autodiscover_cache_lock')
-    with _autodiscover_cache_lock:
+    # Use lock to guard against multiple threads competing to cache information. The lock is picked by domain and
+    # credentials, so unrelated domains can mostly be autodiscovered in parallel.
+    log.debug('Waiting for autodiscover lock for domain %s', domain)
+    with _get_autodiscover_lock(autodiscover_key):
         # Don't recurse while holding the lock!
-        log.debug('_autodiscover_cache_lock acquired')
+        log.debug('Autodiscover lock for domain %s acquired', domain)
         if autodiscover_key in _autodiscover_cache:
             protocol = _autodiscover_cache[autodiscover_key]
             if not isinstance(protocol, AutodiscoverProtocol):
@@ -217,7 +287,7 @@ def discover(email, credentials):
                 log.debug('%s redirects to %s', email, e.redirect_email)
                 # Start over with the new email address after releasing the lock
                 email = e.redirect_email
-    log.debug('Released autodiscover_cache_lock')
+    log.debug('Released autodiscover lock for domain %s', domain)
     # We fell out of the with statement, so either cache was filled by someone else, or autodiscover redirected us to
     # another email address. Start over after releasing the lock.
     return discover(email=email, credentials=credentials)
@@ -226,6 +296,8 @@ def discover(email, credentials):
 def _try_autodiscover(hostname, credentials, email):
     # Implements the full chain of autodiscover server discovery attempts. Tries to return autodiscover data from the
     # final host.
+    if AutodiscoverProtocol.CONCURRENT_PROBING:
+        return _try_autodiscover_concurrently(hostname=hostname, credentials=credentials, email=email)
     try:
         return _autodiscover_hostname(hostname=hostname, credentials=credentials, email=email, has_ssl=True)
     except RedirectError as e:
@@ -279,6 +351,56 @@ def _try_autodiscover(hostname, credentials, email):
                         raise_from(AutoDiscoverFailed('All steps in the autodiscover protocol failed'), None)
 
 
+def _try_autodiscover_concurrently(hostname, credentials, email):
+    # Like _try_autodiscover(), but probes all candidate hosts and DNS records at the same time, so a candidate that
+    # times out doesn't delay the next one. Candidates are still tried in the order of the autodiscover protocol. We
+    # stop at the first candidate that works and discard the results of the rest.
+    candidates = [(hostname, True), ('autodiscover.%s' % hostname, True), ('autodiscover.%s' % hostname, False)]
+    probes = ConcurrentCalls([
+        partial(_get_auth_type_or_raise, url=_get_url(hostname=h, has_ssl=has_ssl), email=email, hostname=h)
+        for h, has_ssl in candidates
+    ] + [
+        partial(_get_canonical_name, hostname='autodiscover.%s' % hostname),
+        partial(_get_hostname_from_srv, hostname='autodiscover.%s' % hostname),
+        partial(_get_hostname_from_srv, hostname='_autodiscover._tcp.%s' % hostname),
+    ])
+    canonical_name_probe, srv_probe, tcp_srv_probe = range(len(candidates), len(candidates) + 3)
+    try:
+        for i, (candidate, has_ssl) in enumerate(candidates):
+            try:
+                auth_type = probes.get(i)
+                return _autodiscover_hostname(hostname=candidate, credentials=credentials, email=email,
+                                              has_ssl=has_ssl, auth_type=auth_type)
+            except RedirectError as e:
+                if not e.has_ssl:
+                    raise_from(AutoDiscoverFailed(
+                        '%s redirected us to %s but only HTTPS redirects allowed' % (candidate, e.url)
+                    ), None)
+                log.info('%s redirected us to %s', candidate, e.server)
+                probes.cancel()
+                return _try_autodiscover(e.server, credentials, email)
+            except AutoDiscoverFailed as e:
+                log.info('Autodiscover on %s (has_ssl %s) failed (%s)', candidate, has_ssl, e)
+        log.info('Autodiscover on all candidate hosts for %s failed. Trying DNS records', hostname)
+        hostname_from_dns = probes.get(canonical_name_probe)
+        try:
+            if not hostname_from_dns:
+                log.info('No canonical name on autodiscover.%s Trying SRV record', hostname)
+                hostname_from_dns = probes.get(srv_probe)
+            # Start over with new hostname
+            return _try_autodiscover(hostname=hostname_from_dns, credentials=credentials, email=email)
+        except AutoDiscoverFailed as e:
+            log.info('Autodiscover on %s failed (%s). Trying _autodiscover._tcp.%s', hostname_from_dns, e, hostname)
+            # Start over with new hostname
+            try:
+                hostname_from_dns = probes.get(tcp_srv_probe)
+                return _try_autodiscover(hostname=hostname_from_dns, credentials=credentials, email=email)
+            except AutoDiscoverFailed:
+                raise_from(AutoDiscoverFailed('All steps in the autodiscover protocol failed'), None)
+    finally:
+        probes.cancel()
+
+
 def _get_auth_type_or_raise(url, email, hostname):
     # Returns the auth type of the URL. Raises any redirection errors. This tests host DNS, port availability, and TLS
     # validation (if applicable).
@@ -302,12 +424,17 @@ def _get_auth_type_or_raise(url, email, hostname):
         raise_from(RedirectError(url='%s://%s' % ('https' if redirect_has_ssl else 'http', redirect_hostname)), None)
 
 
-def _autodiscover_hostname(hostname, credentials, email, has_ssl):
+def _get_url(hostname, has_ssl):
+    return '%s://%s/Autodiscover/Autodiscover.xml' % ('https' if has_ssl else 'http', hostname)
+
+
+def _autodiscover_hostname(hostname, credentials, email, has_ssl, auth_type=None):
     # Tries to get autodiscover data on a specific host. If we are HTTP redirected, we restart the autodiscover dance on
-    # the new host.
-    url = '%s://%s/Autodiscover/Autodiscover.xml' % ('https' if has_ssl else 'http', hostname)
+    # the new host. 'auth_type' is the auth type of the host, if the caller already probed it.
+    url = _get_url(hostname=hostname, has_ssl=has_ssl)
     log.info('Trying autodiscover on %s', url)
-    auth_type = _get_auth_type_or_raise(url=url, email=email, hostname=hostname)
+    if auth_type is None:
+        auth_type = _get_auth_type_or_raise(url=url, email=email, hostname=hostname)
     autodiscover_protocol = AutodiscoverProtocol(service_endpoint=url, credentials=credentials, auth_type=auth_type)
     r = _get_response(protocol=autodiscover_protocol, email=email)
     domain = get_domain(email)
@@ -319,13 +446,13 @@ def _autodiscover_hostname(hostname, credentials, email, has_ssl):
         # These are both valid responses from an autodiscover server, showing that we have found the correct
         # server for the original domain. Fill cache before re-raising
         log.debug('Adding cache entry for %s (hostname %s)', domain, hostname)
-        # We have already acquired the cache lock at this point
+        # We have already acquired the autodiscover lock for this domain at this point
         _autodiscover_cache[(domain, credentials)] = autodiscover_protocol
         raise
 
     # Cache the final hostname of the autodiscover service so we don't need to autodiscover the same domain again
     log.debug('Adding cache entry for %s (hostname %s, has_ssl %s)', domain, hostname, has_ssl)
-    # We have already acquired the cache lock at this point
+    # We have already acquired the autodiscover lock for this domain at this point
     _autodiscover_cache[(domain, credentials)] = autodiscover_protocol
     # Autodiscover response contains an auth type, but we don't want to spend time here testing if it actually works.
     # Instead of forcing a possibly-wrong auth type, just let Protocol auto-detect the auth type.
@@ -448,6 +575,214 @@ def _parse_response(bytes_content):
     return ews_url, primary_smtp_address
 
 
+def discover_many(emails, credentials):
+    """
+    Autodiscovers many email addresses at once, using the SOAP Autodiscover service. Email addresses are looked up in
+    batches of GET_USER_SETTINGS_MAX_USERS addresses per GetUserSettings request, and batches are sent concurrently.
+    Email addresses that the SOAP Autodiscover service can't handle, e.g. because the server doesn't support it or
+    redirects the address, are looked up individually with discover().
+
+    :param emails: An iterable of email addresses
+    :param credentials: The credentials to use for all email addresses
+    :return: A list with an element for each email address, in the same order. Each element is a
+             (primary_smtp_address, protocol) tuple, like discover() returns, or the exception that was raised when
+             autodiscovering the email address.
+    """
+    if not isinstance(credentials, Credentials):
+        raise ValueError("'credentials' %r must be a Credentials instance" % credentials)
+    emails = list(emails)
+    emails_by_domain = OrderedDict()
+    for email in emails:
+        emails_by_domain.setdefault(get_domain(email), []).append(email)
+    results = {}
+    thread_pool = ThreadPool(processes=AutodiscoverProtocol.SESSION_POOLSIZE)
+    try:
+        # Find the SOAP Autodiscover endpoint of each domain
+        protocols = thread_pool.map(lambda d: _get_soap_autodiscover_protocol(domain=d, credentials=credentials),
+                                    emails_by_domain)
+        batches = []
+        for protocol, domain_emails in zip(protocols, emails_by_domain.values()):
+            if protocol is None:
+                log.debug('No SOAP Autodiscover service found. Looking up %s addresses individually',
+                          len(domain_emails))
+                results.update((email, None) for email in domain_emails)
+                continue
+            batches.extend((protocol, batch) for batch in chunkify(domain_emails, GET_USER_SETTINGS_MAX_USERS))
+        for batch_results in thread_pool.imap_unordered(
+                lambda b: _discover_batch(protocol=b[0], emails=b[1], credentials=credentials), batches):
+            results.update(batch_results)
+        # Fall back to discover() for the addresses that we could not handle
+        fallback_emails = [email for email in OrderedDict.fromkeys(emails) if results[email] is None]
+        for email, res in zip(fallback_emails, thread_pool.imap(
+                lambda e: _discover_or_exception(email=e, credentials=credentials), fallback_emails)):
+            results[email] = res
+    finally:
+        thread_pool.close()
+    return [results[email] for email in emails]
+
+
+def _discover_or_exception(email, credentials):
+    try:
+        return discover(email=email, credentials=credentials)
+    except (ErrorNonExistentMailbox, TransportError) as e:
+        return e
+
+
+def _get_soap_url(hostname):
+    return 'https://%s/autodiscover/autodiscover.svc' % hostname
+
+
+def _get_soap_autodiscover_protocol(domain, credentials):
+    # Returns an AutodiscoverProtocol for the SOAP Autodiscover service of the domain, or None if we can't find one. If
+    # the POX autodiscover server of the domain is cached, we assume that it also hosts the SOAP service.
+    hostnames = [domain, 'autodiscover.%s' % domain]
+    try:
+        pox_protocol = _autodiscover_cache[(domain, credentials)]
+        hostnames.insert(0, pox_protocol.server)
+    except KeyError:
+        pass
+    for hostname in hostnames:
+        url = _get_soap_url(hostname)
+        try:
+            auth_type = transport.get_autodiscover_authtype(
+                service_endpoint=url, data=_get_user_settings_payload(url=url, emails=[])
+            )
+        except (TransportError, UnauthorizedError) + CONNECTION_ERRORS + TLS_ERRORS as e:
+            log.debug('No SOAP Autodiscover service at %s (%s)', url, e)
+            continue
+        return AutodiscoverProtocol(service_endpoint=url, credentials=credentials, auth_type=auth_type)
+    return None
+
+
+def _get_user_settings_payload(url, emails):
+    # Builds a full GetUserSettings SOAP request
+    envelope = create_element('{%s}Envelope' % SOAPNS, nsmap={'s': SOAPNS, 'a': SOAP_AUTODISCOVER_NS, 'wsa': WSA_NS})
+    header = create_element('{%s}Header' % SOAPNS)
+    add_xml_child(header, '{%s}RequestedServerVersion' % SOAP_AUTODISCOVER_NS, 'Exchange2010')
+    add_xml_child(header, '{%s}Action' % WSA_NS, GET_USER_SETTINGS_ACTION)
+    add_xml_child(header, '{%s}To' % WSA_NS, url)
+    envelope.append(header)
+    body = create_element('{%s}Body' % SOAPNS)
+    request_message = create_element('{%s}GetUserSettingsRequestMessage' % SOAP_AUTODISCOVER_NS)
+    request = create_element('{%s}Request' % SOAP_AUTODISCOVER_NS)
+    users = create_element('{%s}Users' % SOAP_AUTODISCOVER_NS)
+    for email in emails:
+        user = create_element('{%s}User' % SOAP_AUTODISCOVER_NS)
+        add_xml_child(user, '{%s}Mailbox' % SOAP_AUTODISCOVER_NS, email)
+        users.append(user)
+    request.append(users)
+    settings = create_element('{%s}RequestedSettings' % SOAP_AUTODISCOVER_NS)
+    for setting in USER_SETTINGS:
+        add_xml_child(settings, '{%s}Setting' % SOAP_AUTODISCOVER_NS, setting)
+    request.append(settings)
+    request_message.append(request)
+    body.append(request_message)
+    envelope.append(body)
+    return xml_to_str(envelope, encoding=DEFAULT_ENCODING, xml_declaration=True)
+
+
+def _discover_batch(protocol, emails, credentials):
+    # Returns a dict mapping each email address to a (primary_smtp_address, protocol) tuple, an exception, or None if
+    # the email address must be looked up with discover() instead.
+    try:
+        user_settings = _get_user_settings(protocol=protocol, emails=emails)
+    except (TransportError, ParseError) as e:
+        log.debug('GetUserSettings failed on %s (%s). Looking up %s addresses individually', protocol.service_endpoint,
+                  e, len(emails))
+        return {email: None for email in emails}
+    results = {}
+    for email, settings in zip(emails, user_settings):
+        if isinstance(settings, Exception):
+            results[email] = settings
+            continue
+        if settings is None:
+            results[email] = None
+            continue
+        ews_url = settings.get('ExternalEwsUrl') or settings.get('InternalEwsUrl')
+        if not ews_url:
+            results[email] = None
+            continue
+        primary_smtp_address = settings.get('AutoDiscoverSMTPAddress') or email
+        version = _get_version(settings.get('CasVersion'))
+        try:
+            results[email] = primary_smtp_address, Protocol(service_endpoint=ews_url, credentials=credentials,
+                                                            auth_type=None, version=version)
+        except TransportError as e:
+            results[email] = e
+    return results
+
+
+def _get_version(cas_version):
+    # Converts a CasVersion setting, e.g. '15.01.2044.004', to a Version. Returns None if the version is unknown, in
+    # which case Protocol will guess the version.
+    if not cas_version:
+        return None
+    try:
+        build = Build(*[int(v) for v in cas_version.split('.')[:4]])
+        return Version(build=build)
+    except (TypeError, ValueError):
+        log.debug('Unknown CasVersion %r', cas_version)
+        return None
+
+
+def _get_user_settings(protocol, emails):
+    # Sends a GetUserSettings request and returns a list with the settings for each email address, in the same order.
+    # Settings are a dict of setting name to value. Instead of settings, the list contains an exception if the email
+    # address has no mailbox, or None if the email address must be looked up with discover() instead.
+    headers = DEFAULT_HEADERS.copy()
+    headers['SOAPAction'] = '"%s"' % GET_USER_SETTINGS_ACTION
+    data = _get_user_settings_payload(url=protocol.service_endpoint, emails=emails)
+    session = protocol.get_session()
+    try:
+        r, session = post_ratelimited(protocol=protocol, session=session, url=protocol.service_endpoint,
+                                      headers=headers, data=data, allow_redirects=False)
+    except (TransportError, UnauthorizedError) as e:
+        session = None  # post_ratelimited() has already retired the session
+        raise_from(AutoDiscoverFailed('GetUserSettings failed on %s: %s' % (protocol.service_endpoint, e)), None)
+    except Exception:
+        session = None  # post_ratelimited() has already retired the session
+        raise
+    finally:
+        # Also return the session to the pool if we were interrupted
+        if session is not None:
+            protocol.release_session(session)
+    if not is_xml(r.content):
+        raise AutoDiscoverFailed('URL %s: This is not XML: %r' % (protocol.service_endpoint, r.content[:1000]))
+    return _parse_user_settings_response(bytes_content=r.content, emails=emails)
+
+
+def _parse_user_settings_response(bytes_content, emails):
+    ns = {'a': SOAP_AUTODISCOVER_NS, 's': SOAPNS}
+    response = to_xml(bytes_content).find('s:Body/a:GetUserSettingsResponseMessage/a:Response', namespaces=ns)
+    if response is None:
+        raise AutoDiscoverFailed('Unknown GetUserSettings response: %r' % bytes_content[:1000])
+    error_code = get_xml_attr(response, '{%s}ErrorCode' % SOAP_AUTODISCOVER_NS)
+    if error_code != 'NoError':
+        raise AutoDiscoverFailed('GetUserSettings error %s: %s' % (
+            error_code, get_xml_attr(response, '{%s}ErrorMessage' % SOAP_AUTODISCOVER_NS)
+        ))
+    user_responses = response.findall('a:UserResponses/a:UserResponse', namespaces=ns)
+    if len(user_responses) != len(emails):
+        raise AutoDiscoverFailed('Expected %s user responses, got %s' % (len(emails), len(user_responses)))
+    res = []
+    # User responses are returned in the same order as the users in the request
+    for email, user_response in zip(emails, user_responses):
+        error_code = get_xml_attr(user_response, '{%s}ErrorCode' % SOAP_AUTODISCOVER_NS)
+        if error_code == 'NoError':
+            res.append({
+                get_xml_attr(s, '{%s}Name' % SOAP_AUTODISCOVER_NS): get_xml_attr(s, '{%s}Value' % SOAP_AUTODISCOVER_NS)
+                for s in user_response.findall('a:UserSettings/a:UserSetting', namespaces=ns)
+            })
+        elif error_code == 'InvalidUser':
+            res.append(ErrorNonExistentMailbox('The SMTP address %s has no mailbox associated with it' % email))
+        else:
+            # RedirectAddress, RedirectUrl and errors that discover() may handle better
+            log.debug('GetUserSettings error %s for %s: %s', error_code, email,
+                      get_xml_attr(user_response, '{%s}ErrorMessage' % SOAP_AUTODISCOVER_NS))
+            res.append(None)
+    return res
+
+
 def _get_canonical_name(hostname):
     log.debug('Attempting to get canonical name for %s', hostname)
     resolver = dns.resolver.Resolver()
@@ -500,9 +835,8 @@ class AutodiscoverProtocol(BaseProtocol):
 
     def __init__(self, *args, **kwargs):
         super(AutodiscoverProtocol, self).__init__(*args, **kwargs)
+        # Sessions are created when they are first needed
         self._session_pool = LifoQueue(maxsize=self.SESSION_POOLSIZE)
-        for _ in range(self.SESSION_POOLSIZE):
-            self._session_pool.put(self.create_session(), block=False)
 
     def __str__(self):
         return '''\
@@ -31,12 +31,13 @@ class Credentials(object):
     * User Principal Name (UPN)
 
     :param password: Clear-text password
+    :param rate_limiter: An optional protocol.RateLimiter shared by all protocols using these credentials
     """
     EMAIL = 'email'
     DOMAIN = 'domain'
     UPN = 'upn'
 
-    def __init__(self, username, password):
+    def __init__(self, username, password, rate_limiter=None):
         if username.count('@') == 1:
             self.type = self.EMAIL
         elif username.count('\\') == 1:
@@ -45,6 +46,7 @@ class Credentials(object):
             self.type = self.UPN
         self.username = username
         self.password = password
+        self.rate_limiter = rate_limiter
 
     @property
     def fail_fast(self):
@@ -74,12 +76,12 @@ class Credentials(object):
 
 
 class ServiceAccount(Credentials):
-    def __init__(self, username, password, max_wait=3600):
+    def __init__(self, username, password, max_wait=3600, rate_limiter=None):
         """
         A Credentials class that enables fault-tolerance handling. Tells internal methods to do an exponential back off
         when requests start failing, and wait up to max_wait seconds before failing.
         """
-        super(ServiceAccount, self).__init__(username, password)
+        super(ServiceAccount, self).__init__(username, password, rate_limiter=rate_limiter)
         self.max_wait = max_wait
         self._back_off_until = None
         self._back_off_lock = Lock()
@@ -17,10 +17,11 @@ from .fields import IntegerField, CharField, DateTimeField, FieldPath, Effective
 from .items import Item, CalendarItem, Contact, Message, Task, MeetingRequest, MeetingResponse, MeetingCancellation, \
     DistributionList, RegisterMixIn, Persona, ITEM_CLASSES, ITEM_TRAVERSAL_CHOICES, SHAPE_CHOICES, ID_ONLY, \
     DELETE_TYPE_CHOICES, HARD_DELETE
-from .properties import ItemId, Mailbox, EWSElement, ParentFolderId, InvalidField
+from .properties import ItemId, Mailbox, EWSElement, ParentFolderId, InvalidField, FolderId
 from .queryset import QuerySet, SearchableMixIn
 from .restriction import Restriction, Q
-from .services import FindFolder, GetFolder, FindItem, CreateFolder, UpdateFolder, DeleteFolder, EmptyFolder, FindPeople
+from .services import FindFolder, GetFolder, FindItem, CreateFolder, UpdateFolder, DeleteFolder, EmptyFolder, \
+    FindPeople, SyncFolderItems, SyncFolderHierarchy
 from .util import TNS, MNS
 from .version import EXCHANGE_2007_SP1, EXCHANGE_2010_SP1, EXCHANGE_2013, EXCHANGE_2013_SP1
 
@@ -32,12 +33,8 @@ SOFT_DELETED = 'SoftDeleted'
 DEEP = 'Deep'
 FOLDER_TRAVERSAL_CHOICES = (SHALLOW, DEEP, SOFT_DELETED)
 
-
-class FolderId(ItemId):
-    # MSDN: https://msdn.microsoft.com/en-us/library/office/aa579461(v=exchg.150).aspx
-    ELEMENT_NAME = 'FolderId'
-
-    __slots__ = ItemId.__slots__
+# The maximum number of changes that SyncFolderItems will return in a single response
+MAX_CHANGES_RETURNED = 512
 
 
 class DistinguishedFolderId(ItemId):
@@ -273,8 +270,8 @@ class FolderCollection(SearchableMixIn):
     def allowed_item_fields(self):
         # Return non-ID fields of all item classes allowed in this folder type
         fields = set()
-        for item_model in self.supported_item_models:
-            fields.update(set(item_model.supported_fields(version=self.account.version)))
+        for folder in self.folders:
+            fields.update(folder.allowed_item_fields(version=self.account.version))
         return fields
 
     @property
@@ -293,7 +290,7 @@ class FolderCollection(SearchableMixIn):
             raise InvalidField("%r is not a valid field on %s" % (field, self.supported_item_models))
 
     def find_items(self, q, shape=ID_ONLY, depth=SHALLOW, additional_fields=None, order_fields=None,
-                   calendar_view=None, page_size=None, max_items=None, offset=0):
+                   calendar_view=None, page_size=None, max_items=None, offset=0, prefetch_pages=0):
         """
         Private method to call the FindItem service
 
@@ -308,15 +305,30 @@ class FolderCollection(SearchableMixIn):
         :param page_size: the requested number of items per page
         :param max_items: the max number of items to return
         :param offset: the offset relative to the first item in the item collection
+        :param prefetch_pages: the number of pages to request ahead of the page being consumed
         :return: a generator for the returned item IDs or items
         """
+        items = self._find_items_call(
+            FindItem, q, shape=shape, depth=depth, additional_fields=additional_fields, order_fields=order_fields,
+            calendar_view=calendar_view, page_size=page_size, max_items=max_items, offset=offset,
+            prefetch_pages=prefetch_pages,
+        )
+        if items is None:
+            return
+        for i in items:
+            yield self._find_items_result(i, shape=shape, additional_fields=additional_fields)
+
+    def _find_items_call(self, service_cls, q, shape, depth, additional_fields, order_fields, calendar_view, page_size,
+                         max_items, offset, prefetch_pages=0):
+        # Validates the arguments to find_items() and returns the result of calling the FindItem service, or None if
+        # the collection contains no folders.
         if shape not in SHAPE_CHOICES:
             raise ValueError("'shape' %s must be one of %s" % (shape, SHAPE_CHOICES))
         if depth not in ITEM_TRAVERSAL_CHOICES:
             raise ValueError("'depth' %s must be one of %s" % (depth, ITEM_TRAVERSAL_CHOICES))
         if not self.folders:
             log.debug('Folder list is empty')
-            return
+            return None
         if additional_fields:
             for f in additional_fields:
                 self.validate_item_field(field=f)
@@ -344,7 +356,9 @@ class FolderCollection(SearchableMixIn):
             additional_fields,
             restriction.q if restriction else None,
         )
-        items = FindItem(account=self.account, folders=self.folders, chunk_size=page_size).call(
+        return service_cls(
+            account=self.account, folders=self.folders, chunk_size=page_size, prefetch_pages=prefetch_pages
+        ).call(
             additional_fields=additional_fields,
             restriction=restriction,
             order_fields=order_fields,
@@ -355,15 +369,14 @@ class FolderCollection(SearchableMixIn):
             max_items=calendar_view.max_items if calendar_view else max_items,
             offset=offset,
         )
+
+    def _find_items_result(self, elem, shape, additional_fields):
+        # Converts an element returned by the FindItem service to an (id, changekey) tuple or an Item object
+        if isinstance(elem, Exception):
+            return elem
         if shape == ID_ONLY and additional_fields is None:
-            for i in items:
-                yield i if isinstance(i, Exception) else Item.id_from_xml(i)
-        else:
-            for i in items:
-                if isinstance(i, Exception):
-                    yield i
-                else:
-                    yield Folder.item_model_from_tag(i.tag).from_xml(elem=i, account=self.account)
+            return Item.id_from_xml(elem)
+        return Folder.item_model_from_tag(elem.tag).from_xml(elem=elem, account=self.account)
 
     def get_folder_fields(self, is_complex=None):
         additional_fields = set()
@@ -512,6 +525,7 @@ class Folder(RegisterMixIn, SearchableMixIn):
             warnings.warn("The 'folder_id' attribute is deprecated. Use 'id' instead.", PendingDeprecationWarning)
             kwargs['id'] = kwargs.pop('folder_id')
         super(Folder, self).__init__(**kwargs)
+        self.item_sync_state = None  # The sync state after the latest call to sync_items()
 
     @property
     def folder_id(self):
@@ -690,13 +704,17 @@ class Folder(RegisterMixIn, SearchableMixIn):
 
     @classmethod
     def allowed_item_fields(cls, version):
-        # Return non-ID fields of all item classes allowed in this folder type
-        fields = set()
-        for item_model in cls.supported_item_models:
-            fields.update(
-                set(item_model.supported_fields(version=version))
+        # Return non-ID fields of all item classes allowed in this folder type. The union is cached with the other field
+        # tables of this class, which are cleared when fields are registered on any class, including item classes.
+        key = 'allowed_item_fields', version.build if version else None
+        tables = cls._field_tables()
+        try:
+            fields = tables[key]
+        except KeyError:
+            fields = tables[key] = frozenset(
+                f for item_model in cls.supported_item_models for f in item_model.supported_fields(version=version)
             )
-        return fields
+        return set(fields)
 
     def validate_item_field(self, field):
         # Takes a fieldname, Field or FieldPath object pointing to an item field, and checks that it is valid
@@ -932,6 +950,59 @@ class Folder(RegisterMixIn, SearchableMixIn):
                 except ErrorDeleteDistinguishedFolder:
                     log.warning('Tried to delete a distinguished folder (%s)', f)
 
+    def sync_items(self, sync_state=None, only_fields=None, ignore=None, max_changes_per_request=MAX_CHANGES_RETURNED,
+                   sync_scope=None):
+        """
+        Yields all item changes in this folder since the given sync state, as (change_type, value) tuples. The change
+        types are defined on the SyncFolderItems service. When the generator is exhausted, the new sync state is
+        available as 'self.item_sync_state'. Persist it and pass it to the next call to only get new changes.
+
+        :param sync_state: the sync state returned by a previous sync. Defaults to 'self.item_sync_state'. If this is
+               None, all items in the folder are returned as 'create' changes
+        :param only_fields: A list of string or FieldPath items specifying the fields to fetch. Default to all
+               non-complex fields
+        :param ignore: a list of (id, changekey) tuples or Item objects to ignore changes for
+        :param max_changes_per_request: the maximum number of changes to fetch from the server in one request
+        :param sync_scope: one of SyncFolderItems.SYNC_SCOPES. Only supported from Exchange 2010
+        :return: a generator of (change_type, value) tuples
+        """
+        if sync_scope is not None and sync_scope not in SyncFolderItems.SYNC_SCOPES:
+            raise ValueError("'sync_scope' %s must be one of %s" % (sync_scope, SyncFolderItems.SYNC_SCOPES))
+        if not 1 <= max_changes_per_request <= MAX_CHANGES_RETURNED:
+            raise ValueError("'max_changes_per_request' %s must be in range 1-%s" % (
+                max_changes_per_request, MAX_CHANGES_RETURNED))
+        account = self.root.account
+        if only_fields is None:
+            additional_fields = {
+                FieldPath(field=f) for f in self.allowed_item_fields(version=account.version) if not f.is_complex
+            }
+        else:
+            for field in only_fields:
+                self.validate_item_field(field=field)
+            additional_fields = self.normalize_fields(fields=only_fields)
+        if sync_state is None:
+            sync_state = self.item_sync_state
+        while True:
+            # The server returns at most 'max_changes_per_request' changes per call. Continue from the new sync state
+            # until the server tells us there are no more changes.
+            service = SyncFolderItems(account=account)
+            for change in service.call(
+                    folder=self,
+                    shape=ID_ONLY,
+                    additional_fields=additional_fields,
+                    sync_state=sync_state,
+                    ignore=ignore,
+                    max_changes_returned=max_changes_per_request,
+                    sync_scope=sync_scope,
+            ):
+                yield change
+            if service.sync_state is None:
+                # We got an error response. There is no sync state to continue from.
+                break
+            sync_state = self.item_sync_state = service.sync_state
+            if service.includes_last_item_in_range:
+                break
+
     def test_access(self):
         """
         Does a simple FindItem to test (read) access to the folder. Maybe the account doesn't exist, maybe the
@@ -1667,6 +1738,7 @@ class RootOfHierarchy(Folder):
         kwargs['root'] = self
         super(RootOfHierarchy, self).__init__(**kwargs)
         self._subfolders = None  # See self._folders_map()
+        self.folder_sync_state = None  # The sync state after the latest call to sync_hierarchy()
 
     def refresh(self):
         self._subfolders = None
@@ -1703,6 +1775,53 @@ class RootOfHierarchy(Folder):
             if f.parent.id == folder.id:
                 yield f
 
+    def sync_hierarchy(self, sync_state=None, only_fields=None):
+        """
+        Yields all folder changes in this folder hierarchy since the given sync state, as (change_type, value) tuples.
+        The change types are defined on the SyncFolderHierarchy service. When the generator is exhausted, the new sync
+        state is available as 'self.folder_sync_state'. If the folder cache has been populated, it is updated with the
+        changes.
+
+        :param sync_state: the sync state returned by a previous sync. Defaults to 'self.folder_sync_state'. If this
+               is None, all folders in the hierarchy are returned as 'create' changes
+        :param only_fields: A list of Field or FieldPath items specifying the folder fields to fetch. Default to all
+               non-complex fields
+        :return: a generator of (change_type, value) tuples
+        """
+        if only_fields is None:
+            additional_fields = {
+                FieldPath(field=f) for f in self.supported_fields(version=self.account.version) if not f.is_complex
+            }
+        else:
+            additional_fields = {f if isinstance(f, FieldPath) else FieldPath(field=f) for f in only_fields}
+        # To properly identify folders, we always want the 'name' and 'folder_class' fields
+        additional_fields.update((
+            FieldPath(field=Folder.get_field_by_fieldname('folder_class')),
+            FieldPath(field=Folder.get_field_by_fieldname('name')),
+        ))
+        if sync_state is None:
+            sync_state = self.folder_sync_state
+        while True:
+            service = SyncFolderHierarchy(account=self.account)
+            for change in service.call(
+                    folder=self,
+                    shape=ID_ONLY,
+                    additional_fields=additional_fields,
+                    sync_state=sync_state,
+            ):
+                if self._subfolders is not None and not isinstance(change, Exception):
+                    change_type, value = change
+                    if change_type == service.DELETE:
+                        self.remove_folder(value)
+                    else:
+                        self.update_folder(value)
+                yield change
+            if service.sync_state is None:
+                break
+            sync_state = self.folder_sync_state = service.sync_state
+            if service.includes_last_item_in_range:
+                break
+
     @classmethod
     def get_distinguished(cls, account):
         """Gets the distinguished folder for this folder class"""
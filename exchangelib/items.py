@@ -17,7 +17,7 @@ from .fields import BooleanField, IntegerField, DecimalField, Base64Field, TextF
 from .properties import EWSElement, ItemId, ConversationId, ParentFolderId, Attendee, ReferenceItemId, \
     AssociatedCalendarItemId, PersonaId, InvalidField
 from .recurrence import FirstOccurrence, LastOccurrence, Occurrence, DeletedOccurrence
-from .util import is_iterable
+from .util import is_iterable, ChildIndex
 from .version import EXCHANGE_2007_SP1, EXCHANGE_2010, EXCHANGE_2013
 
 log = logging.getLogger(__name__)
@@ -468,8 +468,10 @@ class Item(RegisterMixIn):
 
     @classmethod
     def from_xml(cls, elem, account):
-        item_id, changekey = cls.id_from_xml(elem=elem)
-        kwargs = {f.name: f.from_xml(elem=elem, account=account) for f in cls.supported_fields()}
+        # Walk the children of the element once, so each field can look up its elements by tag instead of searching
+        children = ChildIndex(elem)
+        item_id, changekey = cls.id_from_xml(elem=children)
+        kwargs = {f.name: f.from_xml(elem=children, account=account) for f in cls.supported_fields()}
         cls._clear(elem)
         return cls(account=account, id=item_id, changekey=changekey, **kwargs)
 
@@ -102,6 +102,9 @@ class EWSElement(object):
     NAMESPACE = TNS  # Either TNS or MNS
 
     _fields_lock = Lock()
+    # Field lookup tables, per class. Subclasses may share the FIELDS list of a parent class, so the tables of all
+    # classes are cleared when a field is added or removed.
+    _fields_cache = {}
 
     __slots__ = tuple()
 
@@ -127,8 +130,11 @@ class EWSElement(object):
     def _clear(elem):
         # Clears an XML element to reduce memory consumption
         elem.clear()
-        # Don't attempt to clean up previous siblings. We may not have parsed them yet.
-        elem.getparent().remove(elem)
+        # Don't attempt to clean up previous siblings. We may not have parsed them yet. Elements from responses that are
+        # parsed incrementally have been removed from the tree already.
+        parent = elem.getparent()
+        if parent is not None:
+            parent.remove(elem)
 
     @classmethod
     def from_xml(cls, elem, account):
@@ -180,21 +186,46 @@ class EWSElement(object):
             raise ValueError('Class %s is missing the ELEMENT_NAME attribute' % cls)
         return '{%s}%s' % (cls.NAMESPACE, cls.ELEMENT_NAME)
 
+    @classmethod
+    def _field_tables(cls):
+        # Return the dict of cached field lookups for this class. Get the dict before reading FIELDS, so a lookup that
+        # races with add_field() or remove_field() can only end up in a dict that has already been discarded.
+        try:
+            return cls._fields_cache[cls]
+        except KeyError:
+            return cls._fields_cache.setdefault(cls, {})
+
     @classmethod
     def attribute_fields(cls):
-        return tuple(f for f in cls.FIELDS if f.is_attribute)
+        tables = cls._field_tables()
+        try:
+            fields = tables['attribute_fields']
+        except KeyError:
+            fields = tables['attribute_fields'] = tuple(f for f in cls.FIELDS if f.is_attribute)
+        return fields
 
     @classmethod
     def supported_fields(cls, version=None):
         # Return non-ID field names. If version is specified, only return the fields supported by this version
-        return tuple(f for f in cls.FIELDS if not f.is_attribute and f.supports_version(version))
+        key = 'supported_fields', version.build if version else None
+        tables = cls._field_tables()
+        try:
+            fields = tables[key]
+        except KeyError:
+            fields = tables[key] = tuple(f for f in cls.FIELDS if not f.is_attribute and f.supports_version(version))
+        return fields
 
     @classmethod
     def get_field_by_fieldname(cls, fieldname):
-        for f in cls.FIELDS:
-            if f.name == fieldname:
-                return f
-        raise InvalidField("'%s' is not a valid field name on '%s'" % (fieldname, cls.__name__))
+        tables = cls._field_tables()
+        try:
+            fields_map = tables['fields_map']
+        except KeyError:
+            fields_map = tables['fields_map'] = {f.name: f for f in cls.FIELDS}
+        try:
+            return fields_map[fieldname]
+        except KeyError:
+            raise InvalidField("'%s' is not a valid field name on '%s'" % (fieldname, cls.__name__))
 
     @classmethod
     def validate_field(cls, field, version):
@@ -220,12 +251,14 @@ class EWSElement(object):
         with cls._fields_lock:
             idx = tuple(f.name for f in cls.FIELDS).index(insert_after) + 1
             cls.FIELDS.insert(idx, field)
+            cls._fields_cache.clear()
 
     @classmethod
     def remove_field(cls, field):
         # Remove the given field and invalidate the fieldname cache
         with cls._fields_lock:
             cls.FIELDS.remove(field)
+            cls._fields_cache.clear()
 
     def __eq__(self, other):
         return hash(self) == hash(other)
@@ -347,6 +380,13 @@ class ConversationId(ItemId):
     __slots__ = ItemId.__slots__
 
 
+class FolderId(ItemId):
+    # MSDN: https://msdn.microsoft.com/en-us/library/office/aa579461(v=exchg.150).aspx
+    ELEMENT_NAME = 'FolderId'
+
+    __slots__ = ItemId.__slots__
+
+
 class ParentFolderId(ItemId):
     # MSDN: https://msdn.microsoft.com/en-us/library/office/aa494327(v=exchg.150).aspx
     ELEMENT_NAME = 'ParentFolderId'
@@ -934,3 +974,148 @@ class FailedMailbox(EWSElement):
     ]
 
     __slots__ = tuple(f.name for f in FIELDS)
+
+
+class OldItemId(ItemId):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/olditemid
+    ELEMENT_NAME = 'OldItemId'
+
+    __slots__ = ItemId.__slots__
+
+
+class OldFolderId(FolderId):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/oldfolderid
+    ELEMENT_NAME = 'OldFolderId'
+
+    __slots__ = FolderId.__slots__
+
+
+class OldParentFolderId(ParentFolderId):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/oldparentfolderid
+    ELEMENT_NAME = 'OldParentFolderId'
+
+    __slots__ = ParentFolderId.__slots__
+
+
+class Event(EWSElement):
+    # Base class for all event types in a Notification
+    FIELDS = [
+        CharField('watermark', field_uri='Watermark'),
+    ]
+
+    __slots__ = tuple(f.name for f in FIELDS)
+
+
+class TimestampEvent(Event):
+    # An event on an item or a folder. Either 'item_id' or 'folder_id' is set.
+    FIELDS = Event.FIELDS + [
+        DateTimeField('timestamp', field_uri='TimeStamp'),
+        EWSElementField('item_id', value_cls=ItemId),
+        EWSElementField('folder_id', value_cls=FolderId),
+        EWSElementField('parent_folder_id', value_cls=ParentFolderId),
+    ]
+
+    __slots__ = tuple(f.name for f in FIELDS)
+
+
+class OldTimestampEvent(TimestampEvent):
+    # An event that also has the location of the item or folder before the event
+    FIELDS = TimestampEvent.FIELDS + [
+        EWSElementField('old_item_id', value_cls=OldItemId),
+        EWSElementField('old_folder_id', value_cls=OldFolderId),
+        EWSElementField('old_parent_folder_id', value_cls=OldParentFolderId),
+    ]
+
+    __slots__ = tuple(f.name for f in FIELDS)
+
+
+class CopiedEvent(OldTimestampEvent):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/copiedevent
+    ELEMENT_NAME = 'CopiedEvent'
+
+    __slots__ = OldTimestampEvent.__slots__
+
+
+class CreatedEvent(TimestampEvent):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/createdevent
+    ELEMENT_NAME = 'CreatedEvent'
+
+    __slots__ = TimestampEvent.__slots__
+
+
+class DeletedEvent(TimestampEvent):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/deletedevent
+    ELEMENT_NAME = 'DeletedEvent'
+
+    __slots__ = TimestampEvent.__slots__
+
+
+class FreeBusyChangedEvent(TimestampEvent):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/freebusychangedevent
+    ELEMENT_NAME = 'FreeBusyChangedEvent'
+
+    __slots__ = TimestampEvent.__slots__
+
+
+class ModifiedEvent(TimestampEvent):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/modifiedevent
+    ELEMENT_NAME = 'ModifiedEvent'
+    FIELDS = TimestampEvent.FIELDS + [
+        IntegerField('unread_count', field_uri='UnreadCount'),
+    ]
+
+    __slots__ = tuple(f.name for f in FIELDS)
+
+
+class MovedEvent(OldTimestampEvent):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/movedevent
+    ELEMENT_NAME = 'MovedEvent'
+
+    __slots__ = OldTimestampEvent.__slots__
+
+
+class NewMailEvent(TimestampEvent):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/newmailevent
+    ELEMENT_NAME = 'NewMailEvent'
+
+    __slots__ = TimestampEvent.__slots__
+
+
+class StatusEvent(Event):
+    # MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/statusevent
+    ELEMENT_NAME = 'StatusEvent'
+
+    __slots__ = Event.__slots__
+
+
+EVENT_CLASSES = (CopiedEvent, CreatedEvent, DeletedEvent, FreeBusyChangedEvent, ModifiedEvent, MovedEvent,
+                 NewMailEvent, StatusEvent)
+
+
+class Notification(EWSElement):
+    # MSDN:
+    # https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/notification-ex15websvcsotherref
+    ELEMENT_NAME = 'Notification'
+    NAMESPACE = MNS
+    EVENT_MODEL_MAP = {cls.response_tag(): cls for cls in EVENT_CLASSES}
+
+    FIELDS = [
+        CharField('subscription_id', field_uri='SubscriptionId'),
+        CharField('previous_watermark', field_uri='PreviousWatermark'),
+        BooleanField('more_events', field_uri='MoreEvents'),
+    ]
+
+    __slots__ = tuple(f.name for f in FIELDS) + ('events',)
+
+    def __init__(self, **kwargs):
+        self.events = kwargs.pop('events', None) or []  # The Event instances in this notification, in server order
+        super(Notification, self).__init__(**kwargs)
+
+    @classmethod
+    def from_xml(cls, elem, account):
+        # The events are direct children of the element, so we can't use a list field here
+        events = [cls.EVENT_MODEL_MAP[e.tag].from_xml(elem=e, account=account)
+                  for e in list(elem) if e.tag in cls.EVENT_MODEL_MAP]
+        kwargs = {f.name: f.from_xml(elem=elem, account=account) for f in cls.FIELDS}
+        cls._clear(elem)
+        return cls(events=events, **kwargs)
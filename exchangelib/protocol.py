@@ -7,10 +7,19 @@ when creating an Account.
 """
 from __future__ import unicode_literals
 
+from collections import deque
+from functools import partial
+import glob
+import hashlib
 import logging
+from itertools import islice
 from multiprocessing.pool import ThreadPool
 import os
-from threading import Lock
+import random
+import sqlite3
+import tempfile
+from threading import Condition, Lock, local
+import time
 
 from cached_property import threaded_cached_property
 import requests.adapters
@@ -20,13 +29,13 @@ from future.moves.queue import LifoQueue, Empty, Full
 from six import string_types
 
 from .credentials import Credentials
-from .errors import TransportError, SessionPoolMinSizeReached
+from .errors import TransportError, SessionPoolMinSizeReached, RateLimitError
 from .properties import FreeBusyViewOptions, MailboxData, TimeWindow, TimeZone
 from .services import GetServerTimeZones, GetRoomLists, GetRooms, ResolveNames, GetUserAvailability, \
     GetSearchableMailboxes, ExpandDL
 from .transport import get_auth_instance, get_service_authtype, get_docs_authtype, AUTH_TYPE_MAP, DEFAULT_HEADERS
-from .util import split_url
-from .version import Version, API_VERSIONS
+from .util import split_url, time_func, ConcurrentCalls, shelve_filename
+from .version import Build, Version, API_VERSIONS
 
 log = logging.getLogger(__name__)
 
@@ -42,6 +51,13 @@ class BaseProtocol(object):
     # low unless you have an agreement with the Exchange admin on the receiving end to hammer the server and
     # rate-limiting policies have been disabled for the connecting user.
     SESSION_POOLSIZE = 4
+    # The session pool size is decreased when the server asks us to back off. When the server has not done so for
+    # SESSION_POOLSIZE_COOLDOWN seconds, the pool size is increased again by one session, and so on until it reaches
+    # MAX_SESSION_POOLSIZE. If MAX_SESSION_POOLSIZE is None, the pool size will not grow beyond SESSION_POOLSIZE.
+    SESSION_POOLSIZE_COOLDOWN = 60
+    MAX_SESSION_POOLSIZE = None
+    # The number of session pool size changes to keep in 'session_pool_history'
+    SESSION_POOLSIZE_HISTORY_LENGTH = 100
     # We want only 1 TCP connection per Session object. We may have lots of different credentials hitting the server and
     # each credential needs its own session (NTLM auth will only send credentials once and then secure the connection,
     # so a connection can only handle requests for one credential). Having multiple connections ser Session could
@@ -49,6 +65,20 @@ class BaseProtocol(object):
     CONNECTIONS_PER_SESSION = 1
     # Timeout for HTTP requests
     TIMEOUT = 120
+    # If True, the candidate autodiscover servers and API versions are probed concurrently instead of one at a time, so
+    # an unresponsive candidate doesn't delay the others. The results are still used in the usual priority order.
+    CONCURRENT_PROBING = False
+    # Sessions that have been idle in the pool for more than SESSION_IDLE_TIMEOUT seconds get their connections closed,
+    # so we don't hold on to sockets the server has most likely given up on (IIS closes idle connections after 120
+    # seconds by default). The session itself stays in the pool and opens a new connection when it is used again.
+    SESSION_IDLE_TIMEOUT = 60
+    # Sessions are created when they are first needed, up to the session pool size. Set WARM_UP_SESSIONS to a number of
+    # sessions to create and authenticate in the background when the protocol is created, so the first requests don't
+    # all have to wait for an auth handshake.
+    WARM_UP_SESSIONS = 0
+    # Set this to a ThrottlingRegistry instance to share back off periods and a concurrency limit with other processes
+    # on this machine that use the same credentials and server.
+    THROTTLING_REGISTRY = None
 
     # The adapter class to use for HTTP requests. Override this if you need e.g. proxy support or specific TLS versions
     HTTP_ADAPTER_CLS = requests.adapters.HTTPAdapter
@@ -66,6 +96,18 @@ class BaseProtocol(object):
         self._session_pool_size = self.SESSION_POOLSIZE
         self._session_pool = None  # Consumers need to fill the session pool themselves
         self._session_pool_lock = None
+        self._session_count = 0  # The number of sessions that exist, in the pool or checked out
+        self._session_count_lock = Lock()
+        self._session_pool_size_changed = time_func()  # Used to time the cool-down period between pool size changes
+        self._session_pool_history = deque(
+            [(time.time(), self._session_pool_size)], maxlen=self.SESSION_POOLSIZE_HISTORY_LENGTH
+        )
+        self.autotuner = None  # Set this to an Autotuner instance to adjust chunk and pool sizes automatically
+        self.retry_policy = RetryPolicy()  # Decides how long to wait before retrying failed requests
+        # Set this to a RateLimiter instance to limit the request rate to this endpoint. If None, the rate limiter of
+        # the credentials is used, if any.
+        self.rate_limiter = None
+        self.last_used = time_func()  # Used by CachingProtocol to find idle protocols
 
     def __del__(self):
         # pylint: disable=bare-except
@@ -79,7 +121,7 @@ class BaseProtocol(object):
         log.debug('Server %s: Closing sessions', self.server)
         while True:
             try:
-                self._session_pool.get(block=False).close()
+                self._discard_session(self._session_pool.get(block=False))
             except Empty:
                 break
 
@@ -97,13 +139,38 @@ class BaseProtocol(object):
     def session_pool_size(self):
         return self._session_pool_size
 
+    def get_rate_limiter(self):
+        # The rate limiter of the protocol takes precedence over the one shared by all protocols using the credentials
+        if self.rate_limiter is not None:
+            return self.rate_limiter
+        return self.credentials.rate_limiter
+
+    @property
+    def max_session_pool_size(self):
+        return self.MAX_SESSION_POOLSIZE or self.SESSION_POOLSIZE
+
+    @property
+    def session_pool_history(self):
+        """Returns the most recent session pool size changes as a list of (timestamp, pool_size) tuples, oldest first.
+        The first entry is the initial pool size, unless it has been pushed out by later changes.
+        """
+        return list(self._session_pool_history)
+
+    def _set_poolsize(self, pool_size):
+        # Must be called while holding the session pool lock
+        self._session_pool_size = pool_size
+        self._session_pool_size_changed = time_func()
+        self._session_pool_history.append((time.time(), pool_size))
+
     def decrease_poolsize(self):
         """Decreases the session pool size in response to error messages from the server requesting to rate-limit
         requests. We decrease by one session per call.
         """
-        # Take a single session from the pool and discard it. We need to protect this with a lock while we are changing
-        # the pool size variable, to avoid race conditions. We must keep at least one session in the pool.
+        # We need to protect this with a lock while we are changing the pool size variable, to avoid race conditions.
+        # We must keep at least one session in the pool.
         if self._session_pool_size <= 1:
+            # Restart the cool-down period before we increase the pool size again
+            self._session_pool_size_changed = time_func()
             raise SessionPoolMinSizeReached('Session pool size cannot be decreased further')
         with self._session_pool_lock:
             if self._session_pool_size <= 1:
@@ -111,42 +178,196 @@ class BaseProtocol(object):
                 return
             log.warning('Lowering session pool size from %s to %s', self._session_pool_size,
                         self._session_pool_size - 1)
-            self.get_session().close()
-            self._session_pool_size -= 1
+            self._set_poolsize(self._session_pool_size - 1)
+        # Discard a surplus session if one is idle in the pool. Don't wait for a session to be released. If all sessions
+        # are checked out, release_session() discards the surplus session when it is returned.
+        if self._session_count > self._session_pool_size:
+            try:
+                self._discard_session(self._session_pool.get(block=False))
+            except Empty:
+                pass
+
+    def increase_poolsize(self):
+        """Increases the session pool size, e.g. when the server is no longer rate-limiting requests. We increase by one
+        session per call, up to max_session_pool_size.
+        """
+        with self._session_pool_lock:
+            if self._session_pool_size >= self.max_session_pool_size:
+                log.debug('Session pool size is already at the max size %s', self.max_session_pool_size)
+                return
+            self._increase_poolsize()
+
+    def _increase_poolsize(self):
+        # Must be called while holding the session pool lock
+        log.info('Increasing session pool size from %s to %s', self._session_pool_size, self._session_pool_size + 1)
+        self._set_poolsize(self._session_pool_size + 1)
+        # The pool was created with a fixed max size. Make room for the new session.
+        self._session_pool.maxsize = max(self._session_pool.maxsize, self._session_pool_size)
+
+    def recover_poolsize(self):
+        """Increases the session pool size by one session if it is below the max size and the pool size has not changed
+        for SESSION_POOLSIZE_COOLDOWN seconds. Called after each successful request, so the pool size recovers
+        gradually after a period of throttling. When an autotuner is attached, the autotuner decides when to grow the
+        pool instead.
+        """
+        if self.autotuner is not None:
+            return
+        self._recover_poolsize()
+
+    def _recover_poolsize(self):
+        # Check without the lock first. This is called often and will almost always return here.
+        if self._session_pool_size >= self.max_session_pool_size or self._session_pool_lock is None:
+            return
+        if time_func() - self._session_pool_size_changed < self.SESSION_POOLSIZE_COOLDOWN:
+            return
+        with self._session_pool_lock:
+            if self._session_pool_size >= self.max_session_pool_size:
+                return
+            if time_func() - self._session_pool_size_changed < self.SESSION_POOLSIZE_COOLDOWN:
+                # The pool size was changed in another thread
+                return
+            self._increase_poolsize()
 
     def get_session(self):
         _timeout = 60  # Rate-limit messages about session starvation
         while True:
             try:
-                log.debug('Server %s: Waiting for session', self.server)
-                session = self._session_pool.get(timeout=_timeout)
-                log.debug('Server %s: Got session %s', self.server, session.session_id)
-                return session
+                session = self._session_pool.get(block=False)
             except Empty:
-                # This is normal when we have many worker threads starving for available sessions
-                log.debug('Server %s: No sessions available for %s seconds', self.server, _timeout)
+                # Create a new session if we're below the pool size. Otherwise, wait for a session to be released.
+                session = self._create_pooled_session()
+            if session is None:
+                try:
+                    log.debug('Server %s: Waiting for session', self.server)
+                    session = self._session_pool.get(timeout=_timeout)
+                except Empty:
+                    # This is normal when we have many worker threads starving for available sessions
+                    log.debug('Server %s: No sessions available for %s seconds', self.server, _timeout)
+                    continue
+            log.debug('Server %s: Got session %s', self.server, session.session_id)
+            self.last_used = time_func()
+            if self._session_is_idle(session, self.SESSION_IDLE_TIMEOUT):
+                log.debug('Server %s: Closing idle connections of session %s', self.server, session.session_id)
+                session.close()
+            return session
+
+    def _create_pooled_session(self):
+        # Returns a new session, or None if the pool already has as many sessions as it may contain
+        with self._session_count_lock:
+            if self._session_count >= self._session_pool_size:
+                return None
+            self._session_count += 1
+        try:
+            return self.create_session()
+        except Exception:
+            with self._session_count_lock:
+                self._session_count -= 1
+            raise
+
+    def _discard_session(self, session):
+        with self._session_count_lock:
+            self._session_count -= 1
+        session.close()
+
+    def warm_up(self, session_count=None):
+        """Creates up to 'session_count' sessions (default: the session pool size) in the background, authenticates
+        them with a cheap request and adds them to the session pool.
+        """
+        if session_count is None:
+            session_count = self._session_pool_size
+        sessions = []
+        for _ in range(session_count):
+            session = self._create_pooled_session()
+            if session is None:
+                break
+            sessions.append(session)
+        log.debug('Server %s: Warming up %s sessions', self.server, len(sessions))
+        return ConcurrentCalls([partial(self._warm_up_session, session) for session in sessions])
+
+    def _warm_up_session(self, session):
+        # Any response will do. We only want the auth handshake to happen on the connection.
+        try:
+            session.get(self.service_endpoint, allow_redirects=False, timeout=self.TIMEOUT)
+        except Exception as e:
+            log.debug('Server %s: Failed to warm up session %s: %s', self.server, session.session_id, e)
+        self.release_session(session)
 
     def release_session(self, session):
+        if getattr(session, 'dedicated', False):
+            log.debug('Server %s: Closing dedicated session %s', self.server, session.session_id)
+            session.close()
+            return
+        if self._session_count > self._session_pool_size:
+            # The pool size was decreased while the session was checked out
+            log.debug('Server %s: Closing surplus session %s', self.server, session.session_id)
+            self._discard_session(session)
+            return
         # This should never fail, as we don't have more sessions than the queue contains
         log.debug('Server %s: Releasing session %s', self.server, session.session_id)
+        session.last_used = time_func()
         try:
             self._session_pool.put(session, block=False)
         except Full:
             log.debug('Server %s: Session pool was already full %s', self.server, session.session_id)
 
+    @staticmethod
+    def _session_is_idle(session, max_idle):
+        return time_func() - getattr(session, 'last_used', time_func()) >= max_idle
+
+    def reap_idle_sessions(self, max_idle=None):
+        # Close the connections of pooled sessions that have been idle for more than 'max_idle' seconds (default
+        # SESSION_IDLE_TIMEOUT). Closing a requests Session only closes its connection pools, so the sessions are put
+        # back in the pool and will reconnect when needed. Sessions that are currently in use are not touched.
+        if self._session_pool is None:
+            return 0
+        if max_idle is None:
+            max_idle = self.SESSION_IDLE_TIMEOUT
+        sessions = []
+        while True:
+            try:
+                sessions.append(self._session_pool.get(block=False))
+            except Empty:
+                break
+        reaped = 0
+        for session in sessions:
+            if self._session_is_idle(session, max_idle):
+                log.debug('Server %s: Closing idle connections of session %s', self.server, session.session_id)
+                session.close()
+                reaped += 1
+            try:
+                self._session_pool.put(session, block=False)
+            except Full:
+                log.debug('Server %s: Session pool was already full %s', self.server, session.session_id)
+        return reaped
+
     def retire_session(self, session):
-        # The session is useless. Close it completely and place a fresh session in the pool
+        # The session is useless. Close it completely and place a fresh session in the pool, unless the pool size was
+        # decreased in the meantime.
         log.debug('Server %s: Retiring session %s', self.server, session.session_id)
-        session.close()
+        if getattr(session, 'dedicated', False):
+            session.close()
+            return
+        self._discard_session(session)
         del session
-        self.release_session(self.create_session())
+        new_session = self._create_pooled_session()
+        if new_session is not None:
+            self.release_session(new_session)
 
     def renew_session(self, session):
         # The session is useless. Close it completely and place a fresh session in the pool
         log.debug('Server %s: Renewing session %s', self.server, session.session_id)
+        dedicated = getattr(session, 'dedicated', False)
         session.close()
         del session
-        return self.create_session()
+        return self.create_dedicated_session() if dedicated else self.create_session()
+
+    def create_dedicated_session(self):
+        """Returns a session that is not part of the session pool, e.g. for a long-lived streaming response that would
+        otherwise keep a pooled session from other requests. The session is closed when it is released or retired.
+        """
+        session = self.create_session()
+        session.dedicated = True
+        return session
 
     def create_session(self):
         session = requests.sessions.Session()
@@ -154,6 +375,7 @@ class BaseProtocol(object):
         session.session_id = sum(map(ord, str(os.urandom(100))))  # Used for debugging messages in services
         session.protocol = self
         session.auth = get_auth_instance(credentials=self.credentials, auth_type=self.auth_type)
+        session.last_used = time_func()
         # Create a copy of the headers because headers are mutable and session users may modify headers
         session.headers.update(DEFAULT_HEADERS.copy())
         session.mount('http://', adapter=self.get_adapter())
@@ -172,9 +394,273 @@ class BaseProtocol(object):
         return self.__class__.__name__ + repr((self.service_endpoint, self.credentials, self.auth_type))
 
 
+DISCOVERY_PERSISTENT_STORAGE = os.path.join(tempfile.gettempdir(), shelve_filename(name='discovery') + '.sqlite')
+
+
+class DiscoveryCache(object):
+    # Persists the service endpoint -> (auth type, docs auth type, server version) translation to the filesystem, so
+    # new processes can skip the round trips needed to probe the auth type and guess the server version. Entries expire
+    # after 'ttl' seconds. Set 'ttl' to 0 to disable the cache.
+    #
+    # Like the autodiscover cache, the persistent storage must not contain any sensitive information since the cache
+    # could be readable by unprivileged users. The auth type and server version are made publicly available by the
+    # server, so they are OK to cache. Just don't persist any credentials info.
+    #
+    # The persistent storage is an SQLite database in WAL mode, like the autodiscover cache, so it can safely be shared
+    # by multiple processes. Each thread uses its own database connection, which is kept open.
+    #
+    # If the server rejects the cached version or credentials, the corresponding cache entry must be purged.
+    TTL = 24 * 3600
+    DB_TIMEOUT = 10  # Seconds to wait for another process to release a write lock on the database
+
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self._local = local()  # Holds the database connection of each thread
+
+    @property
+    def _storage_file(self):
+        return DISCOVERY_PERSISTENT_STORAGE
+
+    def _connect(self):
+        conn = sqlite3.connect(self._storage_file, timeout=self.DB_TIMEOUT)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS discovery (service_endpoint TEXT PRIMARY KEY, '
+                     'auth_type TEXT NOT NULL, docs_auth_type TEXT, build TEXT, api_version TEXT, '
+                     'created REAL NOT NULL)')
+        return conn
+
+    def _get_connection(self):
+        conn, storage_file = getattr(self._local, 'conn', (None, None))
+        if conn is None or storage_file != self._storage_file:
+            conn = self._connect()
+            self._local.conn = conn, self._storage_file
+        return conn
+
+    def _close_connection(self):
+        conn, _ = getattr(self._local, 'conn', (None, None))
+        if conn is not None:
+            conn.close()
+        self._local.conn = None, None
+
+    def _execute(self, sql, params=()):
+        # Like the autodiscover cache, delete corrupt files and try again, but leave the file alone on operational
+        # errors like lock contention.
+        try:
+            with self._get_connection() as conn:
+                return conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            raise
+        except sqlite3.DatabaseError as e:
+            self._close_connection()
+            for f in glob.glob(self._storage_file + '*'):
+                log.warning('Deleting invalid discovery cache file %s (%r)', f, e)
+                os.unlink(f)
+        with self._get_connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def get(self, service_endpoint):
+        # Returns a (auth_type, docs_auth_type, version) tuple, or None if there is no valid entry
+        if not self.ttl:
+            return None
+        rows = self._execute('SELECT auth_type, docs_auth_type, build, api_version, created FROM discovery '
+                             'WHERE service_endpoint = ?', (str(service_endpoint),))
+        if not rows:
+            return None
+        auth_type, docs_auth_type, build, api_version, created = rows[0]
+        if not 0 <= time.time() - created < self.ttl:
+            log.debug('Discovery cache entry for %s has expired', service_endpoint)
+            return None
+        if build is None and api_version is None:
+            version = None
+        else:
+            version = Version(build=Build(*[int(v) for v in build.split('.')]) if build else None,
+                              api_version=api_version)
+        return auth_type, docs_auth_type, version
+
+    def set(self, service_endpoint, auth_type, docs_auth_type, version):
+        if not self.ttl:
+            return
+        build = str(version.build) if version and version.build else None
+        api_version = version.api_version if version else None
+        self._execute('INSERT OR REPLACE INTO discovery '
+                      '(service_endpoint, auth_type, docs_auth_type, build, api_version, created) '
+                      'VALUES (?, ?, ?, ?, ?, ?)',
+                      (str(service_endpoint), auth_type, docs_auth_type, build, api_version, time.time()))
+
+    def invalidate(self, service_endpoint):
+        # Don't fail on non-existing entries because we could end here multiple times due to race conditions
+        self._execute('DELETE FROM discovery WHERE service_endpoint = ?', (str(service_endpoint),))
+        log.debug('Invalidated discovery cache entry for %s', service_endpoint)
+
+    def clear(self):
+        # Wipe the entire cache
+        self._execute('DELETE FROM discovery')
+
+
+discovery_cache = DiscoveryCache()
+
+
+THROTTLING_PERSISTENT_STORAGE = os.path.join(tempfile.gettempdir(), shelve_filename(name='throttling') + '.sqlite')
+
+
+class ThrottlingRegistry(object):
+    """Shares throttling state between processes on the same machine, e.g. the workers of a multi-process deployment.
+
+    When one process is asked by the server to back off, the other processes using the same credentials and server
+    also wait until the back off period has ended. If 'max_concurrent' is set, no more than that number of requests are
+    in flight at any time for the same credentials and server, across all processes. Enable it like this:
+
+        BaseProtocol.THROTTLING_REGISTRY = ThrottlingRegistry(max_concurrent=16)
+
+    The state is stored in an SQLite database in WAL mode, like the autodiscover cache. Entries are keyed by a hash of
+    the server name and username, so no credentials info is persisted. A process that dies while a request is in
+    flight can't release its concurrency slot, so slots expire after 'lease_timeout' seconds.
+    """
+    LEASE_TIMEOUT = 300
+    POLL_INTERVAL = 0.1  # Seconds between attempts to get a concurrency slot
+    DB_TIMEOUT = 10  # Seconds to wait for another process to release a write lock on the database
+
+    def __init__(self, max_concurrent=None, lease_timeout=LEASE_TIMEOUT):
+        if max_concurrent is not None and max_concurrent < 1:
+            raise ValueError("'max_concurrent' %r must be a positive number" % max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.lease_timeout = lease_timeout
+        self._local = local()  # Holds the database connection of each thread
+
+    @property
+    def _storage_file(self):
+        return THROTTLING_PERSISTENT_STORAGE
+
+    def _connect(self):
+        # Transactions are started explicitly, so we can take the write lock before counting concurrency slots
+        conn = sqlite3.connect(self._storage_file, timeout=self.DB_TIMEOUT, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS back_off (key TEXT PRIMARY KEY, until REAL NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS slots '
+                     '(id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, expires REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS slots_key ON slots (key)')
+        return conn
+
+    def _get_connection(self):
+        conn, storage_file = getattr(self._local, 'conn', (None, None))
+        if conn is None or storage_file != self._storage_file:
+            conn = self._connect()
+            self._local.conn = conn, self._storage_file
+        return conn
+
+    def _close_connection(self):
+        conn, _ = getattr(self._local, 'conn', (None, None))
+        if conn is not None:
+            conn.close()
+        self._local.conn = None, None
+
+    def _transaction(self, func):
+        # Runs func(conn) in a write transaction. Like the autodiscover cache, delete empty or corrupt files and try
+        # again.
+        try:
+            return self._run_transaction(func)
+        except sqlite3.DatabaseError as e:
+            if isinstance(e, sqlite3.OperationalError) and 'locked' in str(e):
+                # Another process held the write lock for longer than DB_TIMEOUT. The file is fine.
+                raise
+            self._close_connection()
+            for f in glob.glob(self._storage_file + '*'):
+                log.warning('Deleting invalid throttling state file %s (%r)', f, e)
+                os.unlink(f)
+        return self._run_transaction(func)
+
+    def _run_transaction(self, func):
+        conn = self._get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            res = func(conn)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return res
+
+    @staticmethod
+    def _key(protocol):
+        return hashlib.sha256(
+            ('%s|%s' % (protocol.server, protocol.credentials.username)).lower().encode('utf-8')
+        ).hexdigest()
+
+    def try_acquire(self, protocol):
+        """Reserves a request to the server of the protocol without blocking. Returns a (slot, delay) tuple, where
+        'delay' is the number of seconds left of the shared back off period, or None if there are already
+        'max_concurrent' requests in flight. release() must be called with the slot when the request is done.
+        """
+        key = self._key(protocol)
+
+        def reserve(conn):
+            now = time.time()
+            row = conn.execute('SELECT until FROM back_off WHERE key = ?', (key,)).fetchone()
+            delay = max(row[0] - now, 0) if row else 0
+            if self.max_concurrent is None:
+                return None, delay
+            conn.execute('DELETE FROM slots WHERE expires <= ?', (now,))
+            in_flight = conn.execute('SELECT COUNT(*) FROM slots WHERE key = ?', (key,)).fetchone()[0]
+            if in_flight >= self.max_concurrent:
+                return None
+            slot = conn.execute('INSERT INTO slots (key, expires) VALUES (?, ?)',
+                                (key, now + delay + self.lease_timeout)).lastrowid
+            return slot, delay
+
+        return self._transaction(reserve)
+
+    def acquire(self, protocol):
+        """Blocks until a request may be sent to the server of the protocol. Returns a slot which must be passed to
+        release() when the request is done.
+        """
+        while True:
+            res = self.try_acquire(protocol)
+            if res is not None:
+                break
+            time.sleep(self.POLL_INTERVAL)
+        slot, delay = res
+        if delay:
+            log.warning('Another process was asked to back off. Sleeping %s seconds', delay)
+            time.sleep(delay)
+        return slot
+
+    def release(self, slot):
+        if slot is None:
+            return
+        self._transaction(lambda conn: conn.execute('DELETE FROM slots WHERE id = ?', (slot,)))
+
+    def back_off(self, protocol, seconds):
+        """Makes all processes wait 'seconds' seconds (60 if None) before sending new requests to the server of the
+        protocol with the same credentials.
+        """
+        key = self._key(protocol)
+        until = time.time() + (seconds or 60)
+        self._transaction(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO back_off (key, until) '
+            'VALUES (?, max(?, COALESCE((SELECT until FROM back_off WHERE key = ?), 0)))', (key, until, key)
+        ))
+
+    def clear(self):
+        # Wipe all shared state
+        def clear(conn):
+            conn.execute('DELETE FROM back_off')
+            conn.execute('DELETE FROM slots')
+        self._transaction(clear)
+
+
 class CachingProtocol(type):
     _protocol_cache = {}
     _protocol_cache_lock = Lock()
+    _protocol_cache_swept = time_func()
+    # The maximum number of protocols to keep in the cache, and the number of seconds a protocol may be unused before
+    # it is evicted from the cache. Evicted protocols close their idle connections, but stay usable for anyone still
+    # holding a reference to them. Their thread pool is closed when the protocol is garbage collected or closed
+    # explicitly. Set to None to disable the limit.
+    MAX_CACHED_PROTOCOLS = 1000
+    PROTOCOL_IDLE_TIMEOUT = 3600
+    # Idle protocols and sessions are looked for at most once every PROTOCOL_CACHE_SWEEP_INTERVAL seconds, when a
+    # protocol is created or a session is released.
+    PROTOCOL_CACHE_SWEEP_INTERVAL = 60
 
     def __call__(cls, *args, **kwargs):
         # Cache Protocol instances that point to the same endpoint and use the same credentials. This ensures that we
@@ -188,6 +674,7 @@ class CachingProtocol(type):
         # combination should be safe.
         _protocol_cache_key = kwargs['service_endpoint'], kwargs['credentials']
 
+        cls._sweep_cache_if_due()
         protocol = cls._protocol_cache.get(_protocol_cache_key)
         if isinstance(protocol, Exception):
             # The input data leads to a TransportError. Re-throw
@@ -198,6 +685,7 @@ class CachingProtocol(type):
         # Acquire lock to guard against multiple threads competing to cache information. Having a per-server lock is
         # probably overkill although it would reduce lock contention.
         log.debug('Waiting for _protocol_cache_lock')
+        protocols_to_reap, evicted = [], []
         with cls._protocol_cache_lock:
             protocol = cls._protocol_cache.get(_protocol_cache_key)
             if isinstance(protocol, Exception):
@@ -215,8 +703,69 @@ class CachingProtocol(type):
                 cls._protocol_cache[_protocol_cache_key] = e
                 raise e
             cls._protocol_cache[_protocol_cache_key] = protocol
+            if cls.MAX_CACHED_PROTOCOLS is not None and len(cls._protocol_cache) > cls.MAX_CACHED_PROTOCOLS:
+                protocols_to_reap, evicted = cls._sweep_cache()
+        cls._reap_idle_sessions(protocols_to_reap, evicted)
         return protocol
 
+    def _sweep_cache_if_due(cls):
+        # Sweeps the cache if it hasn't been swept for PROTOCOL_CACHE_SWEEP_INTERVAL seconds
+        if time_func() - CachingProtocol._protocol_cache_swept < cls.PROTOCOL_CACHE_SWEEP_INTERVAL:
+            return
+        # Don't wait for the lock. Another thread is already sweeping or creating a protocol. This thread may even hold
+        # the lock itself, if a protocol releases sessions while it is being created.
+        if not cls._protocol_cache_lock.acquire(False):
+            return
+        try:
+            if time_func() - CachingProtocol._protocol_cache_swept < cls.PROTOCOL_CACHE_SWEEP_INTERVAL:
+                # The cache was swept in another thread
+                return
+            protocols_to_reap, evicted = cls._sweep_cache()
+        finally:
+            cls._protocol_cache_lock.release()
+        cls._reap_idle_sessions(protocols_to_reap, evicted)
+
+    def _sweep_cache(cls):
+        # Evict protocols that have been idle for too long, and then the least recently used protocols until the cache
+        # is within MAX_CACHED_PROTOCOLS. Must be called while holding the cache lock. Returns the remaining protocols
+        # and the evicted protocols. Reaping their idle sessions may block, so callers must do that after releasing the
+        # lock.
+        CachingProtocol._protocol_cache_swept = time_func()
+        cache = cls._protocol_cache
+        evicted = []
+        if cls.PROTOCOL_IDLE_TIMEOUT is not None:
+            for key, protocol in list(cache.items()):
+                if isinstance(protocol, Exception):
+                    continue
+                if time_func() - protocol.last_used >= cls.PROTOCOL_IDLE_TIMEOUT:
+                    evicted.append(cls._evict(key))
+        if cls.MAX_CACHED_PROTOCOLS is not None and len(cache) > cls.MAX_CACHED_PROTOCOLS:
+            # Cached exceptions are cheap to re-create, so evict them before any protocols
+            by_last_used = sorted(
+                cache.items(), key=lambda i: -1 if isinstance(i[1], Exception) else i[1].last_used
+            )
+            for key, _ in by_last_used[:len(cache) - cls.MAX_CACHED_PROTOCOLS]:
+                evicted.append(cls._evict(key))
+        remaining = [protocol for protocol in cache.values() if not isinstance(protocol, Exception)]
+        return remaining, [protocol for protocol in evicted if protocol is not None]
+
+    def _evict(cls, key):
+        # Only drop our reference. Accounts may still be using the protocol. Returns the evicted protocol, if any.
+        protocol = cls._protocol_cache.pop(key)
+        if isinstance(protocol, Exception):
+            return None
+        log.debug("Service endpoint '%s': Evicting protocol from cache", key[0])
+        return protocol
+
+    @staticmethod
+    def _reap_idle_sessions(protocols, evicted):
+        for protocol in protocols:
+            protocol.reap_idle_sessions()
+        for protocol in evicted:
+            # Close all connections that are not in use. Sessions reconnect when needed, so this is safe even if an
+            # Account is still using the protocol. The thread pool is closed when the protocol is garbage collected.
+            protocol.reap_idle_sessions(max_idle=0)
+
     @classmethod
     def clear_cache(mcs):
         for key, protocol in mcs._protocol_cache.items():
@@ -239,11 +788,25 @@ class Protocol(with_metaclass(CachingProtocol, BaseProtocol)):
         self.messages_url = '%s://%s/EWS/messages.xsd' % (scheme, self.server)
         self.types_url = '%s://%s/EWS/types.xsd' % (scheme, self.server)
 
+        # Get the auth type and version from the discovery cache, if we need them and another process already probed
+        # the server.
+        cached = discovery_cache.get(self.service_endpoint) if self.auth_type is None or not version else None
+        # Services only need to invalidate the cache entry if the value that failed came from the cache
+        self.auth_type_from_cache = False
+        self.version_from_cache = False
+        if cached:
+            log.debug('Using cached auth type and version for %s: %s', self.service_endpoint, cached)
+            if self.auth_type is None:
+                self.auth_type = cached[0]
+                self.auth_type_from_cache = True
+        probed = False
+
         # Autodetect authentication type if necessary
         # pylint: disable=access-member-before-definition
         if self.auth_type is None:
             self.auth_type = get_service_authtype(service_endpoint=self.service_endpoint, versions=API_VERSIONS,
                                                   name=self.credentials.username)
+            probed = True
 
         # Default to the auth type used by the service. We only need this if 'version' is None
         self.docs_auth_type = self.auth_type
@@ -252,10 +815,14 @@ class Protocol(with_metaclass(CachingProtocol, BaseProtocol)):
         # We also want to re-use sessions, to avoid the NTLM auth handshake on every request.
         self._session_pool = self._create_session_pool()
         self._session_pool_lock = Lock()
+        self._async_protocol = None  # The AsyncProtocol of this protocol, created by AsyncProtocol.from_protocol()
 
         if version:
             isinstance(version, Version)
             self.version = version
+        elif cached:
+            self.docs_auth_type, self.version = cached[1:]
+            self.version_from_cache = True
         else:
             # Version.guess() needs auth objects and a working session pool
             try:
@@ -264,13 +831,35 @@ class Protocol(with_metaclass(CachingProtocol, BaseProtocol)):
             except TransportError:
                 pass
             self.version = Version.guess(self)
+            probed = True
+
+        if probed:
+            discovery_cache.set(self.service_endpoint, auth_type=self.auth_type, docs_auth_type=self.docs_auth_type,
+                                version=self.version)
+
+        if self.WARM_UP_SESSIONS:
+            self.warm_up(self.WARM_UP_SESSIONS)
 
     def _create_session_pool(self):
-        # Create a pool to reuse sessions containing connections to the server
-        session_pool = LifoQueue(maxsize=self._session_pool_size)
-        for _ in range(self._session_pool_size):
-            session_pool.put(self.create_session(), block=False)
-        return session_pool
+        # Create a pool to reuse sessions containing connections to the server. Sessions are added by get_session() when
+        # they are first needed.
+        self._session_count = 0
+        return LifoQueue(maxsize=self._session_pool_size)
+
+    def release_session(self, session):
+        super(Protocol, self).release_session(session)
+        # Long-running programs may create all their protocols at startup, so also look for idle protocols and sessions
+        # here.
+        type(self)._sweep_cache_if_due()
+
+    def close(self):
+        # Also called when the protocol is garbage collected. The thread pool is re-created if the protocol is used
+        # again.
+        super(Protocol, self).close()
+        thread_pool = self.__dict__.pop('thread_pool', None)
+        if thread_pool is not None:
+            log.debug('Server %s: Closing thread pool', self.server)
+            thread_pool.close()
 
     @threaded_cached_property
     def thread_pool(self):
@@ -278,7 +867,7 @@ class Protocol(with_metaclass(CachingProtocol, BaseProtocol)):
         # larger than the connection pool so we have time to process data without idling the connection.
         # Create the pool as the last thing here, since we may fail in the version or auth type guessing, which would
         # leave open threads around to be garbage collected.
-        thread_poolsize = 4 * self._session_pool_size
+        thread_poolsize = 4 * max(self._session_pool_size, self.max_session_pool_size)
         return ThreadPool(processes=thread_poolsize)
 
     def get_timezones(self, timezones=None, return_full_timezone_data=False):
@@ -404,6 +993,8 @@ class Protocol(with_metaclass(CachingProtocol, BaseProtocol)):
             pass
         del state['_session_pool']
         del state['_session_pool_lock']
+        del state['_session_count_lock']
+        del state['_async_protocol']
         return state
 
     def __setstate__(self, state):
@@ -411,6 +1002,8 @@ class Protocol(with_metaclass(CachingProtocol, BaseProtocol)):
         self.__dict__.update(state)
         self._session_pool = self._create_session_pool()
         self._session_pool_lock = Lock()
+        self._session_count_lock = Lock()
+        self._async_protocol = None
 
     def __str__(self):
         return '''\
@@ -429,6 +1022,381 @@ XSD auth: %s''' % (
         )
 
 
+class Autotuner(object):
+    """Adjusts the chunk size of pooled services (CreateItem, GetItem etc.) and the session pool size of a protocol,
+    based on the measured throughput, request latency, payload size and throttling errors from the server.
+
+    Requests are measured in windows of WINDOW_SIZE requests per service. The chunk size of a service is moved in steps
+    of CHUNK_SIZE_FACTOR in one direction as long as the throughput (items per second) improves, and in the other
+    direction when it deteriorates. Throttling errors (ErrorServerBusy, ErrorTimeoutExpired) halve the chunk size. The
+    session pool size is increased by one session after each window without throttling errors that didn't lower the
+    throughput. Pool growth obeys the same max size (BaseProtocol.MAX_SESSION_POOLSIZE) and cool-down period
+    (BaseProtocol.SESSION_POOLSIZE_COOLDOWN) as the recovery after throttling, which the autotuner replaces while it is
+    attached. Throttling errors already decrease the session pool size.
+
+    Enable autotuning for a protocol like this:
+
+        account.protocol.autotuner = Autotuner(protocol=account.protocol)
+    """
+    WINDOW_SIZE = 8  # The number of requests needed to measure throughput
+    CHUNK_SIZE_FACTOR = 1.25  # Multiplicative step size when searching for the best chunk size
+    TOLERANCE = 0.05  # Throughput changes smaller than this fraction are considered noise
+
+    def __init__(self, protocol, initial_chunk_size=None, min_chunk_size=10, max_chunk_size=500,
+                 max_payload_size=10*1024*1024):
+        """
+        :param protocol: The protocol to tune
+        :param initial_chunk_size: The chunk size to start from. Defaults to services.CHUNK_SIZE
+        :param min_chunk_size: The smallest chunk size to use
+        :param max_chunk_size: The largest chunk size to use
+        :param max_payload_size: The maximum size of a request, in bytes. Limits the chunk size for large items
+        """
+        from .services import CHUNK_SIZE
+        if initial_chunk_size is None:
+            initial_chunk_size = min(max(CHUNK_SIZE, min_chunk_size), max_chunk_size)
+        if not 1 <= min_chunk_size <= initial_chunk_size <= max_chunk_size:
+            raise ValueError("'initial_chunk_size' %r must be between 'min_chunk_size' %r and 'max_chunk_size' %r" % (
+                initial_chunk_size, min_chunk_size, max_chunk_size))
+        self.protocol = protocol
+        self.initial_chunk_size = initial_chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.max_payload_size = max_payload_size
+        self._services = {}  # Tuning state per service name
+        self._throttled = False  # True if we had throttling errors since the session pool size was last evaluated
+        self._lock = Lock()
+
+    def _get_state(self, service_name):
+        try:
+            return self._services[service_name]
+        except KeyError:
+            state = self._services[service_name] = dict(
+                chunk_size=self.initial_chunk_size,
+                direction=1,  # The direction we're currently moving the chunk size in
+                throughput=None,  # Items per second in the previous window
+            )
+            self._reset_window(state)
+            return state
+
+    @staticmethod
+    def _reset_window(state):
+        state.update(window_start=None, window_requests=0, window_items=0, window_bytes=0, window_latency=0.0)
+
+    def get_chunk_size(self, service_name):
+        with self._lock:
+            return self._get_state(service_name)['chunk_size']
+
+    def chunkify(self, service_name, iterable):
+        """Like util.chunkify(), but uses the current chunk size of the service for each new chunk"""
+        iterator = iter(iterable)
+        while True:
+            chunk = list(islice(iterator, self.get_chunk_size(service_name)))
+            if not chunk:
+                break
+            yield chunk
+
+    def record(self, service_name, item_count, duration, payload_size):
+        """Records a successful request
+
+        :param service_name: The name of the service
+        :param item_count: The number of items in the request
+        :param duration: The time it took to get a response, in seconds
+        :param payload_size: The size of the request, in bytes
+        """
+        now = time_func()
+        with self._lock:
+            state = self._get_state(service_name)
+            if state['window_start'] is None:
+                state['window_start'] = now - duration
+            state['window_requests'] += 1
+            state['window_items'] += item_count
+            state['window_bytes'] += payload_size
+            state['window_latency'] += duration
+            if state['window_requests'] < self.WINDOW_SIZE:
+                return
+            throughput = state['window_items'] / max(now - state['window_start'], 0.001)
+            log.debug('%s: %s requests, %.1f items/sec, %.2f sec/request, %s bytes/request', service_name,
+                      state['window_requests'], throughput, state['window_latency'] / state['window_requests'],
+                      int(state['window_bytes'] / state['window_requests']))
+            improved = state['throughput'] is None or throughput >= state['throughput'] * (1 - self.TOLERANCE)
+            if not improved:
+                # We went too far. Turn around.
+                state['direction'] = -state['direction']
+            self._adjust_chunk_size(service_name, state)
+            state['throughput'] = throughput
+            self._reset_window(state)
+            increase_pool = improved and not self._throttled
+            self._throttled = False
+        if increase_pool:
+            # Obeys the max size and the cool-down period of the protocol
+            self.protocol._recover_poolsize()
+
+    def _adjust_chunk_size(self, service_name, state):
+        old_chunk_size = state['chunk_size']
+        if state['direction'] > 0:
+            chunk_size = max(int(old_chunk_size * self.CHUNK_SIZE_FACTOR), old_chunk_size + 1)
+        else:
+            chunk_size = int(old_chunk_size / self.CHUNK_SIZE_FACTOR)
+        # Don't send requests larger than the max payload size
+        bytes_per_item = state['window_bytes'] / max(state['window_items'], 1)
+        if bytes_per_item:
+            chunk_size = min(chunk_size, int(self.max_payload_size / bytes_per_item))
+        chunk_size = min(max(chunk_size, self.min_chunk_size), self.max_chunk_size)
+        if chunk_size in (self.min_chunk_size, self.max_chunk_size):
+            # Bounce off the limits
+            state['direction'] = 1 if chunk_size == self.min_chunk_size else -1
+        if chunk_size != old_chunk_size:
+            log.debug('%s: Changing chunk size from %s to %s', service_name, old_chunk_size, chunk_size)
+        state['chunk_size'] = chunk_size
+
+    def record_throttling(self, service_name):
+        """Records a throttling error from the server. Halves the chunk size of the service and starts a new window"""
+        with self._lock:
+            state = self._get_state(service_name)
+            old_chunk_size = state['chunk_size']
+            state['chunk_size'] = max(int(old_chunk_size / 2), self.min_chunk_size)
+            state['direction'] = -1
+            state['throughput'] = None
+            self._reset_window(state)
+            self._throttled = True
+        log.debug('%s: Throttled by server. Changing chunk size from %s to %s', service_name, old_chunk_size,
+                  state['chunk_size'])
+
+    def __getstate__(self):
+        # Locks cannot be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+class RateLimiter(object):
+    """Limits the rate of requests and the number of concurrent requests, before the server starts throttling us.
+
+    Exchange throttling policies apply to the budget of the connecting user, not to a single connection. A RateLimiter
+    can be shared by any number of protocols, accounts and threads, e.g. all accounts accessed with the same
+    ServiceAccount:
+
+        credentials = ServiceAccount(..., rate_limiter=RateLimiter(rate=20, max_concurrent=10))
+
+    or attached to a single protocol:
+
+        account.protocol.rate_limiter = RateLimiter(rate=5)
+
+    Requests are admitted by a token bucket holding up to 'burst' tokens which refills at 'rate' tokens per second. When
+    the server asks us to back off, no requests are admitted for the requested number of seconds and the rate is
+    halved, down to 'min_rate'. After that, each successful request increases the rate by RECOVERY_STEP times the
+    original rate until it is back at the original rate.
+    """
+    RECOVERY_STEP = 0.05  # Fraction of the original rate to add after each successful request
+    POLL_INTERVAL = 0.05  # Seconds between attempts to get a concurrency slot when we can't block a thread
+
+    def __init__(self, rate=10.0, burst=None, max_concurrent=None, min_rate=0.1):
+        """
+        :param rate: The maximum number of requests per second
+        :param burst: The number of requests that may be sent at once after a quiet period. Defaults to 'rate'
+        :param max_concurrent: The maximum number of requests in flight at any time. None means no limit
+        :param min_rate: The rate will not be lowered below this value when the server asks us to back off
+        """
+        if burst is None:
+            burst = max(rate, 1)
+        if not 0 < min_rate <= rate:
+            raise ValueError("'min_rate' %r must be positive and no larger than 'rate' %r" % (min_rate, rate))
+        if burst < 1:
+            raise ValueError("'burst' %r must be at least 1" % burst)
+        if max_concurrent is not None and max_concurrent < 1:
+            raise ValueError("'max_concurrent' %r must be a positive number" % max_concurrent)
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.min_rate = min_rate
+        self._tokens = burst
+        self._tokens_updated = time_func()
+        self._paused_until = 0.0
+        self._concurrent = 0
+        self._lock = Condition(Lock())
+
+    def try_acquire(self):
+        """Reserves a request without blocking. Returns the number of seconds the caller must wait before sending the
+        request, or None if there are already 'max_concurrent' requests in flight. If a delay is returned, release()
+        must be called when the request is done.
+        """
+        with self._lock:
+            return self._reserve()
+
+    def _reserve(self):
+        # Must be called while holding the lock. Taking a token may leave the bucket in debt, which the caller pays off
+        # by waiting. This keeps requests in FIFO order without anyone having to poll the bucket.
+        if self.max_concurrent is not None and self._concurrent >= self.max_concurrent:
+            return None
+        now = time_func()
+        self._tokens = min(self._tokens + (now - self._tokens_updated) * self.rate, self.burst)
+        self._tokens_updated = now
+        self._tokens -= 1
+        self._concurrent += 1
+        return max(-self._tokens / self.rate, self._paused_until - now, 0)
+
+    def acquire(self):
+        """Blocks until a request may be sent. release() must be called when the request is done"""
+        with self._lock:
+            while True:
+                delay = self._reserve()
+                if delay is not None:
+                    break
+                self._lock.wait()
+        if delay:
+            log.debug('Rate limit reached. Sleeping %.2f seconds', delay)
+            time.sleep(delay)
+
+    def release(self):
+        """Marks a request as done, and lets the rate recover if it was lowered by back_off()"""
+        with self._lock:
+            self._concurrent -= 1
+            if self.rate < self.max_rate:
+                self.rate = min(self.rate + self.max_rate * self.RECOVERY_STEP, self.max_rate)
+            self._lock.notify()
+
+    def back_off(self, seconds):
+        """Called when the server asks us to back off. 'seconds' is the BackOffMilliseconds value of the error
+        converted to seconds, or None if the server didn't suggest a value.
+        """
+        with self._lock:
+            now = time_func()
+            if seconds:
+                self._paused_until = max(self._paused_until, now + seconds)
+            old_rate = self.rate
+            self.rate = max(self.rate / 2, self.min_rate)
+            # Don't let requests through in a burst when the back off period ends
+            self._tokens = min(self._tokens, 0)
+            self._tokens_updated = now
+        log.debug('Server requested back off (%s seconds). Lowering rate limit from %.2f to %.2f requests/sec',
+                  seconds, old_rate, self.rate)
+
+    def __getstate__(self):
+        # Locks cannot be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Condition(Lock())
+        self._concurrent = 0
+        self._tokens_updated = time_func()
+        self._paused_until = 0.0
+
+
+class RetryPolicy(object):
+    """Decides how long post_ratelimited() waits before retrying a request that failed with a transient error, and
+    when to give up. Only used by credentials that are not fail_fast, i.e. ServiceAccount.
+
+    Waits grow exponentially from 'base_wait' seconds, up to 'max_backoff' seconds. With 'jitter' enabled, the actual
+    wait is drawn uniformly between zero and that value ("full jitter"), so threads and processes that failed at the
+    same time don't all retry at the same time and trigger throttling again. If the server sent a Retry-After header,
+    we wait at least that long. We give up when the total wait for a request would exceed the 'max_wait' of the
+    credentials, or when the request would not succeed within 'deadline' seconds of the first attempt.
+
+    If 'retry_budget' is set, retries are limited to that number plus 'budget_ratio' retries per successful request,
+    per protocol. This stops retries from piling up when a server is down for everyone, instead of for a single
+    request. Statistics about retries are available in 'stats'.
+
+    Set a different policy on a protocol like this:
+
+        account.protocol.retry_policy = RetryPolicy(deadline=300)
+    """
+    def __init__(self, base_wait=10, max_backoff=600, jitter=True, deadline=None, retry_budget=None,
+                 budget_ratio=0.1):
+        """
+        :param base_wait: The wait before the first retry, in seconds. Doubles for every retry
+        :param max_backoff: The longest wait between two attempts, in seconds
+        :param jitter: If True, randomize waits between zero and the exponential back off value
+        :param deadline: The max number of seconds from the first attempt until the request must have succeeded
+        :param retry_budget: The max number of retries that may be saved up. None means no limit
+        :param budget_ratio: The number of retries added to the budget for each successful request
+        """
+        if not 0 < base_wait <= max_backoff:
+            raise ValueError("'base_wait' %r must be positive and no larger than 'max_backoff' %r" % (
+                base_wait, max_backoff))
+        self.base_wait = base_wait
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_budget = retry_budget
+        self.budget_ratio = budget_ratio
+        self._budget = retry_budget
+        self._stats = dict(successes=0, retries=0, total_wait=0.0, gave_up=0)
+        self._lock = Lock()
+
+    @property
+    def stats(self):
+        """A dict with the number of successful requests, retries, total seconds waited before retrying and the number
+        of requests we gave up on.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    @staticmethod
+    def _get_retry_after(response):
+        # Only supports the delay-seconds form of the Retry-After header
+        try:
+            return max(float(response.headers.get('Retry-After', '')), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def get_wait(self, protocol, response, retry, total_wait, started):
+        """Returns the number of seconds to wait before the next attempt, or raises RateLimitError if we should give up
+
+        :param protocol: The protocol sending the request
+        :param response: The failed response
+        :param retry: The number of retries of this request so far
+        :param total_wait: The number of seconds we have waited before retrying this request so far
+        :param started: The time_func() value when the request was first attempted
+        """
+        back_off = min(self.base_wait * 2 ** retry, self.max_backoff)
+        wait = random.uniform(0, back_off) if self.jitter else back_off
+        wait = max(wait, self._get_retry_after(response))
+        msg = None
+        with self._lock:
+            if total_wait + wait > protocol.credentials.max_wait:
+                msg = 'Max timeout reached'
+            elif self.deadline is not None and time_func() - started + wait > self.deadline:
+                msg = 'Deadline reached'
+            elif self._budget is not None and self._budget < 1:
+                msg = 'Retry budget exhausted'
+            if msg:
+                self._stats['gave_up'] += 1
+            else:
+                if self._budget is not None:
+                    self._budget -= 1
+                self._stats['retries'] += 1
+                self._stats['total_wait'] += wait
+        if msg:
+            # We lost patience. Session is cleaned up in outer loop
+            raise RateLimitError(msg, url=response.url, status_code=response.status_code, total_wait=total_wait)
+        return wait
+
+    def record_success(self):
+        """Records a successful request, which adds to the retry budget"""
+        with self._lock:
+            self._stats['successes'] += 1
+            if self._budget is not None:
+                self._budget = min(self._budget + self.budget_ratio, self.retry_budget)
+
+    def __getstate__(self):
+        # Locks cannot be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
 class NoVerifyHTTPAdapter(requests.adapters.HTTPAdapter):
     # An HTTP adapter that ignores TLS validation errors. Use at own risk.
     def cert_verify(self, conn, url, verify, cert):
@@ -2,7 +2,8 @@
 from __future__ import unicode_literals
 
 from copy import deepcopy
-from itertools import islice
+import heapq
+from itertools import chain, islice
 import logging
 import warnings
 
@@ -13,6 +14,7 @@ from .fields import FieldPath, FieldOrder
 from .properties import InvalidField
 from .restriction import Q
 from .services import CHUNK_SIZE
+from .util import ThreadedIterator
 from .version import EXCHANGE_2010
 
 log = logging.getLogger(__name__)
@@ -79,6 +81,9 @@ class QuerySet(SearchableMixIn):
         self.return_format = self.NONE
         self.calendar_view = None
         self.page_size = None
+        self.prefetch_pages = 0  # The number of pages to request ahead of the page being consumed
+        self.fan_out = False  # Query each folder in a separate FindItem request, concurrently
+        self.chunk_size = None  # The number of items to fetch per GetItem request. Defaults to page_size
         self.max_items = None
         self.offset = 0
 
@@ -110,6 +115,9 @@ class QuerySet(SearchableMixIn):
         new_qs.return_format = self.return_format
         new_qs.calendar_view = self.calendar_view
         new_qs.page_size = self.page_size
+        new_qs.prefetch_pages = self.prefetch_pages
+        new_qs.fan_out = self.fan_out
+        new_qs.chunk_size = self.chunk_size
         new_qs.max_items = self.max_items
         new_qs.offset = self.offset
         return new_qs
@@ -181,8 +189,9 @@ class QuerySet(SearchableMixIn):
             self.NONE: self._as_items,
         }[return_format](items)
 
-    def _query(self):
-        from .folders import SHALLOW
+    def _get_query_fields(self):
+        # Returns the fields to request from the server, whether any of them are complex fields, the fields to sort by
+        # server-side and the fields that we only need for client-side sorting.
         from .items import Persona
         if self.only_fields is None:
             # We didn't restrict list of field paths. Get all fields from the server, including extended properties.
@@ -198,23 +207,30 @@ class QuerySet(SearchableMixIn):
             additional_fields = self._additional_fields()
             complex_fields_requested = any(f.field.is_complex for f in additional_fields)
 
-        # EWS can do server-side sorting on multiple fields. A caveat is that server-side sorting is not supported
-        # for calendar views. In this case, we do all the sorting client-side.
-        if self.calendar_view:
-            must_sort_clientside = bool(self.order_fields)
-            order_fields = None
-        else:
-            must_sort_clientside = False
-            order_fields = self.order_fields
-
-        if must_sort_clientside:
-            # Also fetch order_by fields that we only need for client-side sorting.
+        # Server-side sorting is not supported for calendar views
+        order_fields = None if self.calendar_view else self.order_fields
+        if self._must_sort_clientside or (self._must_fan_out and order_fields):
+            # Also fetch order_by fields that we only need for client-side sorting or merging.
             extra_order_fields = {f.field_path for f in self.order_fields} - additional_fields
             if extra_order_fields:
                 additional_fields.update(extra_order_fields)
         else:
             extra_order_fields = set()
+        return additional_fields, complex_fields_requested, order_fields, extra_order_fields
 
+    @property
+    def _must_sort_clientside(self):
+        # EWS can do server-side sorting on multiple fields. A caveat is that server-side sorting is not supported
+        # for calendar views. In this case, we do all the sorting client-side.
+        return bool(self.calendar_view and self.order_fields)
+
+    @property
+    def _must_fan_out(self):
+        return self.fan_out and self.request_type == self.ITEM and len(self.folder_collection) > 1
+
+    def _query(self):
+        from .folders import SHALLOW
+        additional_fields, complex_fields_requested, order_fields, extra_order_fields = self._get_query_fields()
         if self.request_type == self.PERSONA:
             if len(self.folder_collection) != 1:
                 raise ValueError('Personas can only be queried on a single folder')
@@ -237,28 +253,76 @@ class QuerySet(SearchableMixIn):
                 page_size=self.page_size,
                 max_items=self.max_items,
                 offset=self.offset,
+                prefetch_pages=self.prefetch_pages,
             )
 
             if complex_fields_requested:
                 # The FindItem service does not support complex field types. Tell find_items() to return
-                # (id, changekey) tuples, and pass that to fetch().
+                # (id, changekey) tuples, and pass that to fetch(). When merging sorted results, we need the values
+                # of the order_by fields, too.
                 find_item_kwargs['additional_fields'] = None
-                items = self.folder_collection.account.fetch(
-                    ids=self.folder_collection.find_items(self.q, **find_item_kwargs),
-                    only_fields=additional_fields,
-                    chunk_size=self.page_size,
-                )
+                if self._must_fan_out and order_fields:
+                    find_item_kwargs['additional_fields'] = {f.field_path for f in order_fields}
+                items = self._find_and_fetch_items(find_item_kwargs=find_item_kwargs, only_fields=additional_fields)
             else:
                 if not additional_fields:
                     # If additional_fields is the empty set, we only requested ID and changekey fields. We can then
                     # take a shortcut by using (shape=ID_ONLY, additional_fields=None) to tell find_items() to return
                     # (id, changekey) tuples. We'll post-process those later.
                     find_item_kwargs['additional_fields'] = None
-                items = self.folder_collection.find_items(self.q, **find_item_kwargs)
-
-        if not must_sort_clientside:
-            return items
+                items = self._find_items(find_item_kwargs=find_item_kwargs)
+
+        if self._must_sort_clientside:
+            return self._sort_clientside(items=items, extra_order_fields=extra_order_fields)
+        if extra_order_fields:
+            # Nullify the fields we only needed for merging before returning
+            return (_rinse_item(i, extra_order_fields) for i in items)
+        return items
+
+    def _find_and_fetch_items(self, find_item_kwargs, only_fields):
+        # Find item IDs with FindItem and fetch the items with GetItem, in a two-stage pipeline. The FindItem stage runs
+        # in a separate thread, buffering up to two GetItem chunks of IDs, so finding IDs and fetching items overlap.
+        chunk_size = self.chunk_size or self.page_size
+        ids = ThreadedIterator(self._find_items(find_item_kwargs=find_item_kwargs),
+                               buffer_size=2 * (chunk_size or CHUNK_SIZE))
+        items = self.folder_collection.account.fetch(ids=ids, only_fields=only_fields, chunk_size=chunk_size)
+        try:
+            for i in items:
+                yield i
+        finally:
+            # Stop both stages if the consumer stops early. This cancels any outstanding GetItem chunks.
+            items.close()
+            ids.close()
+
+    def _find_items(self, find_item_kwargs):
+        if not self._must_fan_out:
+            return self.folder_collection.find_items(self.q, **find_item_kwargs)
+        return self._fan_out_find_items(find_item_kwargs=find_item_kwargs)
+
+    def _fan_out_find_items(self, find_item_kwargs):
+        # Query each folder in a separate FindItem request, in separate threads, so folders are paged independently
+        # and concurrently. Results are merged on the order_by fields, if any, and otherwise returned in folder order.
+        # Offset and max_items apply to the merged result, so we need to get 'offset + max_items' items per folder.
+        from .folders import FolderCollection
+        offset, max_items = find_item_kwargs['offset'], find_item_kwargs['max_items']
+        folder_kwargs = dict(find_item_kwargs, offset=0, max_items=None if max_items is None else offset + max_items)
+        buffer_size = self.page_size or CHUNK_SIZE
+        iterators = [ThreadedIterator(
+            FolderCollection(account=self.folder_collection.account, folders=[f]).find_items(self.q, **folder_kwargs),
+            buffer_size=buffer_size,
+        ) for f in self.folder_collection.folders]
+        try:
+            if find_item_kwargs['order_fields']:
+                items = _merge_sorted(iterators, order_fields=find_item_kwargs['order_fields'])
+            else:
+                items = chain(*iterators)
+            for i in islice(items, offset, None if max_items is None else offset + max_items):
+                yield i
+        finally:
+            for iterator in iterators:
+                iterator.close()
 
+    def _sort_clientside(self, items, extra_order_fields):
         # Resort to client-side sorting of the order_by fields. This is greedy. Sorting in Python is stable, so when
         # sorting on multiple fields, we can just do a sort on each of the requested fields in reverse order. Reverse
         # each sort operation if the field was marked as such.
@@ -300,6 +364,11 @@ class QuerySet(SearchableMixIn):
             yield val
         self._cache = _cache
 
+    def __aiter__(self):
+        # Support 'async for' iteration on Python 3.6+. See exchangelib.aio for details
+        from .aio import iterate_queryset
+        return iterate_queryset(self)
+
     def __len__(self):
         if self.is_cached:
             return len(self._cache)
@@ -627,6 +696,49 @@ def _get_value_or_default(item, field_order):
     return val
 
 
+class _SortKey(object):
+    # Compares items on a list of FieldOrder objects, like the server does. None values are sorted first.
+    __slots__ = ('values', 'order_fields')
+
+    def __init__(self, item, order_fields):
+        self.values = [_get_value_or_default(item, f) for f in order_fields]
+        self.order_fields = order_fields
+
+    def __lt__(self, other):
+        for f, a, b in zip(self.order_fields, self.values, other.values):
+            if a == b:
+                continue
+            if a is None or b is None:
+                is_less = a is None
+            else:
+                is_less = a < b
+            return is_less != f.reverse
+        return False
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+
+def _merge_sorted(iterables, order_fields):
+    # A k-way merge of iterables that are each sorted on 'order_fields'. Items that compare equal are returned in the
+    # order of the iterables.
+    heap = []
+    iterators = [iter(i) for i in iterables]
+    for n, iterator in enumerate(iterators):
+        for item in iterator:
+            heap.append((_SortKey(item, order_fields), n, item))
+            break
+    heapq.heapify(heap)
+    while heap:
+        _, n, item = heap[0]
+        yield item
+        for next_item in iterators[n]:
+            heapq.heapreplace(heap, (_SortKey(next_item, order_fields), n, next_item))
+            break
+        else:
+            heapq.heappop(heap)
+
+
 def _rinse_item(i, fields_to_nullify):
     # Set fields in fields_to_nullify to None. Make sure to accept exceptions.
     if isinstance(i, Exception):
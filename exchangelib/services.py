@@ -13,10 +13,13 @@ Exchange EWS references:
 from __future__ import unicode_literals
 
 import abc
-from collections import OrderedDict
+from collections import OrderedDict, deque
+import copy
 import datetime
+from inspect import isgenerator
 from itertools import chain
 import logging
+from threading import Lock, local
 import traceback
 
 from six import text_type
@@ -37,12 +40,112 @@ from .ewsdatetime import EWSDateTime, NaiveDateTimeNotAllowed
 from .transport import wrap, extra_headers
 from .util import chunkify, create_element, add_xml_child, get_xml_attr, to_xml, post_ratelimited, \
     xml_to_str, set_xml_value, peek, xml_text_to_value, SOAPNS, TNS, MNS, ENS, ParseError, StreamingBase64Parser, \
-    StreamingContentHandler, DummyResponse, ElementNotFound
-from .version import EXCHANGE_2010, EXCHANGE_2010_SP2, EXCHANGE_2013, EXCHANGE_2013_SP1
+    StreamingContentHandler, StreamingDocumentParser, DummyResponse, ElementNotFound, iterparse, time_func, \
+    CancellableExecutor
+from .version import EXCHANGE_2010, EXCHANGE_2010_SP1, EXCHANGE_2010_SP2, EXCHANGE_2013, EXCHANGE_2013_SP1
 
 log = logging.getLogger(__name__)
 
 CHUNK_SIZE = 100  # A default chunk size for all services
+# The max number of cached shape elements, see create_shape_element()
+MAX_SHAPE_CACHE_SIZE = 1000
+_shape_cache = OrderedDict()
+_shape_cache_lock = Lock()
+
+
+class IterparsedResponse(object):
+    """A SOAP response that is parsed incrementally. Iterating over this object returns the response messages. A message
+    is returned as soon as the element container of the service has started, i.e. before the elements in the container
+    have been parsed, or when the message has been parsed if there is no container. Use iter_container() to get the
+    elements in the container as they are parsed. Elements are removed from the tree when the consumer is done with
+    them, so memory consumption does not grow with the size of the response.
+
+    Raises any SOAP errors immediately, like EWSService._get_soap_payload().
+    """
+    def __init__(self, service_cls, bytes_content):
+        self._messages_tag = service_cls._response_messages_tag()
+        self._message_tag = service_cls._response_message_tag()
+        self._container_tag = service_cls.element_container_name
+        self._events = self._iterparse(bytes_content)
+        self._container = None
+        self.header = None  # The SOAP header element, which precedes the body
+        # Advance to the start of the response messages, so we can raise any SOAP errors
+        has_body = False
+        for event, elem in self._events:
+            if event == 'start':
+                if elem.tag == self._messages_tag:
+                    return
+                if elem.tag == '{%s}Body' % SOAPNS:
+                    has_body = True
+                continue
+            if elem.tag == '{%s}Header' % SOAPNS:
+                self.header = elem
+                continue
+            if elem.tag == '{%s}Fault' % SOAPNS:
+                service_cls._raise_soap_errors(fault=elem)  # Will throw SOAPError or custom EWS error
+            if elem.tag == '{%s}Body' % SOAPNS:
+                raise SOAPError('Unknown SOAP response: %s' % xml_to_str(elem))
+        if not has_body:
+            raise MalformedResponseError('No Body element in SOAP response')
+        raise MalformedResponseError('No %s element in SOAP response' % self._messages_tag)
+
+    def __iter__(self):
+        for event, elem in self._events:
+            if event == 'start':
+                if elem.tag == self._message_tag:
+                    self._container = None
+                elif elem.tag == self._container_tag and self._container is None:
+                    # Only the first container in the message counts. Elements inside items may have the same tag.
+                    self._container = elem
+                    yield self._get_message(elem)
+                continue
+            if self._container is not None and elem.getparent() is self._container:
+                # The consumer did not iterate over this container
+                self._container.remove(elem)
+            elif elem.tag == self._message_tag:
+                if self._container is None:
+                    yield elem
+                self._remove(elem)
+            elif elem.tag == self._messages_tag:
+                return
+
+    @staticmethod
+    def _iterparse(bytes_content):
+        # Most of the response is parsed while the consumer iterates. Raise parse errors the same way as
+        # EWSService._handle_response() does for responses that are parsed at once.
+        try:
+            for event, elem in iterparse(bytes_content, events=('start', 'end')):
+                yield event, elem
+        except ParseError as e:
+            raise SOAPError('Bad SOAP response: %s' % e)
+
+    def _get_message(self, elem):
+        # Returns the message element containing 'elem'
+        while elem.tag != self._message_tag:
+            elem = elem.getparent()
+        return elem
+
+    def iter_container(self, container):
+        """Returns the elements in the container as soon as they have been parsed. Each element is removed from the tree
+        before the next element is returned.
+        """
+        if container is not self._container:
+            raise ValueError("'container' %r is not the current container" % container)
+        for event, elem in self._events:
+            if event != 'end':
+                continue
+            if elem is container:
+                return
+            if elem.getparent() is container:
+                yield elem
+                self._remove(elem)
+
+    @staticmethod
+    def _remove(elem):
+        # The consumer may have removed the element already, e.g. via EWSElement.from_xml()
+        parent = elem.getparent()
+        if parent is not None:
+            parent.remove(elem)
 
 
 class EWSService(object):
@@ -62,6 +165,9 @@ class EWSService(object):
     WARNINGS_TO_IGNORE_IN_RESPONSE = ()
     # Controls whether the HTTP request should be streaming or fetch everything at once
     streaming = False
+    # Controls whether the SOAP response should be parsed incrementally. If True, elements in the element container are
+    # returned as soon as they have been parsed, instead of after the whole XML tree has been built.
+    parse_incrementally = False
 
     def __init__(self, protocol, chunk_size=None):
         self.chunk_size = chunk_size or CHUNK_SIZE  # The number of items to send in a single request
@@ -69,7 +175,11 @@ class EWSService(object):
             raise ValueError("'chunk_size' %r must be an integer" % chunk_size)
         if self.chunk_size < 1:
             raise ValueError("'chunk_size' must be a positive number")
+        # An explicit chunk size takes precedence over the chunk size suggested by the protocol autotuner, if any
+        self._chunk_size_is_explicit = chunk_size is not None
         self.protocol = protocol
+        # Information about the most recent request sent by the current thread
+        self._thread_state = local()
 
     # The following two methods are the minimum required to be implemented by subclasses, but the name and number of
     # kwargs differs between services. Therefore, we cannot make these methods abstract.
@@ -90,16 +200,7 @@ class EWSService(object):
                 # Read the XML and throw any general EWS error messages. Return a generator over the result elements
                 return self._get_elements_in_response(response=response)
             except ErrorServerBusy as e:
-                log.debug('Got ErrorServerBusy (back off %s seconds)', e.back_off)
-                # ErrorServerBusy is very often a symptom of sending too many requests. Scale back if possible.
-                try:
-                    self.protocol.decrease_poolsize()
-                except SessionPoolMinSizeReached:
-                    pass
-                if self.protocol.credentials.fail_fast:
-                    raise
-                self.protocol.credentials.back_off(e.back_off)
-                # We'll warn about this if we actually need to sleep
+                self._handle_server_busy(e)
                 continue
             except (
                     ErrorAccessDenied,
@@ -136,8 +237,26 @@ class EWSService(object):
                             account, traceback.format_exc(20))
                 raise
 
-    def _get_response_xml(self, payload, **parse_opts):
-        # Takes an XML tree and returns SOAP payload as an XML tree
+    def _handle_server_busy(self, e):
+        log.debug('Got ErrorServerBusy (back off %s seconds)', e.back_off)
+        if self.protocol.autotuner is not None:
+            self.protocol.autotuner.record_throttling(service_name=self.SERVICE_NAME)
+        rate_limiter = self.protocol.get_rate_limiter()
+        if rate_limiter is not None:
+            rate_limiter.back_off(e.back_off)
+        if self.protocol.THROTTLING_REGISTRY is not None:
+            self.protocol.THROTTLING_REGISTRY.back_off(self.protocol, e.back_off)
+        # ErrorServerBusy is very often a symptom of sending too many requests. Scale back if possible.
+        try:
+            self.protocol.decrease_poolsize()
+        except SessionPoolMinSizeReached:
+            pass
+        if self.protocol.credentials.fail_fast:
+            raise e
+        # We'll warn about this if we actually need to sleep
+        self.protocol.credentials.back_off(e.back_off)
+
+    def _get_api_versions(self):
         # Microsoft really doesn't want to make our lives easy. The server may report one version in our initial version
         # guessing tango, but then the server may decide that any arbitrary legacy backend server may actually process
         # the request for an account. Prepare to handle ErrorInvalidSchemaVersionForMailboxVersion errors and set the
@@ -150,17 +269,42 @@ class EWSService(object):
             account = None
             hint = self.protocol.version
         api_versions = [hint.api_version] + [v for v in API_VERSIONS if v != hint.api_version]
+        return account, hint, api_versions
+
+    def _raise_all_versions_invalid(self, account, api_versions):
+        if account:
+            raise ErrorInvalidSchemaVersionForMailboxVersion('Tried versions %s but all were invalid for account %s' %
+                                                             (api_versions, account))
+        raise ErrorInvalidServerVersion('Tried versions %s but all were invalid' % api_versions)
+
+    def _get_response_xml(self, payload, **parse_opts):
+        # Takes an XML tree and returns SOAP payload as an XML tree
+        account, hint, api_versions = self._get_api_versions()
         for api_version in api_versions:
             log.debug('Trying API version %s for account %s', api_version, account)
-            r, session = post_ratelimited(
-                protocol=self.protocol,
-                session=self.protocol.get_session(),
-                url=self.protocol.service_endpoint,
-                headers=extra_headers(account=account),
-                data=wrap(content=payload, version=api_version, account=account),
-                allow_redirects=False,
-                stream=self.streaming,
-            )
+            data = wrap(content=payload, version=api_version, account=account)
+            self._thread_state.payload_size = len(data)
+            if self.streaming:
+                # Streaming responses may stay open for a long time, e.g. up to 30 minutes for GetStreamingEvents. Use
+                # a session outside the pool, so we don't starve other requests, or deadlock if the consumer sends
+                # requests while reading the stream.
+                session = self.protocol.create_dedicated_session()
+            else:
+                session = self.protocol.get_session()
+            try:
+                r, session = post_ratelimited(
+                    protocol=self.protocol,
+                    session=session,
+                    url=self.protocol.service_endpoint,
+                    headers=extra_headers(account=account),
+                    data=data,
+                    allow_redirects=False,
+                    stream=self.streaming,
+                )
+            except UnauthorizedError:
+                # The cached auth type may be wrong
+                self._invalidate_discovery_cache(auth_type=True)
+                raise
             if self.streaming:
                 # Let 'requests' decode raw data automatically
                 r.raw.decode_content = True
@@ -168,64 +312,112 @@ class EWSService(object):
                 # If we're streaming, we want to wait to release the session until we have consumed the stream.
                 self.protocol.release_session(session)
             try:
-                res = self._get_soap_payload(response=r, **parse_opts)
-            except ParseError as e:
-                raise SOAPError('Bad SOAP response: %s' % e)
-            except ErrorInvalidServerVersion:
-                # The guessed server version is wrong. Try the next version
-                log.debug('API version %s was invalid', api_version)
-                continue
-            except ErrorInvalidSchemaVersionForMailboxVersion:
-                if not account:
-                    # This should never happen for non-account services
-                    raise ValueError("'account' should not be None")
-                # The guessed server version is wrong for this account. Try the next version
-                log.debug('API version %s was invalid for account %s', api_version, account)
-                continue
-            except ErrorExceededConnectionCount as e:
-                # ErrorExceededConnectionCount indicates that the connecting user has too many open TCP connections to
-                # the server. Decrease our session pool size.
-                try:
-                    self.protocol.decrease_poolsize()
-                    continue
-                except SessionPoolMinSizeReached:
-                    # We're already as low as we can go. Let the user handle this.
-                    raise e
-            except (ErrorTooManyObjectsOpened, ErrorTimeoutExpired) as e:
-                # ErrorTooManyObjectsOpened means there are too many connections to the Exchange database. This is very
-                # often a symptom of sending too many requests.
-                #
-                # ErrorTimeoutExpired can be caused by a busy server, or by overly large requests. Start by lowering the
-                # session count. This is done by downstream code.
-                if isinstance(e, ErrorTimeoutExpired) and self.protocol.session_pool_size <= 1:
-                    # We're already as low as we can go, so downstream cannot limit the session count to put less load
-                    # on the server. We don't have a way of lowering the page size of requests from
-                    # this part of the code yet. Let the user handle this.
-                    raise e
-
-                # Re-raise as an ErrorServerBusy with a default delay of 5 minutes
-                raise ErrorServerBusy(msg='Reraised from %s(%s)' % (e.__class__.__name__, e), back_off=300)
-            except ResponseMessageError as rme:
-                # We got an error message from Exchange, but we still want to get any new version info from the response
-                try:
-                    self._update_api_version(hint=hint, api_version=api_version, response=r)
-                except TransportError as te:
-                    log.debug('Failed to update version info (%s)', te)
-                raise rme
-            else:
-                self._update_api_version(hint=hint, api_version=api_version, response=r)
-            finally:
+                res = self._handle_response(response=r, account=account, hint=hint, api_version=api_version,
+                                            **parse_opts)
+            except Exception:
                 if self.streaming:
-                    # TODO: We shouldn't release the session yet if we still haven't fully consumed the stream. It seems
-                    # a Session can handle multiple unfinished streaming requests, though.
                     self.protocol.release_session(session)
+                raise
+            if self.streaming:
+                if isgenerator(res):
+                    # The response is still being read. Close the session when we're done.
+                    res = self._release_session_after(res=res, response=r, session=session)
+                else:
+                    self.protocol.release_session(session)
+            if res is None:
+                # The API version was invalid. Try the next version
+                continue
+            self.protocol.recover_poolsize()
             return res
-        if account:
-            raise ErrorInvalidSchemaVersionForMailboxVersion('Tried versions %s but all were invalid for account %s' %
-                                                             (api_versions, account))
-        raise ErrorInvalidServerVersion('Tried versions %s but all were invalid' % api_versions)
+        self._raise_all_versions_invalid(account=account, api_versions=api_versions)
 
-    def _update_api_version(self, hint, api_version, response):
+    def _release_session_after(self, res, response, session):
+        # Yields from a streaming response and releases the session when the response has been read to the end, or
+        # when the consumer closes the generator.
+        try:
+            for elem in res:
+                yield elem
+        finally:
+            response.close()
+            self.protocol.release_session(session)
+
+    def _invalidate_discovery_cache(self, auth_type=False, version=False):
+        # The auth type or server version of the endpoint has changed. If the value came from the discovery cache, make
+        # sure new processes probe the server again. Values we probed or guessed ourselves were never read from the
+        # cache, so there's no need to touch the storage file.
+        from .protocol import discovery_cache
+        protocol = self.protocol
+        if not ((auth_type and getattr(protocol, 'auth_type_from_cache', False))
+                or (version and getattr(protocol, 'version_from_cache', False))):
+            return
+        protocol.auth_type_from_cache = protocol.version_from_cache = False
+        discovery_cache.invalidate(protocol.service_endpoint)
+
+    def _update_discovery_cache(self):
+        # Store a corrected server version, so new processes don't start out with the stale version
+        from .protocol import Protocol, discovery_cache
+        protocol = self.protocol
+        if not isinstance(protocol, Protocol):
+            return
+        discovery_cache.set(protocol.service_endpoint, auth_type=protocol.auth_type,
+                            docs_auth_type=protocol.docs_auth_type, version=protocol.version)
+
+    def _handle_response(self, response, account, hint, api_version, **parse_opts):
+        # Parses the SOAP response and handles errors that are related to the API version and session pool size.
+        # Returns the SOAP payload, or None if the caller should try the next API version.
+        try:
+            header, res = self._get_soap_parts(response=response, **parse_opts)
+        except ParseError as e:
+            raise SOAPError('Bad SOAP response: %s' % e)
+        except ErrorInvalidServerVersion:
+            # The guessed server version is wrong. Try the next version
+            log.debug('API version %s was invalid', api_version)
+            self._invalidate_discovery_cache(version=True)
+            return None
+        except ErrorInvalidSchemaVersionForMailboxVersion:
+            if not account:
+                # This should never happen for non-account services
+                raise ValueError("'account' should not be None")
+            # The guessed server version is wrong for this account. Try the next version
+            log.debug('API version %s was invalid for account %s', api_version, account)
+            return None
+        except ErrorExceededConnectionCount as e:
+            # ErrorExceededConnectionCount indicates that the connecting user has too many open TCP connections to
+            # the server. Decrease our session pool size.
+            try:
+                self.protocol.decrease_poolsize()
+                return None
+            except SessionPoolMinSizeReached:
+                # We're already as low as we can go. Let the user handle this.
+                raise e
+        except (ErrorTooManyObjectsOpened, ErrorTimeoutExpired) as e:
+            # ErrorTooManyObjectsOpened means there are too many connections to the Exchange database. This is very
+            # often a symptom of sending too many requests.
+            #
+            # ErrorTimeoutExpired can be caused by a busy server, or by overly large requests. Start by lowering the
+            # session count. This is done by downstream code.
+            if isinstance(e, ErrorTimeoutExpired) and self.protocol.session_pool_size <= 1:
+                # We're already as low as we can go, so downstream cannot limit the session count to put less load
+                # on the server. We don't have a way of lowering the page size of requests from
+                # this part of the code yet. Let the user handle this.
+                raise e
+
+            # Re-raise as an ErrorServerBusy with a default delay of 5 minutes
+            raise ErrorServerBusy(msg='Reraised from %s(%s)' % (e.__class__.__name__, e), back_off=300)
+        except ResponseMessageError as rme:
+            # We got an error message from Exchange, but we still want to get any new version info from the response.
+            # The exception was raised before we got the parsed header, so this needs a separate parse of the response.
+            try:
+                self._update_api_version(hint=hint, api_version=api_version,
+                                         header=self._get_soap_header(response=response))
+            except (TransportError, ParseError) as te:
+                log.debug('Failed to update version info (%s)', te)
+            raise rme
+        else:
+            self._update_api_version(hint=hint, api_version=api_version, header=header)
+        return res
+
+    def _update_api_version(self, hint, api_version, header):
         if api_version == hint.api_version and hint.build is not None:
             # Nothing to do
             return
@@ -236,11 +428,12 @@ class EWSService(object):
             log.debug('Found new API version (%s -> %s)', hint.api_version, api_version)
         else:
             log.debug('Adding missing build number %s', api_version)
-        new_version = Version.from_response(requested_api_version=api_version, bytes_content=response.content)
+        new_version = Version.from_soap_header(requested_api_version=api_version, header=header)
         if isinstance(self, EWSAccountService):
             self.account.version = new_version
         else:
             self.protocol.version = new_version
+            self._update_discovery_cache()
 
     @classmethod
     def _response_tag(cls):
@@ -256,8 +449,30 @@ class EWSService(object):
 
     @classmethod
     def _get_soap_payload(cls, response, **parse_opts):
+        return cls._get_soap_parts(response=response, **parse_opts)[1]
+
+    @classmethod
+    def _get_soap_parts(cls, response, **parse_opts):
+        # Parses the response once and returns the SOAP header element (None if the response has no header) and the
+        # SOAP payload, so the server version can be read from the header without parsing the response again.
+        if cls.parse_incrementally:
+            res = IterparsedResponse(service_cls=cls, bytes_content=response.iter_content())
+            return res.header, res
         root = to_xml(response.iter_content())
-        body = root.find('{%s}Body' % SOAPNS)
+        return root.find('{%s}Header' % SOAPNS), cls._get_soap_messages(body=root.find('{%s}Body' % SOAPNS))
+
+    @staticmethod
+    def _get_soap_header(response):
+        # Returns the SOAP header element of the response. Only parses the response until the header is complete.
+        for _, elem in iterparse(response.iter_content(), events=('end',)):
+            if elem.tag == '{%s}Header' % SOAPNS:
+                return elem
+            if elem.tag == '{%s}Body' % SOAPNS:
+                break
+        return None
+
+    @classmethod
+    def _get_soap_messages(cls, body):
         if body is None:
             raise MalformedResponseError('No Body element in SOAP response')
         response = body.find(cls._response_tag())
@@ -370,13 +585,20 @@ class EWSService(object):
             if isinstance(container_or_exc, (bool, Exception)):
                 yield container_or_exc
             else:
-                for c in self._get_elements_in_container(container=container_or_exc):
+                for c in self._iter_elements_in_container(response=response, container=container_or_exc):
                     yield c
 
     @staticmethod
     def _get_elements_in_container(container):
         return [elem for elem in container]
 
+    def _iter_elements_in_container(self, response, container):
+        # Returns the elements in a container of the response. If the response is being parsed incrementally, each
+        # element is returned as soon as it has been parsed.
+        if isinstance(response, IterparsedResponse):
+            return response.iter_container(container=container)
+        return self._get_elements_in_container(container=container)
+
 
 class EWSAccountService(EWSService):
 
@@ -396,51 +618,29 @@ class EWSFolderService(EWSAccountService):
 
 
 class PagingEWSMixIn(EWSService):
+    def __init__(self, *args, **kwargs):
+        # The number of pages to request ahead of the page currently being consumed. Only used when paging through a
+        # single folder, because the offsets of later pages are not predictable when paging through multiple folders.
+        self.prefetch_pages = kwargs.pop('prefetch_pages', 0)
+        if not isinstance(self.prefetch_pages, int) or self.prefetch_pages < 0:
+            raise ValueError("'prefetch_pages' %r must be a non-negative integer" % self.prefetch_pages)
+        super(PagingEWSMixIn, self).__init__(*args, **kwargs)
+
     def _paged_call(self, payload_func, max_items, **kwargs):
-        if isinstance(self, EWSAccountService):
-            log_prefix = 'EWS %s, account %s, service %s' % (
-                self.protocol.service_endpoint, self.account, self.SERVICE_NAME)
-        else:
-            log_prefix = 'EWS %s, service %s' % (self.protocol.service_endpoint, self.SERVICE_NAME)
-        if isinstance(self, EWSFolderService):
-            expected_message_count = len(self.folders)
-        else:
-            expected_message_count = 1
-        paging_infos = [dict(item_count=0, next_offset=None) for _ in range(expected_message_count)]
+        log_prefix, expected_message_count, paging_infos = self._init_paging()
+        if self.prefetch_pages and expected_message_count == 1:
+            for elem in self._prefetching_paged_call(payload_func, max_items, log_prefix, paging_infos[0], **kwargs):
+                yield elem
+            return
         common_next_offset = kwargs['offset']
         total_item_count = 0
         while True:
             log.debug('%s: Getting items at offset %s (max_items %s)', log_prefix, common_next_offset, max_items)
             kwargs['offset'] = common_next_offset
-            payload = payload_func(**kwargs)
-            try:
-                response = self._get_response_xml(payload=payload)
-            except ErrorServerBusy as e:
-                log.debug('Got ErrorServerBusy (back off %s seconds)', e.back_off)
-                # ErrorServerBusy is very often a symptom of sending too many requests. Scale back if possible.
-                try:
-                    self.protocol.decrease_poolsize()
-                except SessionPoolMinSizeReached:
-                    pass
-                if self.protocol.credentials.fail_fast:
-                    raise
-                self.protocol.credentials.back_off(e.back_off)
-                # We'll warn about this if we actually need to sleep
-                continue
-            # Collect a tuple of (rootfolder, next_offset) tuples
-            parsed_pages = [self._get_page(message) for message in response]
-            if len(parsed_pages) != expected_message_count:
-                raise MalformedResponseError(
-                    "Expected %s items in 'response', got %s" % (expected_message_count, len(parsed_pages))
-                )
-            for (rootfolder, next_offset), paging_info in zip(parsed_pages, paging_infos):
-                paging_info['next_offset'] = next_offset
-                if rootfolder is not None:
-                    container = rootfolder.find(self.element_container_name)
-                    if container is None:
-                        raise MalformedResponseError('No %s elements in ResponseMessage (%s)' % (
-                            self.element_container_name, xml_to_str(rootfolder)))
-                    for elem in self._get_elements_in_container(container=container):
+            response = self._get_page_response(payload=payload_func(**kwargs))
+            for paging_info, container in self._get_paged_containers(response, paging_infos, expected_message_count):
+                if container is not None:
+                    for elem in self._iter_elements_in_container(response=response, container=container):
                         paging_info['item_count'] += 1
                         yield elem
                     total_item_count += paging_info['item_count']
@@ -448,33 +648,141 @@ class PagingEWSMixIn(EWSService):
                         # No need to continue. Break out of inner loop
                         log.debug("'max_items' count reached (inner)")
                         break
-                if not paging_info['next_offset']:
-                    # Paging is done for this message
-                    continue
-                # Check sanity of paging offsets, but don't fail. When we are iterating huge collections that take a
-                # long time to complete, the collection may change while we are iterating. This can affect the
-                # 'next_offset' value and make it inconsistent with the number of already collected items.
-                if paging_info['next_offset'] != paging_info['item_count']:
-                    log.warning('Unexpected next offset: %s -> %s. Maybe the server-side collection has changed?'
-                                % (paging_info['item_count'], paging_info['next_offset']))
+                self._check_next_offset(paging_info)
             # Also break out of outer loop
             if max_items and total_item_count >= max_items:
                 log.debug("'max_items' count reached (outer)")
                 break
-            next_offsets = {p['next_offset'] for p in paging_infos if p['next_offset'] is not None}
-            if not next_offsets:
+            common_next_offset = self._get_next_offset(paging_infos)
+            if common_next_offset is None:
                 # Paging is done for all messages
                 break
-            # We cannot guarantee that all messages that have a next_offset also have the *same* next_offset. This is
-            # because the collections that we are iterating may change while iterating. We'll do our best but we cannot
-            # guarantee 100% consistency when large collections are simultaneously being changed on the server.
-            #
-            # It's not possible to supply a per-folder offset when iterating multiple folders, so we'll just have to
-            # choose something that is most likely to work. Select the lowest of all the values to at least make sure
-            # we don't miss any items, although we may then get duplicates ¯\_(ツ)_/¯
-            if len(next_offsets) > 1:
-                log.warning('Inconsistent next_offset values: %r. Using lowest value', next_offsets)
-            common_next_offset = min(next_offsets)
+
+    def _prefetching_paged_call(self, payload_func, max_items, log_prefix, paging_info, **kwargs):
+        # Like _paged_call(), but requests up to 'prefetch_pages' pages ahead of the page being consumed, in the thread
+        # pool. We assume that each page is full, so page N+1 starts at the offset of page N plus the page size. If
+        # the server disagrees, e.g. because the collection changed while we were paging, we throw away the pages we
+        # requested ahead and continue from the offset reported by the server.
+        page_size = self.chunk_size
+        end_offset = kwargs['offset'] + max_items if max_items else None
+        request_offset = kwargs['offset']  # The offset of the next page to request
+        pending = deque()  # (offset, AsyncResult) tuples for the pages we have requested, in order
+        total_item_count = 0
+        executor = CancellableExecutor(self.protocol.thread_pool)  # Cancels pages nobody will read, on early exit
+        try:
+            while True:
+                while len(pending) <= self.prefetch_pages and (end_offset is None or request_offset < end_offset):
+                    log.debug('%s: Requesting items at offset %s (max_items %s)', log_prefix, request_offset,
+                              max_items)
+                    page_kwargs = dict(kwargs, offset=request_offset)
+                    pending.append((request_offset, executor.submit(
+                        lambda kw: self._get_page_response(payload=payload_func(**kw)),
+                        page_kwargs
+                    )))
+                    request_offset += page_size
+                if not pending:
+                    break
+                offset, result = pending.popleft()
+                response = result.get()
+                for _, container in self._get_paged_containers(response, [paging_info], 1):
+                    if container is not None:
+                        # Don't request pages beyond the end of the collection
+                        total_items = int(container.getparent().get('TotalItemsInView'))
+                        end_offset = total_items if end_offset is None else min(end_offset, total_items)
+                        for elem in self._iter_elements_in_container(response=response, container=container):
+                            paging_info['item_count'] += 1
+                            total_item_count += 1
+                            yield elem
+                    self._check_next_offset(paging_info)
+                if max_items and total_item_count >= max_items:
+                    log.debug("'max_items' count reached")
+                    break
+                next_offset = paging_info['next_offset']
+                if next_offset is None:
+                    # Paging is done. Any pages we requested ahead are empty.
+                    break
+                if next_offset != offset + page_size:
+                    log.debug('%s: Expected next offset %s, got %s. Discarding %s prefetched pages', log_prefix,
+                              offset + page_size, next_offset, len(pending))
+                    pending.clear()
+                    request_offset = next_offset
+        finally:
+            executor.cancel()
+
+    def _get_page_response(self, payload):
+        while True:
+            try:
+                return self._get_response_xml(payload=payload)
+            except ErrorServerBusy as e:
+                self._handle_server_busy(e)
+
+    def _init_paging(self):
+        # Returns a log prefix, the number of response messages to expect per page, and a paging info dict per message
+        if isinstance(self, EWSAccountService):
+            log_prefix = 'EWS %s, account %s, service %s' % (
+                self.protocol.service_endpoint, self.account, self.SERVICE_NAME)
+        else:
+            log_prefix = 'EWS %s, service %s' % (self.protocol.service_endpoint, self.SERVICE_NAME)
+        if isinstance(self, EWSFolderService):
+            expected_message_count = len(self.folders)
+        else:
+            expected_message_count = 1
+        paging_infos = [dict(item_count=0, next_offset=None) for _ in range(expected_message_count)]
+        return log_prefix, expected_message_count, paging_infos
+
+    def _get_paged_containers(self, response, paging_infos, expected_message_count):
+        # Yields a (paging_info, container) tuple for each message in the response. Updates the 'next_offset' of each
+        # paging info. The container is None if the page is empty. The messages are processed one at a time, so the
+        # caller can consume the container before the next message in an incrementally parsed response is parsed.
+        message_count = 0
+        for message in response:
+            if message_count >= expected_message_count:
+                raise MalformedResponseError(
+                    "Expected %s items in 'response', got more" % expected_message_count
+                )
+            paging_info = paging_infos[message_count]
+            message_count += 1
+            rootfolder, paging_info['next_offset'] = self._get_page(message)
+            container = None
+            if rootfolder is not None:
+                container = rootfolder.find(self.element_container_name)
+                if container is None:
+                    raise MalformedResponseError('No %s elements in ResponseMessage (%s)' % (
+                        self.element_container_name, xml_to_str(rootfolder)))
+            yield paging_info, container
+        if message_count != expected_message_count:
+            raise MalformedResponseError(
+                "Expected %s items in 'response', got %s" % (expected_message_count, message_count)
+            )
+
+    @staticmethod
+    def _check_next_offset(paging_info):
+        if not paging_info['next_offset']:
+            # Paging is done for this message
+            return
+        # Check sanity of paging offsets, but don't fail. When we are iterating huge collections that take a
+        # long time to complete, the collection may change while we are iterating. This can affect the
+        # 'next_offset' value and make it inconsistent with the number of already collected items.
+        if paging_info['next_offset'] != paging_info['item_count']:
+            log.warning('Unexpected next offset: %s -> %s. Maybe the server-side collection has changed?'
+                        % (paging_info['item_count'], paging_info['next_offset']))
+
+    @staticmethod
+    def _get_next_offset(paging_infos):
+        # Returns the offset of the next page, or None if paging is done for all messages
+        next_offsets = {p['next_offset'] for p in paging_infos if p['next_offset'] is not None}
+        if not next_offsets:
+            return None
+        # We cannot guarantee that all messages that have a next_offset also have the *same* next_offset. This is
+        # because the collections that we are iterating may change while iterating. We'll do our best but we cannot
+        # guarantee 100% consistency when large collections are simultaneously being changed on the server.
+        #
+        # It's not possible to supply a per-folder offset when iterating multiple folders, so we'll just have to
+        # choose something that is most likely to work. Select the lowest of all the values to at least make sure
+        # we don't miss any items, although we may then get duplicates ¯\_(ツ)_/¯
+        if len(next_offsets) > 1:
+            log.warning('Inconsistent next_offset values: %r. Using lowest value', next_offsets)
+        return min(next_offsets)
 
     def _get_page(self, message):
         rootfolder = self._get_element_container(message=message, name='{%s}RootFolder' % MNS)
@@ -646,36 +954,59 @@ class EWSPooledMixIn(EWSService):
         # Chop items list into suitable pieces and let worker threads chew on the work. The order of the output result
         # list must be the same as the input id list, so the caller knows which status message belongs to which ID.
         # Yield results as they become available.
-        results = []
-        n = 1
-        for chunk in chunkify(items, self.chunk_size):
-            log.debug('Starting %s._get_elements worker %s for %s items', self.__class__.__name__, n, len(chunk))
-            n += 1
-            results.append(self.protocol.thread_pool.apply_async(
-                lambda c: self._get_elements(payload=payload_func(c, **kwargs)),
-                (chunk,)
-            ))
-            # Results will be available before iteration has finished if 'items' is a slow generator. Return early
-            for i, r in enumerate(results, 1):
-                if r is None:
-                    continue
-                if not r.ready():
-                    # First non-yielded result isn't ready yet. Yielding other ready results would mess up ordering
-                    break
-                log.debug('%s._get_elements result %s is ready early', self.__class__.__name__, i)
-                for elem in r.get():
+        #
+        # Limit the number of outstanding chunks, so memory usage doesn't grow with the size of 'items' if a chunk is
+        # slow to finish or the consumer is slow. We stop pulling from 'items' until the oldest chunk has been consumed.
+        max_outstanding = 4 * self.protocol.session_pool_size
+        # If the consumer stops iterating early, e.g. by breaking out of a loop or because of an exception, we cancel
+        # the chunks that have not started yet, so we don't spend sessions and server resources on results that
+        # nobody will read.
+        executor = CancellableExecutor(self.protocol.thread_pool)
+        results = deque()
+        n = 0
+        try:
+            for chunk in self._get_chunks(items):
+                n += 1
+                log.debug('Starting %s._get_elements worker %s for %s items', self.__class__.__name__, n, len(chunk))
+                results.append(executor.submit(
+                    lambda c: self._get_elements_in_chunk(payload_func=payload_func, chunk=c, **kwargs),
+                    chunk
+                ))
+                # Results will be available before iteration has finished if 'items' is a slow generator. Return
+                # early. We can only yield the oldest result, otherwise we would mess up ordering.
+                while results and (len(results) >= max_outstanding or results[0].ready()):
+                    log.debug('Yielding %s._get_elements result %s of %s', self.__class__.__name__,
+                              n - len(results) + 1, n)
+                    for elem in results.popleft().get():
+                        yield elem
+            # Yield remaining results in order, as they become available
+            while results:
+                log.debug('Waiting for %s._get_elements result %s of %s', self.__class__.__name__,
+                          n - len(results) + 1, n)
+                for elem in results.popleft().get():
                     yield elem
-                results[i-1] = None
-        # Yield remaining results in order, as they become available
-        for i, r in enumerate(results, 1):
-            if r is None:
-                log.debug('%s._get_elements result %s of %s already sent', self.__class__.__name__, i, len(results))
-                continue
-            log.debug('Waiting for %s._get_elements result %s of %s', self.__class__.__name__, i, len(results))
-            elems = r.get()
-            log.debug('%s._get_elements result %s of %s is ready', self.__class__.__name__, i, len(results))
-            for elem in elems:
-                yield elem
+        finally:
+            if results:
+                log.debug('Cancelling %s outstanding %s._get_elements workers', len(results), self.__class__.__name__)
+            executor.cancel()
+
+    def _get_chunks(self, items):
+        # Use the chunk size suggested by the autotuner, unless the caller asked for a specific chunk size
+        if self._chunk_size_is_explicit or self.protocol.autotuner is None:
+            return chunkify(items, self.chunk_size)
+        return self.protocol.autotuner.chunkify(service_name=self.SERVICE_NAME, iterable=items)
+
+    def _get_elements_in_chunk(self, payload_func, chunk, **kwargs):
+        # Runs in a worker thread. Consume the elements here, so responses that are parsed incrementally are still
+        # parsed in parallel in the worker threads instead of in the thread that consumes the results. Reports request
+        # statistics, including the parse time, to the autotuner, if any.
+        start = time_func()
+        res = list(self._get_elements(payload=payload_func(chunk, **kwargs)))
+        autotuner = self.protocol.autotuner
+        if autotuner is not None:
+                autotuner.record(service_name=self.SERVICE_NAME, item_count=len(chunk), duration=time_func() - start,
+                             payload_size=self._thread_state.payload_size)
+        return res
 
 
 class GetItem(EWSAccountService, EWSPooledMixIn):
@@ -684,6 +1015,7 @@ class GetItem(EWSAccountService, EWSPooledMixIn):
     """
     SERVICE_NAME = 'GetItem'
     element_container_name = '{%s}Items' % MNS
+    parse_incrementally = True
 
     def call(self, items, additional_fields, shape):
         """
@@ -703,14 +1035,9 @@ class GetItem(EWSAccountService, EWSPooledMixIn):
     def get_payload(self, items, additional_fields, shape):
         from .properties import ItemId
         getitem = create_element('m:%s' % self.SERVICE_NAME)
-        itemshape = create_element('m:ItemShape')
-        add_xml_child(itemshape, 't:BaseShape', shape)
-        if additional_fields:
-            additional_properties = create_element('t:AdditionalProperties')
-            expanded_fields = chain(*(f.expand(version=self.account.version) for f in additional_fields))
-            set_xml_value(additional_properties, sorted(expanded_fields, key=lambda f: f.path),
-                          version=self.account.version)
-            itemshape.append(additional_properties)
+        itemshape = create_shape_element(
+            tag='m:ItemShape', shape=shape, additional_fields=additional_fields, version=self.account.version
+        )
         getitem.append(itemshape)
         item_ids = create_element('m:ItemIds')
         for item in items:
@@ -988,6 +1315,7 @@ class FindItem(EWSFolderService, PagingEWSMixIn):
     """
     SERVICE_NAME = 'FindItem'
     element_container_name = '{%s}Items' % TNS
+    parse_incrementally = True
 
     def call(self, additional_fields, restriction, order_fields, shape, query_string, depth, calendar_view, max_items,
              offset):
@@ -1020,15 +1348,9 @@ class FindItem(EWSFolderService, PagingEWSMixIn):
     def get_payload(self, additional_fields, restriction, order_fields, query_string, shape, depth, calendar_view,
                     page_size, offset=0):
         finditem = create_element('m:%s' % self.SERVICE_NAME, Traversal=depth)
-        itemshape = create_element('m:ItemShape')
-        add_xml_child(itemshape, 't:BaseShape', shape)
-        if additional_fields:
-            expanded_fields = chain(*(f.expand(version=self.account.version) for f in additional_fields))
-            itemshape.append(set_xml_value(
-                create_element('t:AdditionalProperties'),
-                sorted(expanded_fields, key=lambda f: f.path),
-                version=self.account.version
-            ))
+        itemshape = create_shape_element(
+            tag='m:ItemShape', shape=shape, additional_fields=additional_fields, version=self.account.version
+        )
         finditem.append(itemshape)
         if calendar_view is None:
             view_type = create_element('m:IndexedPageItemView',
@@ -1094,14 +1416,9 @@ class FindFolder(EWSFolderService, PagingEWSMixIn):
 
     def get_payload(self, additional_fields, restriction, shape, depth, page_size, offset=0):
         findfolder = create_element('m:%s' % self.SERVICE_NAME, Traversal=depth)
-        foldershape = create_element('m:FolderShape')
-        add_xml_child(foldershape, 't:BaseShape', shape)
-        if additional_fields:
-            additional_properties = create_element('t:AdditionalProperties')
-            expanded_fields = chain(*(f.expand(version=self.account.version) for f in additional_fields))
-            set_xml_value(additional_properties, sorted(expanded_fields, key=lambda f: f.path),
-                          version=self.account.version)
-            foldershape.append(additional_properties)
+        foldershape = create_shape_element(
+            tag='m:FolderShape', shape=shape, additional_fields=additional_fields, version=self.account.version
+        )
         findfolder.append(foldershape)
         if self.account.version.build >= EXCHANGE_2010:
             indexedpageviewitem = create_element('m:IndexedPageFolderView', MaxEntriesReturned=text_type(page_size),
@@ -1173,14 +1490,9 @@ class GetFolder(EWSAccountService):
     def get_payload(self, folders, additional_fields, shape):
         from .folders import Folder, FolderId, DistinguishedFolderId
         getfolder = create_element('m:%s' % self.SERVICE_NAME)
-        foldershape = create_element('m:FolderShape')
-        add_xml_child(foldershape, 't:BaseShape', shape)
-        if additional_fields:
-            additional_properties = create_element('t:AdditionalProperties')
-            expanded_fields = chain(*(f.expand(version=self.account.version) for f in additional_fields))
-            set_xml_value(additional_properties, sorted(expanded_fields, key=lambda f: f.path),
-                          version=self.account.version)
-            foldershape.append(additional_properties)
+        foldershape = create_shape_element(
+            tag='m:FolderShape', shape=shape, additional_fields=additional_fields, version=self.account.version
+        )
         getfolder.append(foldershape)
         folder_ids = create_element('m:FolderIds')
         for folder in folders:
@@ -1376,6 +1688,410 @@ class EmptyFolder(EWSAccountService):
         return emptyfolder
 
 
+class SyncFolder(EWSAccountService):
+    # Base class for SyncFolderItems and SyncFolderHierarchy
+    element_container_name = '{%s}Changes' % MNS
+    last_in_range_tag = None  # The name of the XML element telling us that there are no more changes to fetch
+    # The change types we can receive
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    READ_FLAG_CHANGE = 'read_flag_change'
+    CHANGE_TYPES_MAP = {
+        '{%s}Create' % TNS: CREATE,
+        '{%s}Update' % TNS: UPDATE,
+        '{%s}Delete' % TNS: DELETE,
+        '{%s}ReadFlagChange' % TNS: READ_FLAG_CHANGE,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(SyncFolder, self).__init__(*args, **kwargs)
+        # These are set when the response is parsed
+        self.sync_state = None
+        self.includes_last_item_in_range = None
+
+    def _get_elements_in_response(self, response):
+        for msg in response:
+            container_or_exc = self._get_element_container(message=msg, name=self.element_container_name)
+            if isinstance(container_or_exc, (bool, Exception)):
+                yield container_or_exc
+                continue
+            # Remember the new sync state and whether there are more changes to fetch
+            self.sync_state = get_xml_attr(msg, '{%s}SyncState' % MNS)
+            self.includes_last_item_in_range = xml_text_to_value(get_xml_attr(msg, self.last_in_range_tag), bool)
+            for c in self._get_elements_in_container(container=container_or_exc):
+                yield c
+
+    def _change_type(self, elem):
+        try:
+            return self.CHANGE_TYPES_MAP[elem.tag]
+        except KeyError:
+            raise ValueError("Unknown element tag '%s': (%s)" % (elem.tag, elem))
+
+    @staticmethod
+    def _add_sync_state(payload, sync_state):
+        if sync_state:
+            add_xml_child(payload, 'm:SyncState', sync_state)
+
+
+class SyncFolderItems(SyncFolder):
+    """
+    MSDN: https://msdn.microsoft.com/en-us/library/office/aa563967(v=exchg.150).aspx
+    """
+    SERVICE_NAME = 'SyncFolderItems'
+    last_in_range_tag = '{%s}IncludesLastItemInRange' % MNS
+    SYNC_SCOPES = ('NormalItems', 'NormalAndAssociatedItems')
+
+    def call(self, folder, shape, additional_fields, sync_state, ignore, max_changes_returned, sync_scope):
+        """
+        Get a batch of item changes in a folder since the given sync state. The new sync state is available as
+        'self.sync_state' when the returned generator is exhausted.
+
+        :param folder: the Folder to sync items in
+        :param shape: The set of attributes to return
+        :param additional_fields: the extra fields that should be returned with the item, as FieldPath objects
+        :param sync_state: the sync state returned by a previous call, or None to get all items in the folder
+        :param ignore: a list of (id, changekey) tuples or Item objects to ignore changes for
+        :param max_changes_returned: the maximum number of changes to return in one call
+        :param sync_scope: whether to include folder associated items. Only supported from Exchange 2010
+        :return: (change_type, value) tuples. 'value' is an Item for creates and updates, an ItemId for deletes and
+        an (ItemId, is_read) tuple for read flag changes
+        """
+        from .folders import Folder
+        from .properties import ItemId
+        for change in self._get_elements(payload=self.get_payload(
+                folder=folder,
+                shape=shape,
+                additional_fields=additional_fields,
+                sync_state=sync_state,
+                ignore=ignore,
+                max_changes_returned=max_changes_returned,
+                sync_scope=sync_scope,
+        )):
+            if isinstance(change, Exception):
+                yield change
+                continue
+            change_type = self._change_type(change)
+            if change_type == self.READ_FLAG_CHANGE:
+                item_id = ItemId.from_xml(elem=change.find(ItemId.response_tag()), account=self.account)
+                is_read = xml_text_to_value(get_xml_attr(change, '{%s}IsRead' % TNS), bool)
+                yield change_type, (item_id, is_read)
+            elif change_type == self.DELETE:
+                yield change_type, ItemId.from_xml(elem=change.find(ItemId.response_tag()), account=self.account)
+            else:
+                # Creates and updates contain a full item element, e.g. a 't:Message' element
+                elem = change[0]
+                yield change_type, Folder.item_model_from_tag(elem.tag).from_xml(elem=elem, account=self.account)
+
+    def get_payload(self, folder, shape, additional_fields, sync_state, ignore, max_changes_returned, sync_scope):
+        from .properties import ItemId
+        syncfolderitems = create_element('m:%s' % self.SERVICE_NAME)
+        itemshape = create_shape_element(
+            tag='m:ItemShape', shape=shape, additional_fields=additional_fields, version=self.account.version
+        )
+        syncfolderitems.append(itemshape)
+        syncfolderid = create_element('m:SyncFolderId')
+        set_xml_value(syncfolderid, folder, version=self.account.version)
+        syncfolderitems.append(syncfolderid)
+        self._add_sync_state(payload=syncfolderitems, sync_state=sync_state)
+        if ignore:
+            ignore_elem = create_element('m:Ignore')
+            for item in ignore:
+                set_xml_value(ignore_elem, to_item_id(item, ItemId), version=self.account.version)
+            syncfolderitems.append(ignore_elem)
+        add_xml_child(syncfolderitems, 'm:MaxChangesReturned', max_changes_returned)
+        if sync_scope and self.account.version.build >= EXCHANGE_2010:
+            add_xml_child(syncfolderitems, 'm:SyncScope', sync_scope)
+        return syncfolderitems
+
+
+class SyncFolderHierarchy(SyncFolder):
+    """
+    MSDN: https://msdn.microsoft.com/en-us/library/office/aa580990(v=exchg.150).aspx
+    """
+    SERVICE_NAME = 'SyncFolderHierarchy'
+    last_in_range_tag = '{%s}IncludesLastFolderInRange' % MNS
+
+    def call(self, folder, shape, additional_fields, sync_state):
+        """
+        Get the folder changes below a folder since the given sync state. The new sync state is available as
+        'self.sync_state' when the returned generator is exhausted.
+
+        :param folder: the root Folder of the hierarchy to sync
+        :param shape: The set of attributes to return
+        :param additional_fields: the extra fields that should be returned with the folder, as FieldPath objects
+        :param sync_state: the sync state returned by a previous call, or None to get all folders in the hierarchy
+        :return: (change_type, value) tuples. 'value' is a Folder for creates and updates and a FolderId for deletes
+        """
+        from .folders import Folder, FolderId
+        for change in self._get_elements(payload=self.get_payload(
+                folder=folder,
+                shape=shape,
+                additional_fields=additional_fields,
+                sync_state=sync_state,
+        )):
+            if isinstance(change, Exception):
+                yield change
+                continue
+            change_type = self._change_type(change)
+            if change_type == self.DELETE:
+                yield change_type, FolderId.from_xml(elem=change.find(FolderId.response_tag()), account=self.account)
+            else:
+                # Creates and updates contain a full folder element, e.g. a 't:CalendarFolder' element
+                yield change_type, Folder.from_xml(elem=change[0], root=folder.root)
+
+    def get_payload(self, folder, shape, additional_fields, sync_state):
+        syncfolderhierarchy = create_element('m:%s' % self.SERVICE_NAME)
+        foldershape = create_shape_element(
+            tag='m:FolderShape', shape=shape, additional_fields=additional_fields, version=self.account.version
+        )
+        syncfolderhierarchy.append(foldershape)
+        syncfolderid = create_element('m:SyncFolderId')
+        set_xml_value(syncfolderid, folder, version=self.account.version)
+        syncfolderhierarchy.append(syncfolderid)
+        self._add_sync_state(payload=syncfolderhierarchy, sync_state=sync_state)
+        return syncfolderhierarchy
+
+
+class Subscribe(EWSAccountService):
+    """
+    MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/subscribe-operation
+    """
+    SERVICE_NAME = 'Subscribe'
+    subscription_request_elem_tag = None  # The name of the XML element describing the subscription type
+    EVENT_TYPES = (
+        'CopiedEvent', 'CreatedEvent', 'DeletedEvent', 'ModifiedEvent', 'MovedEvent', 'NewMailEvent',
+        'FreeBusyChangedEvent',
+    )
+
+    def _get_elements_in_response(self, response):
+        for msg in response:
+            container_or_exc = self._get_element_container(message=msg)
+            if isinstance(container_or_exc, Exception):
+                yield container_or_exc
+                continue
+            yield get_xml_attr(msg, '{%s}SubscriptionId' % MNS), get_xml_attr(msg, '{%s}Watermark' % MNS)
+
+    def _call(self, **kwargs):
+        elements = list(self._get_elements(payload=self.get_payload(**kwargs)))
+        if len(elements) != 1:
+            raise ValueError('Expected exactly one element in response')
+        elem = elements[0]
+        if isinstance(elem, Exception):
+            raise elem
+        return elem
+
+    def _partial_payload(self, folders, event_types):
+        subscribe = create_element('m:%s' % self.SERVICE_NAME)
+        request_elem = create_element(self.subscription_request_elem_tag)
+        if folders:
+            folder_ids = create_element('t:FolderIds')
+            set_xml_value(folder_ids, folders, version=self.account.version)
+            request_elem.append(folder_ids)
+        else:
+            # Subscribe to all folders in the mailbox
+            request_elem.set('SubscribeToAllFolders', 'true')
+        event_types_elem = create_element('t:EventTypes')
+        for event_type in event_types:
+            add_xml_child(event_types_elem, 't:EventType', event_type)
+        if not len(event_types_elem):
+            raise ValueError('"event_types" must not be empty')
+        request_elem.append(event_types_elem)
+        subscribe.append(request_elem)
+        return subscribe, request_elem
+
+
+class SubscribeToPull(Subscribe):
+    subscription_request_elem_tag = 'm:PullSubscriptionRequest'
+
+    def call(self, folders, event_types, watermark, timeout):
+        """
+        Create a pull subscription. Events are fetched with the GetEvents service.
+
+        :param folders: the folders to subscribe to. If empty, subscribe to all folders
+        :param event_types: the event types to subscribe to, as a list of values from Subscribe.EVENT_TYPES
+        :param watermark: the watermark of a previous subscription to resume from, or None
+        :param timeout: the number of minutes the subscription stays alive without a GetEvents request
+        :return: a (subscription_id, watermark) tuple
+        """
+        return self._call(folders=folders, event_types=event_types, watermark=watermark, timeout=timeout)
+
+    def get_payload(self, folders, event_types, watermark, timeout):
+        subscribe, request_elem = self._partial_payload(folders=folders, event_types=event_types)
+        if watermark:
+            add_xml_child(request_elem, 't:Watermark', watermark)
+        add_xml_child(request_elem, 't:Timeout', timeout)
+        return subscribe
+
+
+class SubscribeToStreaming(Subscribe):
+    subscription_request_elem_tag = 'm:StreamingSubscriptionRequest'
+
+    def call(self, folders, event_types):
+        """
+        Create a streaming subscription. Events are fetched with the GetStreamingEvents service.
+
+        :param folders: the folders to subscribe to. If empty, subscribe to all folders
+        :param event_types: the event types to subscribe to, as a list of values from Subscribe.EVENT_TYPES
+        :return: a (subscription_id, watermark) tuple. Streaming subscriptions have no watermark.
+        """
+        if self.account.version.build < EXCHANGE_2010_SP1:
+            raise NotImplementedError('Streaming subscriptions are only supported for Exchange 2010 SP1 servers and '
+                                      'later')
+        return self._call(folders=folders, event_types=event_types)
+
+    def get_payload(self, folders, event_types):
+        subscribe, _ = self._partial_payload(folders=folders, event_types=event_types)
+        return subscribe
+
+
+class Unsubscribe(EWSAccountService):
+    """
+    MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/unsubscribe-operation
+    """
+    SERVICE_NAME = 'Unsubscribe'
+
+    def call(self, subscription_id):
+        """
+        End a pull or streaming subscription.
+
+        :param subscription_id: the ID of the subscription
+        :return: True
+        """
+        elements = list(self._get_elements(payload=self.get_payload(subscription_id=subscription_id)))
+        if len(elements) != 1:
+            raise ValueError('Expected exactly one element in response')
+        elem = elements[0]
+        if isinstance(elem, Exception):
+            raise elem
+        return elem
+
+    def get_payload(self, subscription_id):
+        unsubscribe = create_element('m:%s' % self.SERVICE_NAME)
+        add_xml_child(unsubscribe, 'm:SubscriptionId', subscription_id)
+        return unsubscribe
+
+
+class GetEvents(EWSAccountService):
+    """
+    MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/getevents-operation
+    """
+    SERVICE_NAME = 'GetEvents'
+    element_container_name = '{%s}Notification' % MNS
+
+    def call(self, subscription_id, watermark):
+        """
+        Get the events of a pull subscription that happened after the watermark.
+
+        :param subscription_id: the ID of the pull subscription
+        :param watermark: the watermark of the last event we have seen
+        :return: Notification objects. If 'more_events' is True, call again with the watermark of the last event.
+        """
+        from .properties import Notification
+        for elem in self._get_elements(payload=self.get_payload(subscription_id=subscription_id, watermark=watermark)):
+            if isinstance(elem, Exception):
+                yield elem
+                continue
+            yield Notification.from_xml(elem=elem, account=self.account)
+
+    def get_payload(self, subscription_id, watermark):
+        getevents = create_element('m:%s' % self.SERVICE_NAME)
+        add_xml_child(getevents, 'm:SubscriptionId', subscription_id)
+        add_xml_child(getevents, 'm:Watermark', watermark)
+        return getevents
+
+    @staticmethod
+    def _get_elements_in_container(container):
+        # The container is the notification
+        return [container]
+
+
+class GetStreamingEvents(EWSAccountService):
+    """
+    MSDN: https://docs.microsoft.com/en-us/exchange/client-developer/web-service-reference/getstreamingevents-operation
+    """
+    SERVICE_NAME = 'GetStreamingEvents'
+    element_container_name = '{%s}Notifications' % MNS
+    streaming = True
+    # The connection status values the server sends in each response message
+    OK = 'OK'
+    CLOSED = 'Closed'
+
+    def __init__(self, *args, **kwargs):
+        super(GetStreamingEvents, self).__init__(*args, **kwargs)
+        self.connection_status = None  # Set when the response is parsed
+
+    def call(self, subscription_ids, connection_timeout):
+        """
+        Open a long-lived connection that delivers the events of one or more streaming subscriptions as soon as they
+        happen. The connection is closed by the server after 'connection_timeout' minutes.
+
+        :param subscription_ids: the IDs of the streaming subscriptions
+        :param connection_timeout: the number of minutes to keep the connection open, in range 1-30
+        :return: a generator of Notification objects
+        """
+        from .properties import Notification
+        if self.account.version.build < EXCHANGE_2010_SP1:
+            raise NotImplementedError('%s is only supported for Exchange 2010 SP1 servers and later'
+                                      % self.SERVICE_NAME)
+        if not 1 <= connection_timeout <= 30:
+            raise ValueError("'connection_timeout' %s must be in range 1-30" % connection_timeout)
+        for elem in self._get_elements(payload=self.get_payload(
+                subscription_ids=subscription_ids,
+                connection_timeout=connection_timeout,
+        )):
+            if isinstance(elem, Exception):
+                yield elem
+                continue
+            yield Notification.from_xml(elem=elem, account=self.account)
+
+    def get_payload(self, subscription_ids, connection_timeout):
+        getstreamingevents = create_element('m:%s' % self.SERVICE_NAME)
+        subscriptions_elem = create_element('m:SubscriptionIds')
+        for subscription_id in subscription_ids:
+            add_xml_child(subscriptions_elem, 't:SubscriptionId', subscription_id)
+        if not len(subscriptions_elem):
+            raise ValueError('"subscription_ids" must not be empty')
+        getstreamingevents.append(subscriptions_elem)
+        add_xml_child(getstreamingevents, 'm:ConnectionTimeout', connection_timeout)
+        return getstreamingevents
+
+    @classmethod
+    def _get_soap_parts(cls, response, **parse_opts):
+        # The response is a stream of SOAP envelopes that arrive as events happen. We don't have a header until the
+        # first envelope has arrived.
+        return None, cls._iter_envelope_messages(response=response)
+
+    @classmethod
+    def _iter_envelope_messages(cls, response):
+        # Parse each envelope as soon as it is complete. Wrap in DummyResponse because _get_soap_parts() expects an
+        # iter_content() method.
+        parser = StreamingDocumentParser()
+        for envelope in parser.parse(response):
+            envelope_response = DummyResponse(url=None, headers=None, request_headers=None, content=envelope)
+            _, messages = super(GetStreamingEvents, cls)._get_soap_parts(response=envelope_response)
+            for msg in messages:
+                yield msg
+
+    def _update_api_version(self, hint, api_version, header):
+        # We can't read the version from a response that is still streaming
+        pass
+
+    def _get_elements_in_response(self, response):
+        for msg in response:
+            container_or_exc = self._get_element_container(message=msg)
+            if isinstance(container_or_exc, Exception):
+                yield container_or_exc
+                continue
+            self.connection_status = get_xml_attr(msg, '{%s}ConnectionStatus' % MNS)
+            # Keep-alive messages don't contain any notifications
+            container = msg.find(self.element_container_name)
+            if container is None:
+                continue
+            for c in self._get_elements_in_container(container=container):
+                yield c
+
+
 class SendItem(EWSAccountService):
     """
     MSDN: https://msdn.microsoft.com/en-us/library/office/aa580238(v=exchg.150).aspx
@@ -1511,15 +2227,9 @@ class FindPeople(EWSAccountService, PagingEWSMixIn):
     def get_payload(self, folder, additional_fields, restriction, order_fields, query_string, shape, depth, page_size,
                     offset=0):
         findpeople = create_element('m:%s' % self.SERVICE_NAME, Traversal=depth)
-        personashape = create_element('m:PersonaShape')
-        add_xml_child(personashape, 't:BaseShape', shape)
-        if additional_fields:
-            expanded_fields = chain(*(f.expand(version=self.account.version) for f in additional_fields))
-            personashape.append(set_xml_value(
-                create_element('t:AdditionalProperties'),
-                sorted(expanded_fields, key=lambda f: f.path),
-                version=self.account.version
-            ))
+        personashape = create_shape_element(
+            tag='m:PersonaShape', shape=shape, additional_fields=additional_fields, version=self.account.version
+        )
         findpeople.append(personashape)
         view_type = create_element('m:IndexedPageItemView',
                                    MaxEntriesReturned=text_type(page_size),
@@ -1552,16 +2262,7 @@ class FindPeople(EWSAccountService, PagingEWSMixIn):
             try:
                 response = self._get_response_xml(payload=payload_func(**kwargs))
             except ErrorServerBusy as e:
-                log.debug('Got ErrorServerBusy (back off %s seconds)', e.back_off)
-                # ErrorServerBusy is very often a symptom of sending too many requests. Scale back if possible.
-                try:
-                    self.protocol.decrease_poolsize()
-                except SessionPoolMinSizeReached:
-                    pass
-                if self.protocol.credentials.fail_fast:
-                    raise
-                self.protocol.credentials.back_off(e.back_off)
-                # We'll warn about this if we actually need to sleep
+                self._handle_server_busy(e)
                 continue
             # Collect a tuple of (rootfolder, total_items) tuples
             parsed_pages = [self._get_page(message) for message in response]
@@ -1739,16 +2440,16 @@ class GetAttachment(EWSAccountService):
         return payload
 
     @classmethod
-    def _get_soap_payload(cls, response, **parse_opts):
+    def _get_soap_parts(cls, response, **parse_opts):
         if not parse_opts.get('stream_file_content', False):
-            return super(GetAttachment, cls)._get_soap_payload(response=response)
+            return super(GetAttachment, cls)._get_soap_parts(response=response)
 
         from .attachments import FileAttachment
         parser = StreamingBase64Parser()
         field = FileAttachment.get_field_by_fieldname('_content')
         handler = StreamingContentHandler(parser=parser, ns=field.namespace, element_name=field.field_uri)
         parser.setContentHandler(handler)
-        return parser.parse(response)
+        return None, parser.parse(response)
 
     def stream_file_content(self, attachment_id):
         # The streaming XML parser can only stream content of one attachment
@@ -2095,3 +2796,31 @@ def to_item_id(item, item_cls):
     if isinstance(item, dict):
         return item_cls(**item)
     return item_cls(item.id, item.changekey)
+
+
+def create_shape_element(tag, shape, additional_fields, version):
+    # Creates e.g. an 'm:ItemShape' element with the base shape and the expanded, sorted additional fields. The same
+    # shape is sent with every chunk or page of a request, so we build the element once per combination of arguments
+    # and return copies of it. Extended property fields with the same name may have different definitions on different
+    # item models, so the key includes the value class of each field. The fields are sorted in the element, so their
+    # order doesn't matter.
+    key = tag, shape, frozenset((f, f.field.value_cls) for f in additional_fields or ()), version.build, \
+        version.api_version
+    with _shape_cache_lock:
+        shape_elem = _shape_cache.pop(key, None)
+        if shape_elem is not None:
+            _shape_cache[key] = shape_elem  # Mark as recently used
+    if shape_elem is None:
+        shape_elem = create_element(tag)
+        add_xml_child(shape_elem, 't:BaseShape', shape)
+        if additional_fields:
+            additional_properties = create_element('t:AdditionalProperties')
+            expanded_fields = chain(*(f.expand(version=version) for f in additional_fields))
+            set_xml_value(additional_properties, sorted(expanded_fields, key=lambda f: f.path), version=version)
+            shape_elem.append(additional_properties)
+        with _shape_cache_lock:
+            _shape_cache[key] = shape_elem
+            while len(_shape_cache) > MAX_SHAPE_CACHE_SIZE:
+                _shape_cache.popitem(last=False)
+    # The cached element is never modified or added to a tree, so it's safe to copy it from multiple threads
+    return copy.deepcopy(shape_elem)
@@ -1,14 +1,17 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+from functools import partial
 import logging
+from threading import Lock
 
 import requests.auth
 import requests_ntlm
 
 from .credentials import IMPERSONATION
 from .errors import UnauthorizedError, TransportError, RedirectError, RelativeRedirect
-from .util import create_element, add_xml_child, get_redirect_url, xml_to_str, ns_translation
+from .util import create_element, add_xml_child, get_redirect_url, xml_to_str, ns_translation, ConcurrentCalls
 
 log = logging.getLogger(__name__)
 
@@ -50,27 +53,83 @@ def wrap(content, version, account=None):
     """
     Generate the necessary boilerplate XML for a raw SOAP request. The XML is specific to the server version.
     ExchangeImpersonation allows to act as the user we want to impersonate.
+
+    The boilerplate only depends on the version, the impersonated address and the timezone, so it is serialized once and
+    cached. Only the content is serialized for each request.
     """
+    impersonated_address, timezone_id = None, None
+    if account:
+        if account.access_type == IMPERSONATION:
+            impersonated_address = account.primary_smtp_address
+        timezone_id = account.default_timezone.ms_id
+    prefix, suffix = _get_envelope_parts(
+        version=version, impersonated_address=impersonated_address, timezone_id=timezone_id,
+        has_account=account is not None,
+    )
+    return prefix + _serialize_body_content(content) + suffix
+
+
+def _get_envelope_parts(version, impersonated_address, timezone_id, has_account):
+    key = version, impersonated_address, timezone_id, has_account
+    with _envelope_cache_lock:
+        try:
+            parts = _envelope_cache.pop(key)
+        except KeyError:
+            parts = None
+        else:
+            _envelope_cache[key] = parts  # Mark as recently used
+    if parts is not None:
+        return parts
     envelope = create_element('s:Envelope', nsmap=ns_translation)
     header = create_element('s:Header')
     requestserverversion = create_element('t:RequestServerVersion', Version=version)
     header.append(requestserverversion)
-    if account:
-        if account.access_type == IMPERSONATION:
+    if has_account:
+        if impersonated_address is not None:
             exchangeimpersonation = create_element('t:ExchangeImpersonation')
             connectingsid = create_element('t:ConnectingSID')
-            add_xml_child(connectingsid, 't:PrimarySmtpAddress', account.primary_smtp_address)
+            add_xml_child(connectingsid, 't:PrimarySmtpAddress', impersonated_address)
             exchangeimpersonation.append(connectingsid)
             header.append(exchangeimpersonation)
         timezonecontext = create_element('t:TimeZoneContext')
-        timezonedefinition = create_element('t:TimeZoneDefinition', Id=account.default_timezone.ms_id)
+        timezonedefinition = create_element('t:TimeZoneDefinition', Id=timezone_id)
         timezonecontext.append(timezonedefinition)
         header.append(timezonecontext)
     envelope.append(header)
     body = create_element('s:Body')
-    body.append(content)
+    body.text = ''  # Serialize as an open and a close tag, so we can split the envelope between them
     envelope.append(body)
-    return xml_to_str(envelope, encoding=DEFAULT_ENCODING, xml_declaration=True)
+    prefix, suffix = xml_to_str(envelope, encoding=DEFAULT_ENCODING, xml_declaration=True).split(_BODY_SPLIT_MARKER)
+    parts = prefix + b'<s:Body>', b'</s:Body>' + suffix
+    with _envelope_cache_lock:
+        _envelope_cache[key] = parts
+        while len(_envelope_cache) > MAX_ENVELOPE_CACHE_SIZE:
+            _envelope_cache.popitem(last=False)
+    return parts
+
+
+def _serialize_body_content(content):
+    # Serialize the content in the context of the envelope namespaces, so it uses the same prefixes. lxml adds the
+    # namespace declarations of the context to the root element of the content. The envelope already has them.
+    body = create_element('s:Body', nsmap=ns_translation)
+    body.append(content)
+    data = xml_to_str(content, encoding=DEFAULT_ENCODING, xml_declaration=False)
+    end_of_tag = data.find(b'>')
+    root_tag = data[:end_of_tag]
+    for declaration in _NS_DECLARATIONS:
+        root_tag = root_tag.replace(declaration, b'', 1)
+    return root_tag + data[end_of_tag:]
+
+
+_BODY_SPLIT_MARKER = b'<s:Body></s:Body>'
+_NS_DECLARATIONS = tuple(
+    (' xmlns:%s="%s"' % (prefix, uri)).encode(DEFAULT_ENCODING) for prefix, uri in ns_translation.items()
+)
+# The max number of cached envelopes. There is an envelope per combination of API version, timezone and impersonated
+# account.
+MAX_ENVELOPE_CACHE_SIZE = 1000
+_envelope_cache = OrderedDict()
+_envelope_cache_lock = Lock()
 
 
 def get_auth_instance(credentials, auth_type):
@@ -128,21 +187,52 @@ def get_service_authtype(service_endpoint, versions, name):
     # We don't know the API version yet, but we need it to create a valid request because some Exchange servers only
     # respond when given a valid request. Try all known versions. Gross.
     from .protocol import BaseProtocol
+    if BaseProtocol.CONCURRENT_PROBING:
+        return _get_service_authtype_concurrently(service_endpoint=service_endpoint, versions=versions, name=name)
     with BaseProtocol.raw_session() as s:
         for version in versions:
-            data = dummy_xml(version=version, name=name)
-            log.debug('Requesting %s from %s', data, service_endpoint)
-            r = s.post(url=service_endpoint, headers=DEFAULT_HEADERS.copy(), data=data, allow_redirects=True,
-                       timeout=BaseProtocol.TIMEOUT)
             try:
-                auth_type = _get_auth_method_from_response(response=r)
-                log.debug('Auth type is %s', auth_type)
-                return auth_type
+                return _get_service_authtype_for_version(session=s, service_endpoint=service_endpoint,
+                                                         version=version, name=name)
             except TransportError:
                 continue
     raise TransportError('Failed to get auth type from service')
 
 
+def _get_service_authtype_concurrently(service_endpoint, versions, name):
+    # Sends a request for each version at the same time, and returns the result for the first version that works. Each
+    # request needs its own session because sessions are not thread-safe.
+    from .protocol import BaseProtocol
+
+    def probe(version):
+        with BaseProtocol.raw_session() as s:
+            return _get_service_authtype_for_version(session=s, service_endpoint=service_endpoint, version=version,
+                                                     name=name)
+
+    probes = ConcurrentCalls([partial(probe, version=v) for v in versions])
+    try:
+        for i in range(len(versions)):
+            try:
+                return probes.get(i)
+            except TransportError:
+                continue
+    finally:
+        # Don't wait for requests for lower-priority versions
+        probes.cancel()
+    raise TransportError('Failed to get auth type from service')
+
+
+def _get_service_authtype_for_version(session, service_endpoint, version, name):
+    from .protocol import BaseProtocol
+    data = dummy_xml(version=version, name=name)
+    log.debug('Requesting %s from %s', data, service_endpoint)
+    r = session.post(url=service_endpoint, headers=DEFAULT_HEADERS.copy(), data=data, allow_redirects=True,
+                     timeout=BaseProtocol.TIMEOUT)
+    auth_type = _get_auth_method_from_response(response=r)
+    log.debug('Auth type is %s', auth_type)
+    return auth_type
+
+
 def _get_auth_method_from_response(response):
     # First, get the auth method from headers. Then, test credentials. Don't handle redirects - burden is on caller.
     log.debug('Request headers: %s', response.request.headers)
@@ -4,18 +4,23 @@ from base64 import b64decode
 from codecs import BOM_UTF8
 import datetime
 from decimal import Decimal
+import getpass
 import io
 import itertools
 import logging
+import os
 import re
 import socket
+import sys
+from threading import Event, Thread
 import time
 import xml.sax.expatreader
 import xml.sax.handler
 
 # Import _etree via defusedxml instead of directly from lxml.etree, to silence overly strict linters
-from defusedxml.lxml import parse, tostring, GlobalParserTLS, RestrictedElement, _etree
+from defusedxml.lxml import parse, tostring, check_docinfo, GlobalParserTLS, RestrictedElement, _etree
 from future.backports.misc import get_ident
+from future.moves.queue import Queue, Full
 from future.moves.urllib.parse import urlparse
 from future.utils import PY2
 import isodate
@@ -43,6 +48,14 @@ class ElementNotFound(Exception):
         self.data = data
 
 
+class DocumentEnd(Exception):
+    # Raised by StreamingDocumentHandler when the root element of an XML document is closed. 'byte_index' is the
+    # position of the end tag of the root element in the document.
+    def __init__(self, byte_index):
+        super(DocumentEnd, self).__init__()
+        self.byte_index = byte_index
+
+
 # Regex of UTF-8 control characters that are illegal in XML 1.0 (and XML 1.1)
 _ILLEGAL_XML_CHARS_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1F\uD800-\uDFFF\uFFFE\uFFFF]')
 
@@ -101,6 +114,134 @@ def chunkify(iterable, chunksize):
             yield chunk
 
 
+class ThreadedIterator(object):
+    """Consumes an iterable in a separate thread, buffering up to 'buffer_size' elements until they are retrieved.
+    Exceptions raised while consuming the iterable are re-raised in the thread retrieving the elements. Call close() to
+    stop the thread if the iterator is abandoned before it is exhausted.
+
+    This uses a dedicated thread instead of the protocol thread pool. The thread blocks while the buffer is full, and
+    blocked threads in the thread pool could starve other services that are waiting for results from the pool.
+    """
+    _DONE = object()
+
+    def __init__(self, iterable, buffer_size):
+        self._queue = Queue(maxsize=buffer_size)
+        self._stopped = Event()
+        self._exhausted = False
+        thread = Thread(target=self._consume, args=(iterable,))
+        thread.daemon = True
+        thread.start()
+
+    def _consume(self, iterable):
+        try:
+            for elem in iterable:
+                if not self._put((elem, None)):
+                    return
+        except Exception as e:
+            self._put((None, e))
+            return
+        self._put((self._DONE, None))
+
+    def _put(self, value):
+        # Returns False if the iterator was closed while we were waiting for room in the buffer
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(value, timeout=1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._exhausted:
+            raise StopIteration()
+        elem, e = self._queue.get()
+        if e is not None:
+            self._exhausted = True
+            raise e
+        if elem is self._DONE:
+            self._exhausted = True
+            raise StopIteration()
+        return elem
+
+    next = __next__  # Python 2
+
+    def close(self):
+        self._exhausted = True
+        self._stopped.set()
+
+
+class CancellableExecutor(object):
+    """Submits jobs to a thread pool. Call cancel() to prevent jobs that have not yet started from running. Jobs that
+    are already running are allowed to finish, but nobody will read their results.
+
+    multiprocessing.pool.ThreadPool has no way to remove a job from the queue, so cancelled jobs still pass through a
+    worker thread. They return immediately without doing any work, e.g. without acquiring a session.
+    """
+    def __init__(self, thread_pool):
+        self._thread_pool = thread_pool
+        self._cancelled = Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def submit(self, func, *args):
+        return self._thread_pool.apply_async(self._run, (func, args))
+
+    def _run(self, func, args):
+        if self._cancelled.is_set():
+            return None
+        return func(*args)
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+class ConcurrentCalls(object):
+    """Calls each of the functions in 'funcs' in a separate thread. get(i) waits for the i'th function to return and
+    returns its result or re-raises its exception. This lets the caller consume the results in a fixed priority order
+    while slow calls run in parallel with fast ones.
+
+    Call cancel() when the remaining results are no longer needed. Calls that have not started yet are skipped. Calls
+    that are already running can't be interrupted, but their results are discarded. Like ThreadedIterator, this uses
+    dedicated threads because it is also used before a protocol, and thus a thread pool, exists.
+    """
+    def __init__(self, funcs):
+        self._results = [None] * len(funcs)
+        self._done = [Event() for _ in funcs]
+        self._cancelled = Event()
+        for i, func in enumerate(funcs):
+            thread = Thread(target=self._call, args=(i, func))
+            thread.daemon = True
+            thread.start()
+
+    def _call(self, i, func):
+        try:
+            if self._cancelled.is_set():
+                return
+            self._results[i] = (func(), None)
+        except Exception as e:
+            self._results[i] = (None, e)
+        finally:
+            self._done[i].set()
+
+    def get(self, i):
+        self._done[i].wait()
+        if self._cancelled.is_set() and self._results[i] is None:
+            raise ValueError('Call %s was cancelled' % i)
+        res, e = self._results[i]
+        if e is not None:
+            raise e
+        return res
+
+    def cancel(self):
+        self._cancelled.set()
+
+
 def peek(iterable):
     """
     Checks if an iterable is empty and returns status and the rewinded iterable
@@ -127,7 +268,7 @@ def xml_to_str(tree, encoding=None, xml_declaration=False):
     if xml_declaration and not encoding:
         raise ValueError("'xml_declaration' is not supported when 'encoding' is None")
     if encoding:
-        return tostring(tree, encoding=encoding, xml_declaration=True)
+        return tostring(tree, encoding=encoding, xml_declaration=xml_declaration)
     return tostring(tree, encoding=text_type, xml_declaration=False)
 
 
@@ -142,6 +283,61 @@ def get_xml_attrs(tree, name):
     return [elem.text for elem in tree.findall(name) if elem.text is not None]
 
 
+class ChildIndex(object):
+    """Wraps an element and looks up its direct children by tag in a dict that is built in a single pass over the
+    children. Model classes with many fields use this in from_xml(), where each field would otherwise search the
+    children of the element with find() or findall(). Everything else is delegated to the element.
+    """
+    # Maps paths passed to find() and findall() to whether they are a single tag. Paths are constants in the code, so
+    # this stays small.
+    _is_tag_cache = {}
+
+    __slots__ = ('elem', 'children')
+
+    def __init__(self, elem):
+        self.elem = elem
+        self.children = {}
+        for e in elem:
+            self.children.setdefault(e.tag, []).append(e)
+
+    @classmethod
+    def _is_tag(cls, path):
+        # Return True if path is a single, optionally namespaced tag and not an ElementPath expression. The namespace
+        # part of a tag may contain slashes and dots.
+        try:
+            return cls._is_tag_cache[path]
+        except KeyError:
+            local_name = path
+            if path.startswith('{'):
+                _, sep, local_name = path.partition('}')
+                if not sep:
+                    local_name = ''
+            is_tag = cls._is_tag_cache[path] = bool(local_name) and not any(c in local_name for c in '{}/[*.')
+            return is_tag
+
+    def find(self, path):
+        children = self.children.get(path)
+        if children:
+            return children[0]
+        if self._is_tag(path):
+            return None
+        return self.elem.find(path)
+
+    def findall(self, path):
+        if not self._is_tag(path):
+            return self.elem.findall(path)
+        return list(self.children.get(path, ()))
+
+    def __iter__(self):
+        return iter(self.elem)
+
+    def __len__(self):
+        return len(self.elem)
+
+    def __getattr__(self, item):
+        return getattr(self.elem, item)
+
+
 def value_to_xml_text(value):
     # We can't handle bytes in this function because str == bytes on Python2
     from .ewsdatetime import EWSTimeZone, EWSDateTime, EWSDate
@@ -227,7 +423,7 @@ def safe_xml_value(value, replacement='?'):
 
 def create_element(name, **attrs):
     # copy.deepcopy() is an order of magnitude faster than creating a new Element() every time
-    if ':' in name:
+    if ':' in name and not name.startswith('{'):
         ns, name = name.split(':')
         name = '{%s}%s' % (ns_translation[ns], name)
     elem = RestrictedElement(**attrs)
@@ -323,6 +519,77 @@ class StreamingBase64Parser(xml.sax.expatreader.ExpatParser):
         self.buffer = [remainder] if remainder else []
 
 
+class StreamingDocumentHandler(xml.sax.handler.ContentHandler):
+    """A SAX content handler that tells the parser when the root element of the current XML document is closed, by
+    raising DocumentEnd. The parser must have a 'current_byte_index' method.
+    """
+    def __init__(self, parser):
+        xml.sax.handler.ContentHandler.__init__(self)
+        self._parser = parser
+        self._depth = 0
+
+    def startDocument(self):
+        self._depth = 0
+
+    def startElementNS(self, name, qname, attrs):
+        self._depth += 1
+
+    def endElementNS(self, name, qname):
+        self._depth -= 1
+        if self._depth == 0:
+            # Get the position now. The parser has moved on when the exception reaches it.
+            raise DocumentEnd(byte_index=self._parser.current_byte_index())
+
+
+class StreamingDocumentParser(xml.sax.expatreader.ExpatParser):
+    """A SAX parser that splits a stream of concatenated XML documents, e.g. the SOAP envelopes returned by the
+    GetStreamingEvents service, and returns a generator of the documents as bytes, as soon as each one is complete.
+    """
+    def __init__(self, *args, **kwargs):
+        xml.sax.expatreader.ExpatParser.__init__(self, *args, **kwargs)
+        self._namespaces = True
+        self.buffer = None
+        self.setContentHandler(StreamingDocumentHandler(parser=self))
+
+    def parse(self, source):
+        # Unlike StreamingBase64Parser, read data as soon as it arrives instead of in fixed-size blocks. The server may
+        # keep the connection open for a long time between documents.
+        self.prepareParser(xml.sax.xmlreader.InputSource())
+        self.buffer = b''
+        try:
+            for chunk in source.iter_content(chunk_size=None):
+                for document in self.feed(chunk):
+                    yield document
+        finally:
+            source.close()
+        if self.buffer.strip():
+            log.debug('Discarding incomplete XML document at end of stream: %s', self.buffer)
+        self.buffer = None
+
+    def feed(self, data, isFinal=0):
+        # Like upstream, but yields each XML document that was completed by this data. The data following the end of a
+        # document is fed to a fresh parser.
+        while True:
+            if not self.buffer:
+                # Expat does not allow whitespace before the XML declaration of a new document
+                data = data.lstrip()
+            if not data:
+                return
+            self.buffer += data
+            try:
+                xml.sax.expatreader.ExpatParser.feed(self, data=data, isFinal=isFinal)
+                return
+            except DocumentEnd as de:
+                end = self.buffer.index(b'>', de.byte_index) + 1
+                document, data = self.buffer[:end], self.buffer[end:]
+                self.buffer = b''
+                self._parsing = False  # Makes the next call to feed() start a new document
+                yield document
+
+    def current_byte_index(self):
+        return self._parser.CurrentByteIndex
+
+
 class ForgivingParser(GlobalParserTLS):
     parser_config = {
         'resolve_entities': False,
@@ -352,7 +619,7 @@ class BytesGeneratorIO(io.BytesIO):
         if size is None or size <= -1:
             res = b''.join(self._bytes_generator)
         else:
-            res = b''.join(next(self._bytes_generator) for _ in range(size))
+            res = b''.join(itertools.islice(self._bytes_generator, size))
         self._tell += len(res)
         return res
 
@@ -388,6 +655,51 @@ def to_xml(bytes_content):
         raise ParseError('This is not XML: %r' % stream.read(), '<not from file>', -1, 0)
 
 
+def iterparse(bytes_content, events=('end',)):
+    # Like to_xml(), but returns a generator of (event, element) tuples while the XML is being parsed. The caller is
+    # responsible for removing elements from the tree when they are no longer needed.
+    #
+    # lxml.etree.iterparse() does not accept a parser instance, so we apply the same restrictions as the defusedxml
+    # parser used by to_xml() here: elements are RestrictedElement instances, and documents with a DTD or entity
+    # declarations are rejected before any elements are returned. EWS responses never contain a DTD.
+    if isinstance(bytes_content, bytes):
+        stream = io.BytesIO(bytes_content)
+    else:
+        stream = BytesGeneratorIO(bytes_content)
+    parser_kwargs = dict(_forgiving_parser.parser_config)
+    parser_kwargs.update(remove_comments=True, remove_pis=True, no_network=True)
+    if 'start' not in events:
+        # We need a 'start' event to check the document before the first element is returned
+        events = ('start',) + tuple(events)
+        skip_start = True
+    else:
+        skip_start = False
+    checked = False
+    try:
+        context = _etree.iterparse(stream, events=events, **parser_kwargs)
+        context.set_element_class_lookup(_etree.ElementDefaultClassLookup(element=RestrictedElement))
+        for event, elem in context:
+            if not checked:
+                check_docinfo(elem.getroottree(), forbid_dtd=True, forbid_entities=True)
+                checked = True
+            if skip_start and event == 'start':
+                continue
+            yield event, elem
+        if not checked:
+            # The recovering parser returns no elements instead of raising an error
+            raise ParseError('This is not XML', '<not from file>', -1, 0)
+    except AssertionError as e:
+        raise ParseError(e.args[0], '<not from file>', -1, 0)
+    except _etree.ParseError as e:
+        if isinstance(e, ParseError):
+            raise
+        if hasattr(e, 'position'):
+            e.lineno, e.offset = e.position
+        raise ParseError(text_type(e), '<not from file>', e.lineno or -1, e.offset or 0)
+    except TypeError:
+        raise ParseError('This is not XML', '<not from file>', -1, 0)
+
+
 def is_xml(text):
     """
     Helper function. Lightweight test if response is an XML doc
@@ -499,6 +811,18 @@ def split_url(url):
     return parsed_url.scheme == 'https', parsed_url.netloc.lower(), parsed_url.path
 
 
+def shelve_filename(name='cache'):
+    # 'shelve' may pickle objects using different pickle protocol versions. Append the python major+minor version
+    # numbers to the filename. Also append the username, to avoid permission errors.
+    major, minor = sys.version_info[:2]
+    try:
+        user = getpass.getuser()
+    except KeyError:
+        # getuser() fails on some systems. Provide a sane default. See issue #448
+        user = 'exchangelib'
+    return 'exchangelib.{name}.{user}.py{major}{minor}'.format(name=name, user=user, major=major, minor=minor)
+
+
 def get_redirect_url(response, allow_relative=True, require_relative=False):
     # allow_relative=False throws RelativeRedirect error if scheme and hostname are equal to the request
     # require_relative=True throws RelativeRedirect error if scheme and hostname are not equal to the request
@@ -549,6 +873,29 @@ except ImportError:
     pass
 
 
+# In Python 2, we want this to be a 'str' object so logging doesn't break (all formatting arguments are 'str'). We
+# activated 'unicode_literals' at the top of this file, so it would be a 'unicode' object unless we convert to 'str'
+# explicitly. This is a no-op for Python 3.
+POST_LOG_MSG = str('''\
+Retry: %(retry)s
+Waited: %(wait)s
+Timeout: %(timeout)s
+Session: %(session_id)s
+Thread: %(thread_id)s
+Auth type: %(auth)s
+URL: %(url)s
+HTTP adapter: %(adapter)s
+Allow redirects: %(allow_redirects)s
+Streaming: %(stream)s
+Response time: %(response_time)s
+Status code: %(status_code)s
+Request headers: %(request_headers)s
+Response headers: %(response_headers)s
+Request data: %(xml_request)s
+Response data: %(xml_response)s
+''')
+
+
 def post_ratelimited(protocol, session, url, headers, data, allow_redirects=False, stream=False):
     """
     There are two error-handling policies implemented here: a fail-fast policy intended for stand-alone scripts which
@@ -570,36 +917,18 @@ def post_ratelimited(protocol, session, url, headers, data, allow_redirects=Fals
     malfunctions. The only cure is to stop making requests.
 
     The contract on sessions here is to return the session that ends up being used, or retiring the session if we
-    intend to raise an exception. We give up on max_wait timeout, not number of retries.
+    intend to raise an exception. The retry policy of the protocol decides how long to wait between retries. By default,
+    we give up on max_wait timeout, not number of retries.
 
     An additional resource on handling throttling policies and client back off strategies:
         https://msdn.microsoft.com/en-us/library/office/jj945066(v=exchg.150).aspx#bk_ThrottlingBatch
     """
     thread_id = get_ident()
-    wait = 10  # seconds
+    wait = 0  # seconds
+    total_wait = 0
     retry = 0
     redirects = 0
-    # In Python 2, we want this to be a 'str' object so logging doesn't break (all formatting arguments are 'str').
-    # We activated 'unicode_literals' at the top of this file, so it would be a 'unicode' object unless we convert
-    # to 'str' explicitly. This is a no-op for Python 3.
-    log_msg = str('''\
-Retry: %(retry)s
-Waited: %(wait)s
-Timeout: %(timeout)s
-Session: %(session_id)s
-Thread: %(thread_id)s
-Auth type: %(auth)s
-URL: %(url)s
-HTTP adapter: %(adapter)s
-Allow redirects: %(allow_redirects)s
-Streaming: %(stream)s
-Response time: %(response_time)s
-Status code: %(status_code)s
-Request headers: %(request_headers)s
-Response headers: %(response_headers)s
-Request data: %(xml_request)s
-Response data: %(xml_response)s
-''')
+    log_msg = POST_LOG_MSG
     log_vals = dict(
         retry=retry,
         wait=wait,
@@ -618,11 +947,17 @@ Response data: %(xml_response)s
         xml_request=data,
         xml_response=None,
     )
+    rate_limiter = protocol.get_rate_limiter()
+    throttling_registry = protocol.THROTTLING_REGISTRY
+    started = time_func()
     try:
         while True:
             _back_off_if_needed(protocol.credentials.back_off_until)
             log.debug('Session %s thread %s: retry %s timeout %s POST\'ing to %s after %ss wait', session.session_id,
                       thread_id, retry, protocol.TIMEOUT, url, wait)
+            slot = None if throttling_registry is None else throttling_registry.acquire(protocol)
+            if rate_limiter is not None:
+                rate_limiter.acquire()
             d_start = time_func()
             # Always create a dummy response for logging purposes, in case we fail in the following
             r = DummyResponse(url=url, headers={}, request_headers=headers)
@@ -633,6 +968,10 @@ Response data: %(xml_response)s
                 log.debug('Session %s thread %s: connection error POST\'ing to %s', session.session_id, thread_id, url)
                 r = DummyResponse(url=url, headers={'TimeoutException': e}, request_headers=headers)
             finally:
+                if rate_limiter is not None:
+                    rate_limiter.release()
+                if throttling_registry is not None:
+                    throttling_registry.release(slot)
                 log_vals.update(
                     retry=retry,
                     wait=wait,
@@ -645,12 +984,14 @@ Response data: %(xml_response)s
                     xml_response='[STREAMING]' if stream else r.content,
                 )
             log.debug(log_msg, log_vals)
-            if _may_retry_on_error(r, protocol, wait):
-                log.info("Session %s thread %s: Connection error on URL %s (code %s). Cool down %s secs",
+            if _may_retry_on_error(r, protocol):
+                wait = protocol.retry_policy.get_wait(protocol=protocol, response=r, retry=retry,
+                                                      total_wait=total_wait, started=started)
+                log.info("Session %s thread %s: Connection error on URL %s (code %s). Cool down %.1f secs",
                          session.session_id, thread_id, r.url, r.status_code, wait)
-                time.sleep(wait)  # Increase delay for every retry
+                time.sleep(wait)
                 retry += 1
-                wait *= 2
+                total_wait += wait
                 session = protocol.renew_session(session)
                 continue
             if r.status_code in (301, 302):
@@ -679,6 +1020,7 @@ Response data: %(xml_response)s
             if stream:
                 r.close()
     log.debug('Session %s thread %s: Useful response from %s', session.session_id, thread_id, url)
+    protocol.retry_policy.record_success()
     return r, session
 
 
@@ -691,7 +1033,7 @@ def _back_off_if_needed(back_off_until):
             time.sleep(sleep_secs)
 
 
-def _may_retry_on_error(response, protocol, wait):
+def _may_retry_on_error(response, protocol):
     # The genericerrorpage.htm/internalerror.asp is ridiculous behaviour for random outages. Redirect to
     # '/internalsite/internalerror.asp' or '/internalsite/initparams.aspx' is caused by e.g. TLS certificate
     # f*ckups on the Exchange server.
@@ -705,10 +1047,7 @@ def _may_retry_on_error(response, protocol, wait):
             return False
         if protocol.credentials.fail_fast:
             return False
-        if wait > protocol.credentials.max_wait:
-            # We lost patience. Session is cleaned up in outer loop
-            raise RateLimitError(
-                'Max timeout reached', url=response.url, status_code=response.status_code, total_wait=wait)
+        # The retry policy decides how long to wait, and when to give up
         return True
     return False
 
@@ -10,7 +10,7 @@ from six import text_type
 from .errors import TransportError, ErrorInvalidSchemaVersionForMailboxVersion, ErrorInvalidServerVersion, \
     ResponseMessageError
 from .transport import get_auth_instance
-from .util import is_xml, to_xml, TNS, SOAPNS, ParseError
+from .util import is_xml, to_xml, TNS, SOAPNS, ParseError, xml_to_str
 
 log = logging.getLogger(__name__)
 
@@ -265,14 +265,20 @@ class Version(object):
                 raise TransportError('No header in XML response (%r)' % bytes_content)
         except ParseError:
             raise TransportError('Unknown XML response (%r)' % bytes_content)
+        return cls.from_soap_header(requested_api_version=requested_api_version, header=header)
 
+    @classmethod
+    def from_soap_header(cls, requested_api_version, header):
+        # Like from_response(), but takes the already parsed SOAP header element of the response
+        if header is None:
+            raise TransportError('No header in XML response')
         info = header.find('{%s}ServerVersionInfo' % TNS)
         if info is None:
-            raise TransportError('No ServerVersionInfo in response: %r' % bytes_content)
+            raise TransportError('No ServerVersionInfo in response: %s' % xml_to_str(header))
         try:
             build = Build.from_xml(elem=info)
         except ValueError:
-            raise TransportError('Bad ServerVersionInfo in response: %r' % bytes_content)
+            raise TransportError('Bad ServerVersionInfo in response: %s' % xml_to_str(header))
         # Not all Exchange servers send the Version element
         api_version_from_server = info.get('Version') or build.api_version()
         if api_version_from_server != requested_api_version:
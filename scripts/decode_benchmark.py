@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Measures the cost of decoding items from a synthetic GetItem response, with and without the child index used by
+# Item.from_xml(). No server is needed.
+import time
+
+from exchangelib.items import Message
+from exchangelib.util import to_xml
+
+ITEM_COUNT = 1000
+ROUNDS = 5
+
+ITEM_XML = '''\
+<t:Message>
+  <t:ItemId Id="AAMkADQ%(i)s=" ChangeKey="CQAAABYAAAA%(i)s"/>
+  <t:ParentFolderId Id="AQMkADQ=" ChangeKey="AQAAAA=="/>
+  <t:ItemClass>IPM.Note</t:ItemClass>
+  <t:Subject>Benchmark message %(i)s</t:Subject>
+  <t:Sensitivity>Normal</t:Sensitivity>
+  <t:Body BodyType="Text">This is the body of message %(i)s</t:Body>
+  <t:DateTimeReceived>2018-01-01T10:00:00Z</t:DateTimeReceived>
+  <t:Size>2048</t:Size>
+  <t:Categories><t:String>foo</t:String><t:String>bar</t:String></t:Categories>
+  <t:Importance>Normal</t:Importance>
+  <t:DateTimeSent>2018-01-01T09:59:00Z</t:DateTimeSent>
+  <t:DateTimeCreated>2018-01-01T10:00:00Z</t:DateTimeCreated>
+  <t:ReminderIsSet>false</t:ReminderIsSet>
+  <t:ReminderMinutesBeforeStart>0</t:ReminderMinutesBeforeStart>
+  <t:DisplayCc/>
+  <t:DisplayTo>Jane Doe</t:DisplayTo>
+  <t:HasAttachments>false</t:HasAttachments>
+  <t:Culture>en-US</t:Culture>
+  <t:LastModifiedName>John Doe</t:LastModifiedName>
+  <t:LastModifiedTime>2018-01-01T10:00:00Z</t:LastModifiedTime>
+  <t:ConversationId Id="AAQkADQ%(i)s="/>
+  <t:Sender><t:Mailbox><t:Name>John Doe</t:Name><t:EmailAddress>john@example.com</t:EmailAddress>
+    <t:RoutingType>SMTP</t:RoutingType></t:Mailbox></t:Sender>
+  <t:ToRecipients><t:Mailbox><t:Name>Jane Doe</t:Name><t:EmailAddress>jane@example.com</t:EmailAddress>
+    <t:RoutingType>SMTP</t:RoutingType></t:Mailbox></t:ToRecipients>
+  <t:IsReadReceiptRequested>false</t:IsReadReceiptRequested>
+  <t:ConversationIndex>AQHTgvuZ</t:ConversationIndex>
+  <t:ConversationTopic>Benchmark message %(i)s</t:ConversationTopic>
+  <t:From><t:Mailbox><t:Name>John Doe</t:Name><t:EmailAddress>john@example.com</t:EmailAddress>
+    <t:RoutingType>SMTP</t:RoutingType></t:Mailbox></t:From>
+  <t:InternetMessageId>&lt;%(i)s@example.com&gt;</t:InternetMessageId>
+  <t:IsRead>true</t:IsRead>
+  <t:IsResponseRequested>false</t:IsResponseRequested>
+</t:Message>'''
+
+RESPONSE_XML = '''\
+<?xml version="1.0" encoding="utf-8"?>
+<m:Items xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages"
+    xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">
+%s
+</m:Items>''' % '\n'.join(ITEM_XML % dict(i=i) for i in range(ITEM_COUNT))
+
+
+def parse_items():
+    return to_xml(RESPONSE_XML.encode('utf-8')).getroot().findall(Message.response_tag())
+
+
+def decode_without_index(elem):
+    # The previous implementation of Item.from_xml(), where each field searches the children of the element
+    item_id, changekey = Message.id_from_xml(elem=elem)
+    kwargs = {f.name: f.from_xml(elem=elem, account=None) for f in Message.supported_fields()}
+    Message._clear(elem)
+    return Message(account=None, id=item_id, changekey=changekey, **kwargs)
+
+
+def decode_with_index(elem):
+    return Message.from_xml(elem=elem, account=None)
+
+
+def measure(decode):
+    best = None
+    for _ in range(ROUNDS):
+        elems = parse_items()
+        t1 = time.monotonic()
+        items = [decode(e) for e in elems]
+        delta = time.monotonic() - t1
+        assert len(items) == ITEM_COUNT
+        best = delta if best is None else min(best, delta)
+    return best
+
+
+# Both implementations must return the same items
+assert [decode_with_index(e) for e in parse_items()] == [decode_without_index(e) for e in parse_items()]
+print('Decoding %s items with %s fields each, best of %s rounds' % (
+    ITEM_COUNT, len(Message.supported_fields()), ROUNDS))
+for label, decode in (('Without child index', decode_without_index), ('With child index', decode_with_index)):
+    delta = measure(decode)
+    print('%s: %.3f sec total, %.1f usec per item' % (label, delta, delta / ITEM_COUNT * 1000000))
@@ -9,6 +9,7 @@ import time
 from yaml import safe_load
 
 from exchangelib import DELEGATE, ServiceAccount, Configuration, Account, EWSDateTime, EWSTimeZone, CalendarItem
+from exchangelib.protocol import Autotuner
 
 logging.basicConfig(level=logging.WARNING)
 
@@ -89,3 +90,11 @@ for i in range(1, 11):
     config.protocol.poolsize = i
     test(calitems, chunk_size)
     time.sleep(60)
+
+print('\nTesting autotuner')
+config.protocol.autotuner = Autotuner(protocol=config.protocol)
+for i in range(1, 11):
+    test(calitems, None)
+    print('Tuned chunk sizes: %s / %s, pool size %s' % (
+        config.protocol.autotuner.get_chunk_size('CreateItem'), config.protocol.autotuner.get_chunk_size('DeleteItem'),
+        config.protocol.session_pool_size))
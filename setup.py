@@ -43,11 +43,14 @@ setup(
                       'isodate'],
     extras_require={
         'kerberos': ['requests_kerberos'],
+        'async': ['aiohttp'],
     },
     packages=['exchangelib'],
     tests_require=['PyYAML', 'requests_mock', 'psutil'],
     python_requires=">=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*",
     test_suite='tests',
+    # Only load the tests that tests/__init__.py imports. Some test modules don't parse on all Python versions.
+    test_loader='unittest:TestLoader',
     zip_safe=False,
     url='https://github.com/ecederstrand/exchangelib',
     classifiers=[
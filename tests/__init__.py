@@ -9,19 +9,27 @@ from inspect import isclass
 from itertools import chain
 import io
 from keyword import kwlist
+from multiprocessing.pool import ThreadPool
 import logging
 import os
 import pickle
 import random
+import re
+import shutil
 import socket
+import sqlite3
 import string
+import sys
 import tempfile
+import threading
 import time
 import unittest
 import unittest.util
 import warnings
 
 from dateutil.relativedelta import relativedelta
+from defusedxml import DTDForbidden
+from defusedxml.lxml import RestrictedElement
 import dns.resolver
 import psutil
 import pytz
@@ -35,6 +43,8 @@ from exchangelib.account import Account, SAVE_ONLY, SEND_ONLY, SEND_AND_SAVE_COP
 from exchangelib.attachments import FileAttachment, ItemAttachment, AttachmentId
 from exchangelib.autodiscover import AutodiscoverProtocol, discover
 import exchangelib.autodiscover
+import exchangelib.protocol
+import exchangelib.services
 from exchangelib.configuration import Configuration
 from exchangelib.credentials import DELEGATE, IMPERSONATION, Credentials, ServiceAccount
 from exchangelib.errors import RelativeRedirect, ErrorItemNotFound, ErrorInvalidOperation, AutoDiscoverRedirect, \
@@ -59,14 +69,15 @@ from exchangelib.folders import Calendar, DeletedItems, Drafts, Inbox, Outbox, S
     AllItems, ConversationSettings, Friends, RSSFeeds, Sharing, IMContactList, QuickContacts, Journal, Notes, \
     SyncIssues, MyContacts, ToDoSearch, FolderCollection, DistinguishedFolderId, Files, \
     DefaultFoldersChangeHistory, PassThroughSearchResults, SmsAndChatsSync, GraphAnalytics, Signal, \
-    PdpProfileV2Secured, VoiceMail
+    PdpProfileV2Secured, VoiceMail, Root
 from exchangelib.indexed_properties import EmailAddress, PhysicalAddress, PhoneNumber, \
     SingleFieldIndexedElement, MultiFieldIndexedElement
 from exchangelib.items import Item, CalendarItem, Message, Contact, Task, DistributionList, Persona
 from exchangelib.properties import Attendee, Mailbox, RoomList, MessageHeader, Room, ItemId, Member, EWSElement, Body, \
     HTMLBody, TimeZone, FreeBusyView, PersonaId, UID, InvalidField, InvalidFieldForVersion, DLMailbox, PermissionSet, \
-    Permission, UserId
-from exchangelib.protocol import BaseProtocol, Protocol, NoVerifyHTTPAdapter
+    Permission, UserId, NewMailEvent, ModifiedEvent
+from exchangelib.protocol import BaseProtocol, CachingProtocol, Protocol, NoVerifyHTTPAdapter, Autotuner, DiscoveryCache, \
+    discovery_cache, RateLimiter, ThrottlingRegistry, RetryPolicy
 from exchangelib.queryset import QuerySet, DoesNotExist, MultipleObjectsReturned
 from exchangelib.recurrence import Recurrence, AbsoluteYearlyPattern, RelativeYearlyPattern, AbsoluteMonthlyPattern, \
     RelativeMonthlyPattern, WeeklyPattern, DailyPattern, FirstOccurrence, LastOccurrence, Occurrence, \
@@ -74,10 +85,13 @@ from exchangelib.recurrence import Recurrence, AbsoluteYearlyPattern, RelativeYe
 from exchangelib.restriction import Restriction, Q
 from exchangelib.settings import OofSettings
 from exchangelib.services import GetServerTimeZones, GetRoomLists, GetRooms, GetAttachment, ResolveNames, GetPersona, \
-    GetFolder, TNS
-from exchangelib.transport import NOAUTH, BASIC, DIGEST, NTLM, wrap, _get_auth_method_from_response
+    GetFolder, GetItem, FindItem, SyncFolderItems, IterparsedResponse, TNS, create_shape_element, \
+    GetStreamingEvents
+from exchangelib.transport import NOAUTH, BASIC, DIGEST, NTLM, wrap, _get_auth_method_from_response, \
+    get_service_authtype
 from exchangelib.util import chunkify, peek, get_redirect_url, to_xml, BOM_UTF8, get_domain, value_to_xml_text, \
-    post_ratelimited, create_element, CONNECTION_ERRORS, PrettyXmlHandler, xml_to_str, ParseError
+    post_ratelimited, create_element, CONNECTION_ERRORS, PrettyXmlHandler, xml_to_str, ParseError, ConcurrentCalls, \
+    DummyResponse, time_func, SOAPNS, MNS, add_xml_child, ChildIndex, iterparse
 from exchangelib.version import Build, Version, EXCHANGE_2007, EXCHANGE_2010, EXCHANGE_2013
 from exchangelib.winzone import generate_map, CLDR_TO_MS_TIMEZONE_MAP
 
@@ -286,6 +300,16 @@ class ConfigurationTest(unittest.TestCase):
 
 
 class ProtocolTest(unittest.TestCase):
+    def setUp(self):
+        # Use a private discovery cache file, so tests don't depend on earlier runs
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_discovery_storage = exchangelib.protocol.DISCOVERY_PERSISTENT_STORAGE
+        exchangelib.protocol.DISCOVERY_PERSISTENT_STORAGE = os.path.join(self.tmp_dir, 'discovery')
+
+    def tearDown(self):
+        discovery_cache._close_connection()
+        exchangelib.protocol.DISCOVERY_PERSISTENT_STORAGE = self.orig_discovery_storage
+        shutil.rmtree(self.tmp_dir)
 
     @requests_mock.mock()
     def test_session(self, m):
@@ -312,6 +336,415 @@ class ProtocolTest(unittest.TestCase):
             self.assertEqual(id(base_p.thread_pool), id(p.thread_pool))
             self.assertEqual(id(base_p._session_pool), id(p._session_pool))
 
+    def test_autotuner(self):
+        protocol = Protocol(service_endpoint='https://example.com/Autotune.asmx', credentials=Credentials('A', 'B'),
+                            auth_type=NTLM, version=Version(Build(15, 1)))
+        protocol.MAX_SESSION_POOLSIZE = protocol.SESSION_POOLSIZE + 1
+        autotuner = Autotuner(protocol=protocol)
+        protocol.autotuner = autotuner
+        self.assertEqual(autotuner.get_chunk_size('GetItem'), 100)
+        with self.assertRaises(ValueError):
+            Autotuner(protocol=protocol, min_chunk_size=200, max_chunk_size=300, initial_chunk_size=100)
+
+        def record_window(chunk_size, duration):
+            for _ in range(autotuner.WINDOW_SIZE):
+                autotuner.record('GetItem', item_count=chunk_size, duration=duration, payload_size=chunk_size * 100)
+
+        # The first window always moves up. The session pool doesn't grow during the cool-down period
+        pool_size = protocol.session_pool_size
+        record_window(100, duration=1)
+        self.assertEqual(autotuner.get_chunk_size('GetItem'), 125)
+        self.assertEqual(protocol.session_pool_size, pool_size)
+        # The autotuner replaces the recovery after throttling
+        protocol.SESSION_POOLSIZE_COOLDOWN = 0
+        protocol.recover_poolsize()
+        self.assertEqual(protocol.session_pool_size, pool_size)
+        # Throughput improved. Grow the session pool
+        record_window(125, duration=0.5)
+        self.assertEqual(autotuner.get_chunk_size('GetItem'), 156)
+        self.assertEqual(protocol.session_pool_size, pool_size + 1)
+        self.assertEqual(protocol._session_pool.maxsize, pool_size + 1)
+        # Never grow the session pool beyond the max size of the protocol
+        record_window(156, duration=0.5)
+        self.assertEqual(autotuner.get_chunk_size('GetItem'), 195)
+        self.assertEqual(protocol.session_pool_size, pool_size + 1)
+        protocol.increase_poolsize()
+        self.assertEqual(protocol.session_pool_size, pool_size + 1)
+        # Throughput deteriorated a lot. Turn around
+        record_window(195, duration=100)
+        self.assertEqual(autotuner.get_chunk_size('GetItem'), 156)
+        # Throttling halves the chunk size. Other services are not affected
+        autotuner.record_throttling('GetItem')
+        self.assertEqual(autotuner.get_chunk_size('GetItem'), 78)
+        self.assertEqual(autotuner.get_chunk_size('CreateItem'), 100)
+        # Large items limit the chunk size
+        for _ in range(autotuner.WINDOW_SIZE):
+            autotuner.record('CreateItem', item_count=100, duration=1, payload_size=autotuner.max_payload_size * 10)
+        self.assertEqual(autotuner.get_chunk_size('CreateItem'), autotuner.min_chunk_size)
+        # Chunks follow the current chunk size
+        self.assertEqual([len(c) for c in autotuner.chunkify('GetItem', range(200))], [78, 78, 44])
+
+    def test_poolsize_recovery(self):
+        protocol = Protocol(service_endpoint='https://example.com/Recover.asmx', credentials=Credentials('A', 'B'),
+                            auth_type=NTLM, version=Version(Build(15, 1)))
+        max_size = protocol.max_session_pool_size
+        self.assertEqual([s for _, s in protocol.session_pool_history], [max_size])
+        protocol.decrease_poolsize()
+        protocol.decrease_poolsize()
+        self.assertEqual(protocol.session_pool_size, max_size - 2)
+        # Nothing happens during the cool-down period
+        protocol.recover_poolsize()
+        self.assertEqual(protocol.session_pool_size, max_size - 2)
+        # Recover one session at a time, up to the max size
+        protocol.SESSION_POOLSIZE_COOLDOWN = 0
+        for _ in range(3):
+            protocol.recover_poolsize()
+        self.assertEqual(protocol.session_pool_size, max_size)
+        sessions = [protocol.get_session() for _ in range(max_size)]
+        self.assertEqual(protocol._session_count, max_size)
+        for session in sessions:
+            protocol.release_session(session)
+        self.assertEqual([s for _, s in protocol.session_pool_history],
+                         [max_size, max_size - 1, max_size - 2, max_size - 1, max_size])
+
+    def test_dedicated_session(self):
+        # Test that dedicated sessions never enter the session pool
+        protocol = Protocol(service_endpoint='https://example.com/Dedicated.asmx', credentials=Credentials('A', 'B'),
+                            auth_type=NTLM, version=Version(Build(15, 1)))
+        session = protocol.create_dedicated_session()
+        session = protocol.renew_session(session)
+        self.assertTrue(session.dedicated)
+        protocol.release_session(session)
+        protocol.retire_session(protocol.create_dedicated_session())
+        self.assertEqual(protocol._session_count, 0)
+        self.assertEqual(protocol._session_pool.qsize(), 0)
+
+    def test_decrease_poolsize_sessions_in_use(self):
+        # Test that decreasing the pool size doesn't wait for a session when all sessions are in use
+        protocol = Protocol(service_endpoint='https://example.com/Decrease.asmx', credentials=Credentials('A', 'B'),
+                            auth_type=NTLM, version=Version(Build(15, 1)))
+        pool_size = protocol.session_pool_size
+        sessions = [protocol.get_session() for _ in range(pool_size)]
+        protocol.decrease_poolsize()
+        self.assertEqual(protocol.session_pool_size, pool_size - 1)
+        self.assertEqual(protocol._session_count, pool_size)
+        # The surplus session is discarded when it is released
+        for session in sessions:
+            protocol.release_session(session)
+        self.assertEqual(protocol._session_count, pool_size - 1)
+        self.assertEqual(protocol._session_pool.qsize(), pool_size - 1)
+
+    def test_protocol_cache_eviction(self):
+        # Test that the least recently used protocols are evicted when the cache is full
+        max_protocols = CachingProtocol.MAX_CACHED_PROTOCOLS
+        reap_idle_sessions = Protocol.reap_idle_sessions
+        try:
+            protocol = Protocol(service_endpoint='https://example.com/Evict1.asmx', credentials=Credentials('A', 'B'),
+                                auth_type=NTLM, version=Version(Build(15, 1)))
+            self.assertIsNotNone(protocol.thread_pool)
+            protocol.last_used = 0  # Make this the least recently used protocol
+            # Idle sessions are reaped after releasing the cache lock
+            reaped = []
+            Protocol.reap_idle_sessions = lambda p, max_idle=None: reaped.append(
+                (p, max_idle, CachingProtocol._protocol_cache_lock.locked())
+            )
+            CachingProtocol.MAX_CACHED_PROTOCOLS = len(CachingProtocol._protocol_cache)
+            Protocol(service_endpoint='https://example.com/Evict2.asmx', credentials=Credentials('A', 'B'),
+                     auth_type=NTLM, version=Version(Build(15, 1)))
+            self.assertEqual(len(CachingProtocol._protocol_cache), CachingProtocol.MAX_CACHED_PROTOCOLS)
+            self.assertNotIn(('https://example.com/Evict1.asmx', Credentials('A', 'B')),
+                             CachingProtocol._protocol_cache)
+            self.assertTrue(reaped)
+            self.assertNotIn(True, [locked for _, _, locked in reaped])
+            # All idle sessions of the evicted protocol are closed, but it keeps its thread pool, since it may still be
+            # in use
+            self.assertIn((protocol, 0, False), reaped)
+            thread_pool = protocol.thread_pool
+            self.assertIs(protocol.__dict__.get('thread_pool'), thread_pool)
+            protocol.release_session(protocol.get_session())
+            # The thread pool is closed when the protocol is closed, and re-created if the protocol is used again
+            protocol.close()
+            self.assertNotIn('thread_pool', protocol.__dict__)
+            self.assertIsNot(protocol.thread_pool, thread_pool)
+        finally:
+            CachingProtocol.MAX_CACHED_PROTOCOLS = max_protocols
+            Protocol.reap_idle_sessions = reap_idle_sessions
+
+    def test_protocol_cache_sweep_on_release(self):
+        # Test that idle protocols are evicted when sessions are released, not only when protocols are created
+        swept = CachingProtocol._protocol_cache_swept
+        try:
+            idle_protocol = Protocol(service_endpoint='https://example.com/Idle.asmx',
+                                     credentials=Credentials('A', 'B'), auth_type=NTLM, version=Version(Build(15, 1)))
+            idle_session = idle_protocol.get_session()
+            idle_protocol.release_session(idle_session)
+            closed = []
+            idle_session.close = lambda: closed.append(idle_session)
+            protocol = Protocol(service_endpoint='https://example.com/Busy.asmx', credentials=Credentials('A', 'B'),
+                                auth_type=NTLM, version=Version(Build(15, 1)))
+            session = protocol.get_session()
+            idle_protocol.last_used -= CachingProtocol.PROTOCOL_IDLE_TIMEOUT
+            CachingProtocol._protocol_cache_swept = 0
+            protocol.release_session(session)
+            self.assertNotIn(('https://example.com/Idle.asmx', Credentials('A', 'B')), CachingProtocol._protocol_cache)
+            self.assertIn(('https://example.com/Busy.asmx', Credentials('A', 'B')), CachingProtocol._protocol_cache)
+            # Sessions of the evicted protocol are closed
+            self.assertEqual(closed, [idle_session])
+        finally:
+            CachingProtocol._protocol_cache_swept = swept
+
+    def test_reap_idle_sessions(self):
+        protocol = Protocol(service_endpoint='https://example.com/Reap.asmx', credentials=Credentials('A', 'B'),
+                            auth_type=NTLM, version=Version(Build(15, 1)))
+        closed = []
+        session = protocol.get_session()
+        session.close = lambda: closed.append(session)
+        protocol.release_session(session)
+        self.assertEqual(protocol.reap_idle_sessions(), 0)
+        session.last_used -= protocol.SESSION_IDLE_TIMEOUT
+        self.assertEqual(protocol.reap_idle_sessions(), 1)
+        self.assertEqual(closed, [session])
+        # Reaped sessions are kept in the pool
+        self.assertEqual(protocol._session_pool.qsize(), 1)
+
+    @requests_mock.mock()
+    def test_lazy_sessions(self, m):
+        url = 'https://example.com/Lazy.asmx'
+        m.get(url, status_code=401)
+        protocol = Protocol(service_endpoint=url, credentials=Credentials('A', 'B'), auth_type=NTLM,
+                            version=Version(Build(15, 1)))
+        # No sessions are created until they are needed
+        self.assertEqual(protocol._session_count, 0)
+        session = protocol.get_session()
+        self.assertEqual(protocol._session_count, 1)
+        protocol.release_session(session)
+        self.assertEqual(id(protocol.get_session()), id(session))
+        protocol.release_session(session)
+        # Warm up the remaining sessions in the background. They are added to the pool when they are authenticated
+        warm_up = protocol.warm_up()
+        warm_up_count = protocol.session_pool_size - 1
+        for i in range(warm_up_count):
+            warm_up.get(i)
+        self.assertEqual(m.call_count, warm_up_count)
+        self.assertEqual(protocol._session_count, protocol.session_pool_size)
+        self.assertEqual(protocol._session_pool.qsize(), protocol.session_pool_size)
+        # Surplus sessions are closed when the pool size is decreased
+        protocol.decrease_poolsize()
+        self.assertEqual(protocol._session_count, protocol.session_pool_size)
+        self.assertEqual(protocol._session_pool.qsize(), protocol.session_pool_size)
+
+    def test_rate_limiter(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(rate=1, min_rate=2)
+        with self.assertRaises(ValueError):
+            RateLimiter(max_concurrent=0)
+        rate_limiter = RateLimiter(rate=10, burst=2, max_concurrent=3)
+        # The burst is admitted immediately. After that, requests are spaced out
+        self.assertEqual(rate_limiter.try_acquire(), 0)
+        self.assertEqual(rate_limiter.try_acquire(), 0)
+        self.assertGreater(rate_limiter.try_acquire(), 0)
+        # The concurrency budget is used up
+        self.assertIsNone(rate_limiter.try_acquire())
+        rate_limiter.release()
+        self.assertIsNotNone(rate_limiter.try_acquire())
+        for _ in range(3):
+            rate_limiter.release()
+        # The server asked us to back off. Requests must wait for the back off period, and the rate is lowered
+        rate_limiter.back_off(5)
+        self.assertEqual(rate_limiter.rate, 5)
+        self.assertGreater(rate_limiter.try_acquire(), 4)
+        # The rate recovers gradually on successful requests
+        rate_limiter.release()
+        self.assertEqual(rate_limiter.rate, 5.5)
+        for _ in range(20):
+            rate_limiter.try_acquire()
+            rate_limiter.release()
+        self.assertEqual(rate_limiter.rate, 10)
+        # Rate limiters survive pickling
+        self.assertEqual(pickle.loads(pickle.dumps(rate_limiter)).rate, 10)
+
+        # Protocols use the rate limiter of the credentials unless they have their own
+        shared = RateLimiter()
+        protocol = Protocol(service_endpoint='https://example.com/RateLimit.asmx',
+                            credentials=ServiceAccount('A', 'B', rate_limiter=shared), auth_type=NTLM,
+                            version=Version(Build(15, 1)))
+        self.assertEqual(id(protocol.get_rate_limiter()), id(shared))
+        protocol.rate_limiter = rate_limiter
+        self.assertEqual(id(protocol.get_rate_limiter()), id(rate_limiter))
+
+    def test_retry_policy(self):
+        protocol = Protocol(service_endpoint='https://example.com/Retry.asmx',
+                            credentials=ServiceAccount('A', 'B', max_wait=100), auth_type=NTLM,
+                            version=Version(Build(15, 1)))
+        with self.assertRaises(ValueError):
+            RetryPolicy(base_wait=10, max_backoff=5)
+        response = DummyResponse(url='https://example.com/Retry.asmx', headers={}, request_headers={})
+        started = time_func()
+        # Exponential back off without jitter
+        policy = RetryPolicy(jitter=False, max_backoff=30)
+        self.assertEqual([policy.get_wait(protocol, response, retry, 0, started) for retry in range(4)],
+                         [10, 20, 30, 30])
+        # Full jitter stays within the exponential back off
+        policy = RetryPolicy()
+        for retry in range(4):
+            self.assertLessEqual(policy.get_wait(protocol, response, retry, 0, started), 10 * 2 ** retry)
+        # We honour the Retry-After header
+        retry_after = DummyResponse(url=response.url, headers={'Retry-After': '50'}, request_headers={})
+        self.assertGreaterEqual(policy.get_wait(protocol, retry_after, 0, 0, started), 50)
+        # We give up when max_wait is reached, or at the deadline
+        with self.assertRaises(RateLimitError) as e:
+            policy.get_wait(protocol, retry_after, 0, 60, started)
+        self.assertEqual(e.exception.value, 'Max timeout reached')
+        with self.assertRaises(RateLimitError) as e:
+            RetryPolicy(deadline=20).get_wait(protocol, retry_after, 0, 0, started)
+        self.assertEqual(e.exception.value, 'Deadline reached')
+        self.assertEqual(policy.stats['retries'], 5)
+        self.assertEqual(policy.stats['gave_up'], 1)
+        # The retry budget is used up by retries and refilled by successful requests
+        policy = RetryPolicy(jitter=False, retry_budget=1, budget_ratio=0.5)
+        policy.get_wait(protocol, response, 0, 0, started)
+        with self.assertRaises(RateLimitError) as e:
+            policy.get_wait(protocol, response, 1, 0, started)
+        self.assertEqual(e.exception.value, 'Retry budget exhausted')
+        policy.record_success()
+        policy.record_success()
+        policy.get_wait(protocol, response, 1, 0, started)
+        self.assertEqual(policy.stats['successes'], 2)
+
+    def test_throttling_registry(self):
+        protocol = Protocol(service_endpoint='https://example.com/Throttling.asmx', credentials=Credentials('A', 'B'),
+                            auth_type=NTLM, version=Version(Build(15, 1)))
+        other_protocol = Protocol(service_endpoint='https://example.com/Throttling.asmx',
+                                  credentials=Credentials('C', 'D'), auth_type=NTLM, version=Version(Build(15, 1)))
+        with self.assertRaises(ValueError):
+            ThrottlingRegistry(max_concurrent=0)
+        registry = ThrottlingRegistry(max_concurrent=2)
+        registry.clear()
+        # Another registry instance sees the same state, like another process would
+        other_registry = ThrottlingRegistry(max_concurrent=2)
+        slot_1 = registry.acquire(protocol)
+        slot_2, delay = other_registry.try_acquire(protocol)
+        self.assertEqual(delay, 0)
+        # The concurrency limit is per credentials
+        self.assertIsNone(other_registry.try_acquire(protocol))
+        other_registry.release(other_registry.acquire(other_protocol))
+        registry.release(slot_1)
+        self.assertIsNotNone(other_registry.try_acquire(protocol))
+        registry.clear()
+        # Slots of dead processes expire
+        short_lease_registry = ThrottlingRegistry(max_concurrent=2, lease_timeout=0)
+        for _ in range(3):
+            self.assertIsNotNone(short_lease_registry.try_acquire(protocol))
+        registry.clear()
+        # Back off periods are shared. A shorter back off doesn't cut a longer one short.
+        registry.back_off(protocol, 10)
+        registry.back_off(protocol, 1)
+        _, delay = other_registry.try_acquire(protocol)
+        self.assertGreater(delay, 9)
+        _, delay = other_registry.try_acquire(other_protocol)
+        self.assertEqual(delay, 0)
+        registry.clear()
+
+    @requests_mock.mock()
+    def test_discovery_cache(self, m):
+        # Test that new protocols use the auth type and version that were probed by an earlier protocol
+        url = 'https://example.com/Discovery.asmx'
+        m.get('https://example.com/EWS/types.xsd', status_code=404)
+        m.post(url, [dict(status_code=401, headers={'WWW-Authenticate': 'Basic realm="foo"'}), dict(text='''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Header>
+    <h:ServerVersionInfo MajorVersion="15" MinorVersion="1" MajorBuildNumber="1" MinorBuildNumber="2"
+        Version="V2016_10_10" xmlns:h="http://schemas.microsoft.com/exchange/services/2006/types"/>
+  </s:Header>
+  <s:Body>
+    <m:ResolveNamesResponse xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">
+      <m:ResponseMessages>
+        <m:ResolveNamesResponseMessage ResponseClass="Error">
+          <m:MessageText>No results were found.</m:MessageText>
+          <m:ResponseCode>ErrorNameResolutionNoResults</m:ResponseCode>
+          <m:DescriptiveLinkKey>0</m:DescriptiveLinkKey>
+        </m:ResolveNamesResponseMessage>
+      </m:ResponseMessages>
+    </m:ResolveNamesResponse>
+  </s:Body>
+</s:Envelope>''')])
+        protocol = Protocol(service_endpoint=url, credentials=Credentials('A', 'B'), auth_type=None)
+        self.assertEqual(protocol.auth_type, BASIC)
+        self.assertEqual(protocol.version.build, Build(15, 1, 1, 2))
+        self.assertFalse(protocol.auth_type_from_cache)
+        call_count = m.call_count
+
+        # Use different credentials, so we don't get the same protocol instance
+        cached_protocol = Protocol(service_endpoint=url, credentials=Credentials('C', 'D'), auth_type=None)
+        self.assertEqual(m.call_count, call_count)
+        self.assertEqual(cached_protocol.auth_type, BASIC)
+        self.assertEqual(cached_protocol.version.build, protocol.version.build)
+        self.assertEqual(cached_protocol.version.api_version, protocol.version.api_version)
+        self.assertTrue(cached_protocol.auth_type_from_cache)
+        self.assertTrue(cached_protocol.version_from_cache)
+        self.assertIsNone(DiscoveryCache(ttl=0).get(url))
+
+        # Rejected values that did not come from the cache don't invalidate the cache entry
+        ResolveNames(protocol=protocol)._invalidate_discovery_cache(auth_type=True, version=True)
+        self.assertIsNotNone(discovery_cache.get(url))
+
+        # A corrected server version is stored in the cache
+        header = to_xml(b'''\
+<s:Header xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <h:ServerVersionInfo MajorVersion="15" MinorVersion="1" MajorBuildNumber="3" MinorBuildNumber="4"
+      Version="V2016_10_10" xmlns:h="http://schemas.microsoft.com/exchange/services/2006/types"/>
+</s:Header>''').getroot()
+        ResolveNames(protocol=cached_protocol)._update_api_version(
+            hint=Version(build=None, api_version='Exchange2013'), api_version='Exchange2016', header=header
+        )
+        self.assertEqual(discovery_cache.get(url)[2].build, Build(15, 1, 3, 4))
+
+        # The entry is removed when the server rejects our credentials
+        self.assertIsNotNone(discovery_cache.get(url))
+        m.post(url, status_code=401)
+        with self.assertRaises(UnauthorizedError):
+            list(ResolveNames(protocol=cached_protocol).call(unresolved_entries=['foo']))
+        self.assertIsNone(discovery_cache.get(url))
+
+        # We can recover from a destroyed file
+        discovery_cache.set(url, auth_type=BASIC, docs_auth_type=BASIC, version=protocol.version)
+        discovery_cache._close_connection()
+        for f in glob.glob(exchangelib.protocol.DISCOVERY_PERSISTENT_STORAGE + '*'):
+            with open(f, 'w') as fp:
+                fp.write('XXX')
+        self.assertIsNone(discovery_cache.get(url))
+
+    @requests_mock.mock()
+    def test_concurrent_service_authtype(self, m):
+        # Test that the first working version in the list wins, even if it's not the first to respond
+        url = 'https://example.com/Concurrent.asmx'
+
+        def response(request, context):
+            version = re.search(r'Version="([^"]+)"', request.body.decode('utf-8')).group(1)
+            if version == 'Exchange2007':
+                context.status_code = 500
+            elif version == 'Exchange2010':
+                context.status_code = 401
+                context.headers['WWW-Authenticate'] = 'NTLM'
+            else:
+                context.status_code = 401
+                context.headers['WWW-Authenticate'] = 'Basic realm="foo"'
+            return ''
+
+        m.post(url, text=response)
+        versions = ['Exchange2007', 'Exchange2010', 'Exchange2013']
+        self.assertEqual(get_service_authtype(service_endpoint=url, versions=versions, name='foo'), NTLM)
+        BaseProtocol.CONCURRENT_PROBING = True
+        try:
+            for _ in range(5):
+                self.assertEqual(get_service_authtype(service_endpoint=url, versions=versions, name='foo'), NTLM)
+            m.post(url, status_code=500)
+            with self.assertRaises(TransportError):
+                get_service_authtype(service_endpoint=url, versions=versions, name='foo')
+        finally:
+            BaseProtocol.CONCURRENT_PROBING = False
+
     def test_close(self):
         proc = psutil.Process()
         ip_addresses = {info[4][0] for info in socket.getaddrinfo(
@@ -605,6 +1038,31 @@ class PropertiesTest(unittest.TestCase):
         self.assertEqual(Item.get_field_by_fieldname('foo'), field)
         Item.remove_field(field)
 
+    def test_field_tables(self):
+        # Field lookups are cached per class and version, and the caches are cleared when fields are registered
+        class TestProp(ExtendedProperty):
+            property_set_id = 'deadbeaf-cafe-cafe-cafe-deadbeefcafe'
+            property_name = 'Test Property'
+            property_type = 'Integer'
+
+        version = Version(build=EXCHANGE_2010)
+        self.assertIs(Message.supported_fields(version=version), Message.supported_fields(version=version))
+        self.assertNotIn('text_body', {f.name for f in Message.supported_fields(version=version)})
+        self.assertIn('text_body', {f.name for f in Message.supported_fields(version=Version(build=EXCHANGE_2013))})
+        self.assertEqual(Message.get_field_by_fieldname('subject').name, 'subject')
+        self.assertNotIn('dead_beef', {f.name for f in Inbox.allowed_item_fields(version=version)})
+        Message.register(attr_name='dead_beef', attr_cls=TestProp)
+        try:
+            self.assertIn('dead_beef', {f.name for f in Message.supported_fields(version=version)})
+            self.assertEqual(Message.get_field_by_fieldname('dead_beef').value_cls, TestProp)
+            self.assertIn('dead_beef', {f.name for f in Inbox.allowed_item_fields(version=version)})
+        finally:
+            Message.deregister(attr_name='dead_beef')
+        self.assertNotIn('dead_beef', {f.name for f in Message.supported_fields(version=version)})
+        self.assertNotIn('dead_beef', {f.name for f in Inbox.allowed_item_fields(version=version)})
+        with self.assertRaises(InvalidField):
+            Message.get_field_by_fieldname('dead_beef')
+
     def test_itemid_equality(self):
         self.assertEqual(ItemId('X', 'Y'), ItemId('X', 'Y'))
         self.assertNotEqual(ItemId('X', 'Y'), ItemId('X', 'Z'))
@@ -1132,6 +1590,117 @@ class QuerySetTest(unittest.TestCase):
         self.assertNotEqual(id(qs.return_format), id(new_qs.return_format))
         self.assertNotEqual(qs.return_format, new_qs.return_format)
 
+    @requests_mock.mock()
+    def test_fan_out(self, m):
+        # Test that each folder is queried separately, and that results are merged on the order_by fields
+        subjects = {'AAA': ['a', 'c', 'd', 'f'], 'BBB': ['b', 'e'], 'CCC': []}
+        folder_ids = []
+
+        def response(request, context):
+            folder_id = re.findall(r'FolderId Id="(\w+)"', request.body.decode('utf-8'))
+            folder_ids.append(folder_id)
+            reverse = 'Order="Descending"' in request.body.decode('utf-8')
+            items = ''.join(
+                '<t:Message><t:ItemId Id="%s" ChangeKey="CK"/><t:Subject>%s</t:Subject></t:Message>' % (s, s)
+                for s in sorted(subjects[folder_id[0]], reverse=reverse)
+            )
+            return '''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <m:FindItemResponse xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages"
+        xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">
+      <m:ResponseMessages>
+        <m:FindItemResponseMessage ResponseClass="Success">
+          <m:ResponseCode>NoError</m:ResponseCode>
+          <m:RootFolder TotalItemsInView="%s" IncludesLastItemInRange="true">
+            <t:Items>%s</t:Items>
+          </m:RootFolder>
+        </m:FindItemResponseMessage>
+      </m:ResponseMessages>
+    </m:FindItemResponse>
+  </s:Body>
+</s:Envelope>''' % (len(subjects[folder_id[0]]), items)
+
+        endpoint = 'https://example.com/EWS/Exchange.asmx'
+        m.post(endpoint, text=response)
+        account = Account(
+            primary_smtp_address='foo@example.com', access_type=DELEGATE, autodiscover=False,
+            default_timezone=UTC, config=Configuration(
+                service_endpoint=endpoint, credentials=Credentials('foo', 'bar'), auth_type=NTLM,
+                version=Version(build=EXCHANGE_2010)
+            )
+        )
+        root = Root(account=account, id='XXX', changekey='YYY')
+        folders = FolderCollection(account=account, folders=[Messages(root=root, id=i, changekey='CK')
+                                                             for i in sorted(subjects)])
+        qs = folders.all().order_by('subject').values_list('subject', flat=True)
+        qs.fan_out = True
+        self.assertEqual(list(qs.iterator()), ['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertEqual(sorted(folder_ids), [['AAA'], ['BBB'], ['CCC']])
+        self.assertEqual(list(qs.order_by('-subject')[1:4]), ['e', 'd', 'c'])
+        # Unordered results are returned in folder order
+        qs = folders.all().values_list('id', flat=True)
+        qs.fan_out = True
+        self.assertEqual(list(qs.iterator()), ['a', 'c', 'd', 'f', 'b', 'e'])
+
+    @requests_mock.mock()
+    def test_find_and_fetch(self, m):
+        # Test that FindItem page size and GetItem chunk size are independent when complex fields are requested
+        find_page_sizes, get_chunk_sizes = [], []
+
+        def response(request, context):
+            body = request.body.decode('utf-8')
+            if 'FindItem' in body:
+                offset = int(re.search(r'Offset="(\d+)"', body).group(1))
+                page_size = int(re.search(r'MaxEntriesReturned="(\d+)"', body).group(1))
+                find_page_sizes.append(page_size)
+                ids = list(range(7))[offset:offset + page_size]
+                items = ''.join('<t:Message><t:ItemId Id="%s" ChangeKey="CK"/></t:Message>' % i for i in ids)
+                root_folder = '<m:RootFolder IndexedPagingOffset="%s" TotalItemsInView="7" ' \
+                              'IncludesLastItemInRange="%s"><t:Items>%s</t:Items></m:RootFolder>' \
+                              % (offset + len(ids), 'true' if offset + len(ids) >= 7 else 'false', items)
+                messages = '<m:FindItemResponseMessage ResponseClass="Success"><m:ResponseCode>NoError' \
+                           '</m:ResponseCode>%s</m:FindItemResponseMessage>' % root_folder
+                service = 'FindItem'
+            else:
+                ids = re.findall(r'ItemId Id="(\w+)"', body)
+                get_chunk_sizes.append(len(ids))
+                messages = ''.join(
+                    '<m:GetItemResponseMessage ResponseClass="Success"><m:ResponseCode>NoError</m:ResponseCode>'
+                    '<m:Items><t:Message><t:ItemId Id="%s" ChangeKey="CK"/><t:Body BodyType="Text">%s</t:Body>'
+                    '</t:Message></m:Items></m:GetItemResponseMessage>' % (i, i) for i in ids
+                )
+                service = 'GetItem'
+            return '''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <m:%sResponse xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages"
+        xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">
+      <m:ResponseMessages>%s</m:ResponseMessages>
+    </m:%sResponse>
+  </s:Body>
+</s:Envelope>''' % (service, messages, service)
+
+        endpoint = 'https://example.com/EWS/Exchange.asmx'
+        m.post(endpoint, text=response)
+        account = Account(
+            primary_smtp_address='foo@example.com', access_type=DELEGATE, autodiscover=False,
+            default_timezone=UTC, config=Configuration(
+                service_endpoint=endpoint, credentials=Credentials('foo', 'bar'), auth_type=NTLM,
+                version=Version(build=EXCHANGE_2010)
+            )
+        )
+        account.root = Root(account=account, id='XXX', changekey='YYY')
+        folder = Inbox(root=account.root, id='AAA', changekey='CK')
+        qs = folder.all().only('body')
+        qs.page_size = 2
+        qs.chunk_size = 3
+        self.assertEqual([i.body for i in qs.iterator()], [str(i) for i in range(7)])
+        self.assertEqual(find_page_sizes, [2, 2, 2, 2])
+        self.assertEqual(sorted(get_chunk_sizes), [1, 3, 3])  # GetItem requests run concurrently
+
 
 class ServicesTest(unittest.TestCase):
     def test_invalid_server_version(self):
@@ -1145,8 +1714,490 @@ class ServicesTest(unittest.TestCase):
         with self.assertRaises(NotImplementedError):
             GetRooms(protocol=account.protocol).call('XXX')
 
+    @requests_mock.mock()  # Just to make sure we don't make any requests
+    def test_sync_folder_items(self, m):
+        # Test parsing of the different change types and the sync state in a SyncFolderItems response
+        xml = b'''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <m:SyncFolderItemsResponse xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages"
+        xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">
+      <m:ResponseMessages>
+        <m:SyncFolderItemsResponseMessage ResponseClass="Success">
+          <m:ResponseCode>NoError</m:ResponseCode>
+          <m:SyncState>H4sIAAA==</m:SyncState>
+          <m:IncludesLastItemInRange>true</m:IncludesLastItemInRange>
+          <m:Changes>
+            <t:Create>
+              <t:Message>
+                <t:ItemId Id="AAA" ChangeKey="BBB" />
+                <t:Subject>Hello</t:Subject>
+              </t:Message>
+            </t:Create>
+            <t:Delete>
+              <t:ItemId Id="CCC" ChangeKey="DDD" />
+            </t:Delete>
+            <t:ReadFlagChange>
+              <t:ItemId Id="EEE" ChangeKey="FFF" />
+              <t:IsRead>true</t:IsRead>
+            </t:ReadFlagChange>
+          </m:Changes>
+        </m:SyncFolderItemsResponseMessage>
+      </m:ResponseMessages>
+    </m:SyncFolderItemsResponse>
+  </s:Body>
+</s:Envelope>'''
+        account = Account(
+            primary_smtp_address='foo@example.com', access_type=DELEGATE, autodiscover=False,
+            default_timezone=UTC, config=Configuration(
+                service_endpoint='https://example.com/EWS/Exchange.asmx', credentials=Credentials('foo', 'bar'),
+                auth_type=NTLM, version=Version(build=EXCHANGE_2010)
+            )
+        )
+        service = SyncFolderItems(account=account)
+        response = service._get_soap_payload(response=MockResponse(xml))
+        service._get_response_xml = lambda payload: response
+        changes = list(service.call(folder=Folder(id='XXX', changekey='YYY'), shape='IdOnly', additional_fields=None,
+                                    sync_state=None, ignore=None, max_changes_returned=512, sync_scope=None))
+        self.assertEqual(service.sync_state, 'H4sIAAA==')
+        self.assertEqual(service.includes_last_item_in_range, True)
+        self.assertEqual([c[0] for c in changes], [service.CREATE, service.DELETE, service.READ_FLAG_CHANGE])
+        self.assertIsInstance(changes[0][1], Message)
+        self.assertEqual((changes[0][1].id, changes[0][1].subject), ('AAA', 'Hello'))
+        self.assertEqual(changes[1][1], ItemId('CCC', 'DDD'))
+        self.assertEqual(changes[2][1], (ItemId('EEE', 'FFF'), True))
+
+    def test_get_item_incremental(self):
+        # Test that GetItem returns items and acceptable errors while the response is being parsed, and that returned
+        # items are removed from the tree.
+        xml = b'''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <m:GetItemResponse xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages"
+        xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">
+      <m:ResponseMessages>
+        <m:GetItemResponseMessage ResponseClass="Success">
+          <m:ResponseCode>NoError</m:ResponseCode>
+          <m:Items>
+            <t:Message>
+              <t:ItemId Id="AAA" ChangeKey="BBB" />
+              <t:Subject>Hello</t:Subject>
+            </t:Message>
+          </m:Items>
+        </m:GetItemResponseMessage>
+        <m:GetItemResponseMessage ResponseClass="Error">
+          <m:MessageText>The specified object was not found in the store.</m:MessageText>
+          <m:ResponseCode>ErrorItemNotFound</m:ResponseCode>
+          <m:DescriptiveLinkKey>0</m:DescriptiveLinkKey>
+          <m:Items />
+        </m:GetItemResponseMessage>
+      </m:ResponseMessages>
+    </m:GetItemResponse>
+  </s:Body>
+</s:Envelope>'''
+        account = Account(
+            primary_smtp_address='foo@example.com', access_type=DELEGATE, autodiscover=False,
+            default_timezone=UTC, config=Configuration(
+                service_endpoint='https://example.com/EWS/Exchange.asmx', credentials=Credentials('foo', 'bar'),
+                auth_type=NTLM, version=Version(build=EXCHANGE_2010)
+            )
+        )
+        service = GetItem(account=account)
+        response = service._get_soap_payload(response=MockResponse(xml))
+        self.assertIsInstance(response, IterparsedResponse)
+        res = service._get_elements_in_response(response=response)
+        elem = next(res)
+        self.assertEqual(elem.tag, '{%s}Message' % TNS)
+        self.assertEqual(elem.findtext('{%s}Subject' % TNS), 'Hello')
+        self.assertIsInstance(next(res), ErrorItemNotFound)
+        self.assertIsNone(elem.getparent())
+        self.assertEqual(list(res), [])
+
+        # SOAP faults are raised before any elements are returned
+        fault_xml = b'''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <s:Fault>
+      <faultcode>a:ErrorServerBusy</faultcode>
+      <faultstring>The server cannot service this request right now. Try again later.</faultstring>
+      <detail>
+        <e:ResponseCode xmlns:e="http://schemas.microsoft.com/exchange/services/2006/errors">ErrorServerBusy</e:ResponseCode>
+      </detail>
+    </s:Fault>
+  </s:Body>
+</s:Envelope>'''
+        with self.assertRaises(ErrorServerBusy):
+            GetItem._get_soap_payload(response=MockResponse(fault_xml))
+
+        # Parse errors are raised as SOAPError, like when the response is parsed at once
+        def broken_content():
+            yield xml[:xml.index(b'<t:Message>')]
+            from lxml.etree import XMLSyntaxError
+            raise XMLSyntaxError('Broken response', 1, 1, 1)
+
+        with self.assertRaises(SOAPError):
+            list(GetItem._get_soap_payload(response=MockResponse(broken_content())))
+
+        # Documents with a DTD are rejected
+        dtd_xml = xml.replace(b'<s:Envelope', b'<!DOCTYPE foo [<!ENTITY bar "baz">]>\n<s:Envelope', 1)
+        with self.assertRaises(DTDForbidden):
+            GetItem._get_soap_payload(response=MockResponse(dtd_xml))
+
+    def test_get_soap_parts(self):
+        # Test that the SOAP header is returned from the same parse as the payload, both when parsing incrementally and
+        # when parsing the whole response at once.
+        xml = b'''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Header>
+    <h:ServerVersionInfo MajorVersion="15" MinorVersion="1" MajorBuildNumber="1" MinorBuildNumber="2"
+        Version="V2016_10_10" xmlns:h="http://schemas.microsoft.com/exchange/services/2006/types"/>
+  </s:Header>
+  <s:Body>
+    <m:{service}Response xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">
+      <m:ResponseMessages>
+        <m:{service}ResponseMessage ResponseClass="Success">
+          <m:ResponseCode>NoError</m:ResponseCode>
+        </m:{service}ResponseMessage>
+      </m:ResponseMessages>
+    </m:{service}Response>
+  </s:Body>
+</s:Envelope>'''
+        for service_cls in (GetItem, ResolveNames):
+            header, messages = service_cls._get_soap_parts(
+                response=MockResponse(xml.replace(b'{service}', service_cls.SERVICE_NAME.encode('ascii')))
+            )
+            self.assertEqual(header.tag, '{%s}Header' % SOAPNS)
+            self.assertEqual(len(list(messages)), 1)
+            version = Version.from_soap_header(requested_api_version='Exchange2016', header=header)
+            self.assertEqual(version.build, Build(15, 1, 1, 2))
+            self.assertEqual(version.api_version, 'Exchange2016')
+        # The header can also be read without parsing the body
+        header = ResolveNames._get_soap_header(response=MockResponse(xml))
+        self.assertEqual(header.tag, '{%s}Header' % SOAPNS)
+        with self.assertRaises(TransportError):
+            Version.from_soap_header(requested_api_version='Exchange2016', header=None)
+
+    def test_create_shape_element(self):
+        version = Version(build=EXCHANGE_2010)
+        additional_fields = [FieldPath(field=f) for f in Message.FIELDS if f.name in ('subject', 'sender')]
+        shape = create_shape_element(tag='m:ItemShape', shape='IdOnly', additional_fields=additional_fields,
+                                     version=version)
+        self.assertEqual(
+            xml_to_str(shape),
+            '<m:ItemShape xmlns:m="%s"><t:BaseShape xmlns:t="%s">IdOnly</t:BaseShape>'
+            '<t:AdditionalProperties xmlns:t="%s"><t:FieldURI FieldURI="message:Sender"/>'
+            '<t:FieldURI FieldURI="item:Subject"/></t:AdditionalProperties></m:ItemShape>' % (MNS, TNS, TNS)
+        )
+        # The next call returns an equal copy of the cached element, which can be appended to another request
+        shape_copy = create_shape_element(tag='m:ItemShape', shape='IdOnly', additional_fields=additional_fields,
+                                          version=version)
+        self.assertIsNot(shape, shape_copy)
+        self.assertEqual(xml_to_str(shape), xml_to_str(shape_copy))
+        create_element('m:GetItem').append(shape_copy)
+        self.assertIsNone(create_shape_element(tag='m:ItemShape', shape='IdOnly', additional_fields=additional_fields,
+                                               version=version).getparent())
+        # The order of the additional fields doesn't matter
+        cache_size = len(exchangelib.services._shape_cache)
+        shape_copy = create_shape_element(tag='m:ItemShape', shape='IdOnly',
+                                          additional_fields=list(reversed(additional_fields)), version=version)
+        self.assertEqual(xml_to_str(shape), xml_to_str(shape_copy))
+        self.assertEqual(len(exchangelib.services._shape_cache), cache_size)
+        # Different arguments give a different element
+        shape = create_shape_element(tag='m:FolderShape', shape='AllProperties', additional_fields=None, version=version)
+        self.assertEqual(
+            xml_to_str(shape),
+            '<m:FolderShape xmlns:m="%s"><t:BaseShape xmlns:t="%s">AllProperties</t:BaseShape></m:FolderShape>'
+            % (MNS, TNS)
+        )
+
+    def test_pool_requests_window(self):
+        # Test that results are returned in order, and that we don't read far ahead of the consumer in the input
+        class MockService(GetItem):
+            def _get_elements(self, payload):
+                # Make chunks finish out of order
+                time.sleep(random.random() / 100)
+                return payload
+
+        pulled = []
+
+        def items():
+            for i in range(1000):
+                pulled.append(i)
+                yield i
+
+        protocol = Protocol(service_endpoint='https://example.com/Window.asmx', credentials=Credentials('A', 'B'),
+                            auth_type=NTLM, version=Version(Build(15, 1)))
+        account = mock_account(version=protocol.version, protocol=protocol)
+        res = MockService(account=account, chunk_size=3)._pool_requests(payload_func=lambda chunk: chunk, items=items())
+        self.assertEqual(next(res), 0)
+        self.assertLessEqual(len(pulled), 4 * protocol.session_pool_size * 3)
+        self.assertEqual(list(res), list(range(1, 1000)))
+
+    def test_pool_requests_parse_in_worker(self):
+        # Test that pooled chunks are parsed in the worker threads, and that the parse time is reported to the autotuner
+        parse_threads = set()
+
+        class MockService(GetItem):
+            def _get_elements(self, payload):
+                # Emulate a response that is parsed while the elements are consumed
+                self._thread_state.payload_size = 0
+                for elem in payload:
+                    time.sleep(0.01)
+                    parse_threads.add(threading.current_thread())
+                    yield elem
+
+        protocol = Protocol(service_endpoint='https://example.com/ParseInWorker.asmx',
+                            credentials=Credentials('A', 'B'), auth_type=NTLM, version=Version(Build(15, 1)))
+        account = mock_account(version=protocol.version, protocol=protocol)
+        autotuner = Autotuner(protocol=protocol)
+        protocol.autotuner = autotuner
+        durations = []
+        autotuner.record = lambda service_name, item_count, duration, payload_size: durations.append(duration)
+        res = MockService(account=account)._pool_requests(payload_func=lambda chunk: chunk, items=range(12))
+        self.assertEqual(list(res), list(range(12)))
+        self.assertNotIn(threading.current_thread(), parse_threads)
+        self.assertEqual(len(durations), 1)
+        self.assertGreaterEqual(durations[0], 0.1)
+
+    def test_pool_requests_cancel(self):
+        # Test that chunks that have not started yet are cancelled when the consumer stops early
+        calls = []
+
+        class MockService(GetItem):
+            def _get_elements(self, payload):
+                calls.append(payload)
+                if list(payload) != [0]:
+                    time.sleep(0.05)
+                return payload
+
+        protocol = Protocol(service_endpoint='https://example.com/Cancel.asmx', credentials=Credentials('A', 'B'),
+                            auth_type=NTLM, version=Version(Build(15, 1)))
+        # Use a single worker thread, so we know that most chunks are still queued when we stop
+        thread_pool = ThreadPool(processes=1)
+        protocol.__dict__['thread_pool'] = thread_pool
+        account = mock_account(version=protocol.version, protocol=protocol)
+        res = MockService(account=account, chunk_size=1)._pool_requests(payload_func=lambda chunk: chunk,
+                                                                         items=range(100))
+        self.assertEqual(next(res), 0)
+        res.close()
+        thread_pool.close()
+        thread_pool.join()
+        self.assertEqual(list(calls[0]), [0])
+        self.assertLessEqual(len(calls), 3)
+
+    @requests_mock.mock()
+    def test_find_item_prefetch(self, m):
+        # Test that prefetched pages are returned in order, and that we continue from the offset reported by the server
+        # if it's not the offset we expected.
+        def response(request, context):
+            offset = int(re.search(r'Offset="(\d+)"', request.body.decode('utf-8')).group(1))
+            # The server returns a short first page, so the prefetched pages start at the wrong offset
+            ids = list(range(12))[offset:offset + (4 if offset == 0 else 5)]
+            items = ''.join('<t:Message><t:ItemId Id="%s" ChangeKey="CK"/></t:Message>' % i for i in ids)
+            return '''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <m:FindItemResponse xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages"
+        xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">
+      <m:ResponseMessages>
+        <m:FindItemResponseMessage ResponseClass="Success">
+          <m:ResponseCode>NoError</m:ResponseCode>
+          <m:RootFolder IndexedPagingOffset="%s" TotalItemsInView="%s" IncludesLastItemInRange="%s">
+            <t:Items>%s</t:Items>
+          </m:RootFolder>
+        </m:FindItemResponseMessage>
+      </m:ResponseMessages>
+    </m:FindItemResponse>
+  </s:Body>
+</s:Envelope>''' % (offset + len(ids), 12, 'true' if offset + len(ids) >= 12 else 'false', items)
+
+        endpoint = 'https://example.com/EWS/Exchange.asmx'
+        m.post(endpoint, text=response)
+        account = Account(
+            primary_smtp_address='foo@example.com', access_type=DELEGATE, autodiscover=False,
+            default_timezone=UTC, config=Configuration(
+                service_endpoint=endpoint, credentials=Credentials('foo', 'bar'), auth_type=NTLM,
+                version=Version(build=EXCHANGE_2010)
+            )
+        )
+        with self.assertRaises(ValueError):
+            FindItem(account=account, folders=[Folder(id='XXX', changekey='YYY')], prefetch_pages=-1)
+        service = FindItem(account=account, folders=[Folder(id='XXX', changekey='YYY')], chunk_size=5,
+                           prefetch_pages=2)
+        elems = service.call(additional_fields=None, restriction=None, order_fields=None, shape='IdOnly',
+                             query_string=None, depth='Shallow', calendar_view=None, max_items=None, offset=0)
+        self.assertEqual([e.find('{%s}ItemId' % TNS).get('Id') for e in elems],
+                         [str(i) for i in range(12)])
+
+    @requests_mock.mock()
+    def test_subscribe_streaming(self, m):
+        # Test that we can parse a stream of SOAP envelopes, reconnect when the server closes the connection, and
+        # unsubscribe when the generator is closed.
+        envelope = '''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <m:%(service)sResponse xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages"
+        xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">
+      <m:ResponseMessages>
+        <m:%(service)sResponseMessage ResponseClass="Success">
+          <m:ResponseCode>NoError</m:ResponseCode>
+          %(body)s
+        </m:%(service)sResponseMessage>
+      </m:ResponseMessages>
+    </m:%(service)sResponse>
+  </s:Body>
+</s:Envelope>'''
+        events = '''\
+<m:Notifications>
+  <m:Notification>
+    <t:SubscriptionId>XXX</t:SubscriptionId>
+    <t:NewMailEvent>
+      <t:Watermark>W1</t:Watermark>
+      <t:TimeStamp>2018-01-01T10:00:00Z</t:TimeStamp>
+      <t:ItemId Id="AAA" ChangeKey="BBB" />
+      <t:ParentFolderId Id="CCC" ChangeKey="DDD" />
+    </t:NewMailEvent>
+    <t:ModifiedEvent>
+      <t:Watermark>W2</t:Watermark>
+      <t:TimeStamp>2018-01-01T10:00:01Z</t:TimeStamp>
+      <t:FolderId Id="CCC" ChangeKey="EEE" />
+      <t:ParentFolderId Id="FFF" ChangeKey="GGG" />
+      <t:UnreadCount>3</t:UnreadCount>
+    </t:ModifiedEvent>
+  </m:Notification>
+</m:Notifications>
+<m:ConnectionStatus>OK</m:ConnectionStatus>'''
+        service_calls = []
+
+        def response(request, context):
+            service = request.body.split(b'<s:Body><m:')[1].split(b'>')[0].decode()
+            service_calls.append(service)
+            if service == 'Subscribe':
+                return (envelope % dict(service=service, body='<m:SubscriptionId>XXX</m:SubscriptionId>')).encode()
+            if service == 'Unsubscribe':
+                return (envelope % dict(service=service, body='')).encode()
+            # A keep-alive message, a message with events and a message telling us the connection is closed
+            return ('\r\n'.join(envelope % dict(service=service, body=body) for body in (
+                '<m:ConnectionStatus>OK</m:ConnectionStatus>', events, '<m:ConnectionStatus>Closed</m:ConnectionStatus>'
+            ))).encode()
+
+        service_endpoint = 'https://example.com/EWS/Exchange.asmx'
+        m.post(service_endpoint, content=response)
+        account = Account(
+            primary_smtp_address='foo@example.com', access_type=DELEGATE, autodiscover=False,
+            default_timezone=UTC, config=Configuration(
+                service_endpoint=service_endpoint, credentials=Credentials('foo', 'bar'), auth_type=NTLM,
+                version=Version(build=EXCHANGE_2013)
+            )
+        )
+        subscription = account.subscribe()
+        new_mail, modified, new_mail_again = [next(subscription) for _ in range(3)]
+        subscription.close()
+        self.assertIsInstance(new_mail, NewMailEvent)
+        self.assertEqual(new_mail.watermark, 'W1')
+        self.assertEqual(new_mail.timestamp, UTC.localize(EWSDateTime(2018, 1, 1, 10)))
+        self.assertEqual(new_mail.item_id, ItemId('AAA', 'BBB'))
+        self.assertIsInstance(modified, ModifiedEvent)
+        self.assertEqual((modified.folder_id.id, modified.unread_count), ('CCC', 3))
+        self.assertEqual(new_mail_again.watermark, 'W1')  # We got the events again after reconnecting
+        self.assertEqual(service_calls, ['Subscribe', 'GetStreamingEvents', 'GetStreamingEvents', 'Unsubscribe'])
+
+    @requests_mock.mock()
+    def test_streaming_session(self, m):
+        # Test that the session of a streaming response is not returned to the pool until the stream has been consumed
+        service_endpoint = 'https://example.com/EWS/Streaming.asmx'
+        m.post(service_endpoint, content=b'''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <m:GetStreamingEventsResponse xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">
+      <m:ResponseMessages>
+        <m:GetStreamingEventsResponseMessage ResponseClass="Success">
+          <m:ResponseCode>NoError</m:ResponseCode>
+          <m:ConnectionStatus>OK</m:ConnectionStatus>
+        </m:GetStreamingEventsResponseMessage>
+      </m:ResponseMessages>
+    </m:GetStreamingEventsResponse>
+  </s:Body>
+</s:Envelope>''')
+        account = Account(
+            primary_smtp_address='foo@example.com', access_type=DELEGATE, autodiscover=False,
+            default_timezone=UTC, config=Configuration(
+                service_endpoint=service_endpoint, credentials=Credentials('foo', 'bar'), auth_type=NTLM,
+                version=Version(build=EXCHANGE_2013)
+            )
+        )
+        released = []
+        release_session = account.protocol.release_session
+        account.protocol.release_session = lambda session: released.append(session) or release_session(session)
+        try:
+            service = GetStreamingEvents(account=account)
+            response = service._get_response_xml(payload=service.get_payload(
+                subscription_ids=['XXX'], connection_timeout=1
+            ))
+            self.assertEqual(released, [])
+            # The stream uses a session outside the pool, so other requests can still get a session while the stream
+            # is open, even if the pool only has room for one session.
+            while account.protocol.session_pool_size > 1:
+                account.protocol.decrease_poolsize()
+            account.protocol.release_session(account.protocol.get_session())
+            del released[:]
+            self.assertEqual(len(list(response)), 1)
+            self.assertEqual(len(released), 1)
+            self.assertTrue(released[0].dedicated)
+            self.assertEqual(account.protocol._session_count, 1)
+            # The session is also released when the consumer stops reading early
+            response = service._get_response_xml(payload=service.get_payload(
+                subscription_ids=['XXX'], connection_timeout=1
+            ))
+            next(response)
+            self.assertEqual(len(released), 1)
+            response.close()
+            self.assertEqual(len(released), 2)
+        finally:
+            del account.protocol.release_session
+
 
 class TransportTest(unittest.TestCase):
+    def test_wrap_cached_envelope(self):
+        # Test that the cached envelope is filled with the serialized content, using the namespace prefixes of the
+        # envelope, and that envelopes are not shared between accounts or versions.
+        MockTZ = namedtuple('EWSTimeZone', ['ms_id'])
+        MockAccount = namedtuple('Account', ['access_type', 'primary_smtp_address', 'default_timezone'])
+        for account in (
+                None,
+                MockAccount(DELEGATE, 'foo@example.com', MockTZ('XXX')),
+                MockAccount(IMPERSONATION, 'foo@example.com', MockTZ('XXX')),
+                MockAccount(IMPERSONATION, 'bar@example.com', MockTZ('YYY')),
+        ):
+            for version in ('Exchange2010', 'Exchange2016'):
+                for _ in range(2):
+                    content = create_element('m:GetItem')
+                    add_xml_child(content, 't:BaseShape', 'IdOnly')
+                    wrapped = wrap(content=content, version=version, account=account)
+                    self.assertIn(b'<s:Body><m:GetItem><t:BaseShape>IdOnly</t:BaseShape></m:GetItem></s:Body>',
+                                  wrapped)
+                    root = to_xml(wrapped)
+                    header = root.find('{%s}Header' % SOAPNS)
+                    self.assertEqual(header.find('{%s}RequestServerVersion' % TNS).get('Version'), version)
+                    impersonation = header.find('{%s}ExchangeImpersonation' % TNS)
+                    timezone = header.find('{%s}TimeZoneContext/{%s}TimeZoneDefinition' % (TNS, TNS))
+                    if account is None:
+                        self.assertIsNone(timezone)
+                    else:
+                        self.assertEqual(timezone.get('Id'), account.default_timezone.ms_id)
+                    if account is None or account.access_type == DELEGATE:
+                        self.assertIsNone(impersonation)
+                    else:
+                        self.assertEqual(impersonation.findtext('{%s}ConnectingSID/{%s}PrimarySmtpAddress' % (
+                            TNS, TNS)), account.primary_smtp_address)
+
     @requests_mock.mock()
     def test_get_auth_method_from_response(self, m):
         url = 'http://example.com/noauth'
@@ -1242,6 +2293,28 @@ class UtilTest(unittest.TestCase):
         seq = (i for i in range(5))
         self.assertEqual(list(chunkify(seq, chunksize=2)), [[0, 1], [2, 3], [4]])
 
+    def test_concurrent_calls(self):
+        started = threading.Event()
+
+        def slow():
+            # Only returns if the other calls run concurrently
+            if not started.wait(5):
+                raise AssertionError('Calls did not run concurrently')
+            return 1
+
+        def fast():
+            started.set()
+            return 2
+
+        def fail():
+            raise ValueError('foo')
+
+        calls = ConcurrentCalls([slow, fast, fail])
+        self.assertEqual(calls.get(0), 1)
+        self.assertEqual(calls.get(1), 2)
+        with self.assertRaises(ValueError):
+            calls.get(2)
+
     def test_peek(self):
         # Test peeking into various sequence types
 
@@ -1317,6 +2390,36 @@ class UtilTest(unittest.TestCase):
             # Not all lxml versions throw an error here, so we can't use assertRaises
             self.assertIn('Offending text: [...]<t:Foo><t:Bar>Baz</t[...]', e.args[0])
 
+    def test_child_index(self):
+        elem = to_xml(
+            b'<t:Foo xmlns:t="%s" Id="X"><t:Bar>1</t:Bar><t:Baz>2</t:Baz><t:Bar>3</t:Bar>'
+            b'<t:Baz><t:Bar>4</t:Bar></t:Baz></t:Foo>' % TNS.encode('ascii')
+        ).getroot()
+        children = ChildIndex(elem)
+        self.assertEqual(children.find('{%s}Bar' % TNS).text, '1')
+        self.assertEqual([e.text for e in children.findall('{%s}Bar' % TNS)], ['1', '3'])
+        self.assertIsNone(children.find('{%s}Qux' % TNS))
+        self.assertEqual(children.findall('{%s}Qux' % TNS), [])
+        # ElementPath expressions are passed on to the element
+        self.assertEqual(children.find('{%s}Baz/{%s}Bar' % (TNS, TNS)).text, '4')
+        self.assertEqual(len(children.findall('.//{%s}Bar' % TNS)), 3)
+        # Other attributes are read from the element
+        self.assertEqual(children.get('Id'), 'X')
+        self.assertEqual(children.tag, '{%s}Foo' % TNS)
+        self.assertEqual(len(children), 4)
+
+    def test_iterparse(self):
+        # Test that incremental parsing uses the same restricted elements as to_xml(), without comments and processing
+        # instructions
+        events = list(iterparse(b'<?xml version="1.0"?><foo><!-- comment --><bar/><?pi baz?></foo>'))
+        self.assertEqual([e.tag for _, e in events], ['bar', 'foo'])
+        self.assertTrue(all(isinstance(e, RestrictedElement) for _, e in events))
+        self.assertEqual(len(events[-1][1]), 1)
+        with self.assertRaises(DTDForbidden):
+            list(iterparse(b'<?xml version="1.0"?><!DOCTYPE foo [<!ENTITY bar "baz">]><foo>&bar;</foo>'))
+        with self.assertRaises(ParseError):
+            list(iterparse(b'foo'))
+
     def test_get_domain(self):
         self.assertEqual(get_domain('foo@example.com'), 'example.com')
         with self.assertRaises(ValueError):
@@ -2296,6 +3399,204 @@ class AccountTest(EWSTest):
             item.delete()
 
 
+class AutodiscoverMockTest(unittest.TestCase):
+    # Autodiscover tests that don't need a test server
+    def setUp(self):
+        # Use a private autodiscover cache file, so tests don't depend on earlier runs
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_autodiscover_storage = exchangelib.autodiscover.AUTODISCOVER_PERSISTENT_STORAGE
+        exchangelib.autodiscover.AUTODISCOVER_PERSISTENT_STORAGE = os.path.join(self.tmp_dir, 'autodiscover.sqlite')
+
+    def tearDown(self):
+        exchangelib.autodiscover._autodiscover_cache._close_connection()
+        exchangelib.autodiscover.AUTODISCOVER_PERSISTENT_STORAGE = self.orig_autodiscover_storage
+        shutil.rmtree(self.tmp_dir)
+
+    def test_autodiscover_cache_locked(self):
+        # Test that the cache file is not deleted when another process holds the write lock for too long
+        from exchangelib.autodiscover import AutodiscoverCache
+        cache = AutodiscoverCache()
+        cache.DB_TIMEOUT = 0.1
+        credentials = Credentials('leet_user', 'cannaguess')
+        cache[('locked.example.com', credentials)] = AutodiscoverProtocol(
+            service_endpoint='https://locked.example.com/Autodiscover/Autodiscover.xml', credentials=credentials,
+            auth_type=NTLM
+        )
+        other_process = sqlite3.connect(exchangelib.autodiscover.AUTODISCOVER_PERSISTENT_STORAGE)
+        try:
+            other_process.execute('BEGIN EXCLUSIVE')
+            with self.assertRaises(sqlite3.OperationalError):
+                del cache[('locked.example.com', credentials)]
+        finally:
+            other_process.close()
+        self.assertIn(('locked.example.com', credentials), cache)
+        cache._close_connection()
+
+    def test_autodiscover_concurrent_probing(self):
+        # Test that all candidate hosts are probed at once, and that candidates are still used in priority order
+        import exchangelib.autodiscover
+        from exchangelib.autodiscover import _try_autodiscover
+        all_probes_started = threading.Event()
+        probed = []
+
+        def _mock_get_auth_type(url, email):
+            probed.append(url)
+            if len(probed) == 3:
+                all_probes_started.set()
+            if url == 'https://example.com/Autodiscover/Autodiscover.xml':
+                # A slow, failing candidate. Only fails after the other candidates have been probed
+                if not all_probes_started.wait(5):
+                    raise AssertionError('Candidates were not probed concurrently')
+                raise AutoDiscoverFailed('Timeout')
+            return NTLM if url.startswith('https') else BASIC
+
+        def _mock_autodiscover_hostname(hostname, credentials, email, has_ssl, auth_type=None):
+            return email, (hostname, has_ssl, auth_type)
+
+        def _mock_dns(hostname):
+            raise AutoDiscoverFailed('No DNS for %s' % hostname)
+
+        _orig = {k: getattr(exchangelib.autodiscover, k) for k in (
+            '_get_auth_type', '_autodiscover_hostname', '_get_canonical_name', '_get_hostname_from_srv'
+        )}
+        exchangelib.autodiscover._get_auth_type = _mock_get_auth_type
+        exchangelib.autodiscover._autodiscover_hostname = _mock_autodiscover_hostname
+        exchangelib.autodiscover._get_canonical_name = _mock_dns
+        exchangelib.autodiscover._get_hostname_from_srv = _mock_dns
+        AutodiscoverProtocol.CONCURRENT_PROBING = True
+        try:
+            self.assertEqual(
+                _try_autodiscover(hostname='example.com', credentials=Credentials('A', 'B'), email='john@example.com'),
+                ('john@example.com', ('autodiscover.example.com', True, NTLM))
+            )
+        finally:
+            AutodiscoverProtocol.CONCURRENT_PROBING = False
+            for k, v in _orig.items():
+                setattr(exchangelib.autodiscover, k, v)
+
+    def test_autodiscover_cache_expiry(self):
+        # Test that entries expire, and that the least recently used protocols are closed when the cache is full
+        from exchangelib.autodiscover import AutodiscoverCache, AUTODISCOVER_LOCK_STRIPES, _get_autodiscover_lock
+        cache = AutodiscoverCache(max_protocols=2)
+        credentials = Credentials('leet_user', 'cannaguess')
+        keys = [('expiry%s.example.com' % i, credentials) for i in range(3)]
+        for domain, _ in keys:
+            cache[(domain, credentials)] = AutodiscoverProtocol(
+                service_endpoint='https://%s/Autodiscover/Autodiscover.xml' % domain, credentials=credentials,
+                auth_type=NTLM
+            )
+        self.assertEqual(list(cache._protocols), keys[1:])
+        cache[keys[1]]  # Mark as recently used
+        self.assertEqual(list(cache._protocols), [keys[2], keys[1]])
+        # The persistent entry still exists
+        self.assertIn(keys[0], cache)
+        self.assertEqual(cache[keys[0]].service_endpoint, 'https://expiry0.example.com/Autodiscover/Autodiscover.xml')
+        self.assertEqual(list(cache._protocols), [keys[1], keys[0]])
+
+        cache.ttl = 0
+        cache[keys[2]] = AutodiscoverProtocol(service_endpoint='https://example.com/Autodiscover/Autodiscover.xml',
+                                              credentials=credentials, auth_type=NTLM)
+        self.assertNotIn(keys[2], cache)
+        closed = []
+        expired_protocol = cache._protocols[keys[2]]
+        expired_protocol.close = lambda: closed.append(keys[2])
+        with self.assertRaises(KeyError):
+            cache[keys[2]]
+        # The expired protocol is closed when it is dropped from the in-memory cache
+        self.assertNotIn(keys[2], cache._protocols)
+        self.assertEqual(closed, [keys[2]])
+        for key in keys:
+            del cache[key]
+        cache.close()
+
+        # A key always gets the same lock, and the number of locks is bounded
+        self.assertIs(_get_autodiscover_lock(keys[0]), _get_autodiscover_lock(keys[0]))
+        locks = {_get_autodiscover_lock(('lock%s.example.com' % i, credentials)) for i in range(1000)}
+        self.assertLessEqual(len(locks), AUTODISCOVER_LOCK_STRIPES)
+
+
+    @requests_mock.mock()
+    def test_discover_many(self, m):
+        # Test that addresses are looked up in batches with GetUserSettings, and that addresses that are redirected
+        # are looked up with discover().
+        import exchangelib.autodiscover
+        from exchangelib.autodiscover import discover_many
+        soap_url = 'https://many.example.com/autodiscover/autodiscover.svc'
+        ews_url = 'https://many.example.com/EWS/Many.asmx'
+        requested = []
+
+        def user_response(email):
+            if email.startswith('nobody'):
+                return '<UserResponse><ErrorCode>InvalidUser</ErrorCode><ErrorMessage>Invalid user</ErrorMessage>' \
+                       '</UserResponse>'
+            if email.startswith('redirect'):
+                return '<UserResponse><ErrorCode>RedirectAddress</ErrorCode><RedirectTarget>john@example.com' \
+                       '</RedirectTarget></UserResponse>'
+            settings = [('ExternalEwsUrl', ews_url), ('CasVersion', '15.01.2044.004')]
+            if email.startswith('alias'):
+                settings.append(('AutoDiscoverSMTPAddress', 'primary@many.example.com'))
+            return '<UserResponse><ErrorCode>NoError</ErrorCode><UserSettings>%s</UserSettings></UserResponse>' \
+                % ''.join('<UserSetting><Name>%s</Name><Value>%s</Value></UserSetting>' % s for s in settings)
+
+        def response(request, context):
+            if 'Authorization' not in request.headers:
+                context.status_code = 401
+                context.headers['WWW-Authenticate'] = 'Basic realm="foo"'
+                return ''
+            emails = re.findall(r'<a:Mailbox>([^<]+)</a:Mailbox>', request.body.decode('utf-8'))
+            requested.append(emails)
+            return '''\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <GetUserSettingsResponseMessage xmlns="http://schemas.microsoft.com/exchange/2010/Autodiscover">
+      <Response>
+        <ErrorCode>NoError</ErrorCode>
+        <UserResponses>%s</UserResponses>
+      </Response>
+    </GetUserSettingsResponseMessage>
+  </s:Body>
+</s:Envelope>''' % ''.join(user_response(e) for e in emails)
+
+        m.head(soap_url, status_code=200)
+        m.post(soap_url, text=response)
+        m.post(ews_url, status_code=401, headers={'WWW-Authenticate': 'Basic realm="foo"'})
+        _orig = exchangelib.autodiscover.discover, exchangelib.autodiscover.GET_USER_SETTINGS_MAX_USERS
+        exchangelib.autodiscover.discover = lambda email, credentials: ('john@example.com', None)
+        exchangelib.autodiscover.GET_USER_SETTINGS_MAX_USERS = 2
+        try:
+            emails = ['%s@many.example.com' % e for e in ('anne', 'alias', 'nobody', 'redirect', 'bob')]
+            res = discover_many(emails=emails, credentials=Credentials('leet_user', 'cannaguess'))
+        finally:
+            exchangelib.autodiscover.discover, exchangelib.autodiscover.GET_USER_SETTINGS_MAX_USERS = _orig
+        self.assertEqual(sorted(requested), sorted([emails[0:2], emails[2:4], emails[4:]]))
+        self.assertEqual(len(res), len(emails))
+        self.assertEqual(res[0][0], 'anne@many.example.com')
+        self.assertEqual(res[0][1].service_endpoint, ews_url)
+        self.assertEqual(res[0][1].version.build, Build(15, 1, 2044, 4))
+        self.assertEqual(res[1][0], 'primary@many.example.com')
+        self.assertIsInstance(res[2], ErrorNonExistentMailbox)
+        self.assertEqual(res[3], ('john@example.com', None))
+        self.assertEqual(res[4][0], 'bob@many.example.com')
+
+    @requests_mock.mock()
+    def test_discover_batch_errors(self, m):
+        # Test that addresses are looked up with discover() if the GetUserSettings request fails, and that the session
+        # is returned to the pool.
+        from exchangelib.autodiscover import _discover_batch
+        soap_url = 'https://many.example.com/autodiscover/autodiscover.svc'
+        protocol = AutodiscoverProtocol(service_endpoint=soap_url, credentials=Credentials('leet_user', 'cannaguess'),
+                                        auth_type=NOAUTH)
+        emails = ['anne@many.example.com', 'bob@many.example.com']
+        for kwargs in (
+                dict(status_code=500, text='Internal error'),  # Raises TransportError
+                dict(status_code=200, text='<?xml version="1.0" encoding="utf-8"?>'),  # Raises ParseError
+        ):
+            m.post(soap_url, **kwargs)
+            res = _discover_batch(protocol=protocol, emails=emails, credentials=protocol.credentials)
+            self.assertEqual(res, {email: None for email in emails})
+            self.assertEqual(protocol._session_pool.qsize(), protocol._session_count)
+
 class AutodiscoverTest(EWSTest):
     def test_magic(self):
         # Just test we don't fail
@@ -6137,9 +7438,13 @@ def get_random_datetime_range(start_date=EWSDate(1996, 1, 1), end_date=EWSDate(2
     ])
 
 
-if __name__ == '__main__':
-    import sys
+if sys.version_info >= (3, 6) and __name__ != '__main__':
+    # The asyncio tests use syntax that older Python versions can't parse, so only import them where it's supported.
+    # Relative imports are not possible when this file is run as a script.
+    from .test_aio import AsyncTest  # noqa
+
 
+if __name__ == '__main__':
     if '-q' in sys.argv:
         sys.argv.remove('-q')
         logging.basicConfig(level=logging.WARNING)
@@ -0,0 +1,145 @@
+# coding=utf-8
+# Tests of the asyncio support. This module uses syntax that is not available before Python 3.6, so it's only imported
+# by tests/__init__.py on Python versions where exchangelib.aio is available.
+import asyncio
+from collections import namedtuple
+import gc
+import os
+import random
+import unittest
+import weakref
+
+import requests.adapters
+import requests_mock
+
+from exchangelib.aio import AiohttpSession, AsyncProtocol, AsyncServiceMixIn, ExecutorSession, aiohttp, \
+    async_service, post_ratelimited as async_post_ratelimited
+from exchangelib.credentials import Credentials
+from exchangelib.errors import UnauthorizedError
+from exchangelib.protocol import BaseProtocol, CachingProtocol, NoVerifyHTTPAdapter, Protocol
+from exchangelib.services import GetItem
+from exchangelib.transport import BASIC, NTLM
+from exchangelib.version import Build, Version, EXCHANGE_2010
+
+from . import mock_account, mock_version
+
+
+class AsyncTest(unittest.TestCase):
+    @staticmethod
+    def run_coro(coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    @requests_mock.mock()
+    def test_post_ratelimited(self, m):
+        url = 'https://example.com/EWS/Exchange.asmx'
+        m.get('https://example.com/EWS/types.xsd', status_code=200)
+        protocol = Protocol(service_endpoint=url, credentials=Credentials('A', 'B'), auth_type=NTLM,
+                            version=Version(Build(15, 1)))
+        aprotocol = AsyncProtocol.from_protocol(protocol)
+        self.assertEqual(id(aprotocol), id(AsyncProtocol.from_protocol(protocol)))
+
+        async def post():
+            session = await aprotocol.get_session()
+            r, session = await async_post_ratelimited(protocol=aprotocol, session=session, url=url, headers=None,
+                                                      data='')
+            await aprotocol.release_session(session)
+            return r
+
+        m.post(url, status_code=200, content=b'<?xml version="1.0" encoding="utf-8"?><foo>bar</foo>')
+        r = self.run_coro(post())
+        self.assertEqual(r.status_code, 200)
+        m.post(url, status_code=401)
+        with self.assertRaises(UnauthorizedError):
+            self.run_coro(post())
+
+    def test_async_protocol_lifetime(self):
+        # Test that the async protocol doesn't keep a protocol alive after it has been evicted from the protocol cache
+        url = 'https://example.com/EWS/Lifetime.asmx'
+        protocol = Protocol(service_endpoint=url, credentials=Credentials('A', 'B'), auth_type=NTLM,
+                            version=Version(Build(15, 1)))
+        self.assertIs(AsyncProtocol.from_protocol(protocol), AsyncProtocol.from_protocol(protocol))
+        protocol_ref = weakref.ref(protocol)
+        aprotocol_ref = weakref.ref(AsyncProtocol.from_protocol(protocol))
+        CachingProtocol._protocol_cache.pop((url, Credentials('A', 'B')))
+        del protocol
+        gc.collect()
+        self.assertIsNone(protocol_ref())
+        self.assertIsNone(aprotocol_ref())
+
+    def test_new_event_loop(self):
+        # Test that pooled sessions of a previous event loop are closed when the protocol is used on a new loop
+        url = 'https://example.com/EWS/Loops.asmx'
+        protocol = Protocol(service_endpoint=url, credentials=Credentials('A', 'B'), auth_type=NTLM,
+                            version=Version(Build(15, 1)))
+        aprotocol = AsyncProtocol.from_protocol(protocol)
+
+        async def get_and_release():
+            session = await aprotocol.get_session()
+            await aprotocol.release_session(session)
+            return session
+
+        session = self.run_coro(get_and_release())
+        closed = []
+        session.close_nowait = lambda: closed.append(session)
+        self.assertIsNot(self.run_coro(get_and_release()), session)
+        self.assertEqual(closed, [session])
+        self.assertEqual(aprotocol._session_count, 1)
+
+        # aiohttp sessions can't be closed on another event loop
+        aprotocol = AsyncProtocol(protocol)
+        aiohttp_session = AiohttpSession.__new__(AiohttpSession)
+        aiohttp_session.session_id = 123
+        aprotocol.create_session = lambda: aiohttp_session
+        self.run_coro(get_and_release())
+        with self.assertRaises(RuntimeError):
+            self.run_coro(get_and_release())
+
+    def test_aiohttp_settings(self):
+        # Test that aiohttp is only used if it can use the same TLS settings as 'requests'
+        url = 'https://example.com/EWS/Settings.asmx'
+        protocol = Protocol(service_endpoint=url, credentials=Credentials('A', 'B'), auth_type=BASIC,
+                            version=Version(Build(15, 1)))
+        aprotocol = AsyncProtocol.from_protocol(protocol)
+        self.assertEqual(aprotocol.supports_aiohttp, aiohttp is not None)
+        try:
+            BaseProtocol.HTTP_ADAPTER_CLS = NoVerifyHTTPAdapter
+            self.assertFalse(aprotocol.supports_aiohttp)
+            self.assertIsInstance(aprotocol.create_session(), ExecutorSession)
+        finally:
+            BaseProtocol.HTTP_ADAPTER_CLS = requests.adapters.HTTPAdapter
+        # The CA bundle of 'requests' is used
+        ca_bundle = os.environ.get('REQUESTS_CA_BUNDLE')
+        try:
+            os.environ['REQUESTS_CA_BUNDLE'] = '/no/such/ca/bundle.pem'
+            with self.assertRaises(IOError):
+                AiohttpSession.get_ssl_context(protocol)
+        finally:
+            if ca_bundle is None:
+                del os.environ['REQUESTS_CA_BUNDLE']
+            else:
+                os.environ['REQUESTS_CA_BUNDLE'] = ca_bundle
+        self.assertIsNotNone(AiohttpSession.get_ssl_context(protocol))
+
+    def test_pool_requests_ordering(self):
+        self.assertEqual(async_service(GetItem), async_service(GetItem))
+        self.assertTrue(issubclass(async_service(GetItem), AsyncServiceMixIn))
+
+        class MockService(AsyncServiceMixIn, GetItem):
+            async def _get_elements(self, payload):
+                # Make chunks finish out of order
+                await asyncio.sleep(random.random() / 100)
+                return payload
+
+        async def consume(service):
+            return [i async for i in service._pool_requests(payload_func=lambda chunk: chunk, items=range(20))]
+
+        pool_protocol = namedtuple('pool_protocol', ('version', 'service_endpoint', 'session_pool_size'))
+        version = mock_version(build=EXCHANGE_2010)
+        account = mock_account(version=version, protocol=pool_protocol(
+            version=version, service_endpoint='example.com', session_pool_size=1
+        ))
+        self.assertEqual(self.run_coro(consume(MockService(account=account, chunk_size=3))), list(range(20)))